@@ -0,0 +1,208 @@
+"""
+Copyright 2020, All rights reserved.
+Author : SangJae Kang
+Mail : craftsangjae@gmail.com
+
+benchmark용 mock github API server (graphQL / REST repository endpoint)
+"""
+import math
+import time
+import zlib
+import random
+import base64
+import asyncio
+from datetime import datetime, timezone
+from aiohttp import web
+
+# 리파짓토리 하나 당 connection 수 (watchers, stargazers, ... languages, repositoryTopics)
+CONNECTIONS_PER_REPOSITORY = 9
+
+
+class MockGithub(object):
+    """
+    실제 github API처럼 동작하는 mock server
+
+    * POST /graphql : 단건 / 배치(r0, r1, ...) / nodes(ids: [...]) / rateLimit(dryRun) Query에 응답
+    * GET /repositories/{id} : REST 리파짓토리 조회
+
+    키(Authorization 헤더) 별로 window초 동안 limit point를 쓸 수 있고, 요청마다 cost만큼 차감
+    (cost는 실제 github처럼 요청한 connection 수 / 100, 최소 1). 할당량이 부족하면 RATE_LIMITED 에러로 응답
+
+    Arguments
+        latency: 응답 latency(초)의 평균
+        jitter: latency의 표준편차 비율 (latency * jitter)
+        error_rate: 502로 응답하는 비율
+        abuse_rate: secondary rate limit(403)으로 응답하는 비율
+        max_concurrent: 동시에 처리 중인 요청이 이보다 많으면 403 (None이면 제한 없음)
+        not_found_rate: 없는 리파짓토리(NOT_FOUND)로 응답하는 비율
+        limit: 키 별 window 당 할당량(point)
+        window: 할당량이 다시 채워지는 주기(초)
+        seed: random seed
+
+    """
+    def __init__(self,
+                 latency=0.05,
+                 jitter=0.2,
+                 error_rate=0.,
+                 abuse_rate=0.,
+                 max_concurrent=None,
+                 not_found_rate=0.,
+                 limit=5000,
+                 window=3600.,
+                 seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.abuse_rate = abuse_rate
+        self.max_concurrent = max_concurrent
+        self.not_found_rate = not_found_rate
+        self.limit = limit
+        self.window = window
+        self.random = random.Random(seed)
+
+        # 키 -> (남은 할당량, resetAt(epoch))
+        self.quotas = {}
+        self.inflight = 0
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post("/graphql", self.handle_graphql)
+        app.router.add_get("/repositories/{repo_id}", self.handle_repository)
+        return app
+
+    def run(self, host="127.0.0.1", port=8900):
+        web.run_app(self.make_app(), host=host, port=port, print=None)
+
+    async def delay(self):
+        latency = max(self.random.gauss(self.latency, self.latency * self.jitter), 0.)
+        await asyncio.sleep(latency)
+
+    def quota(self, key):
+        now = time.time()
+        remain, reset_at = self.quotas.get(key, (self.limit, now + self.window))
+        if reset_at <= now:
+            remain, reset_at = self.limit, now + self.window
+        return remain, reset_at
+
+    def charge(self, key, cost, dry_run=False):
+        """ 할당량에서 cost만큼 차감하고 rateLimit 필드 반환 (부족하면 None)
+        """
+        remain, reset_at = self.quota(key)
+        if remain < cost:
+            self.quotas[key] = (remain, reset_at)
+            return None
+        if not dry_run:
+            remain -= cost
+        self.quotas[key] = (remain, reset_at)
+        return {"limit": self.limit, "cost": cost, "remaining": remain,
+                "resetAt": datetime.fromtimestamp(reset_at, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")}
+
+    @staticmethod
+    def repository(repo_id, owner, name):
+        node_id = base64.b64encode(f"010:Repository{repo_id}".encode('utf8')).decode('utf8')
+        return {
+            "id": node_id, "name": name, "owner": {"login": owner},
+            "homepageUrl": f"https://{owner}.github.io/{name}",
+            "openGraphImageUrl": f"https://opengraph.githubassets.com/{repo_id}",
+            "createdAt": "2015-03-01T00:00:00Z", "updatedAt": "2020-03-01T00:00:00Z",
+            "pushedAt": "2020-03-01T00:00:00Z",
+            "description": f"mock repository {owner}/{name}", "diskUsage": repo_id % 100000,
+            "forkCount": repo_id % 1000, "hasWikiEnabled": True, "hasIssuesEnabled": True,
+            "hasProjectsEnabled": False, "isFork": False, "isArchived": False, "isDisabled": False,
+            "isEmpty": False, "isLocked": False, "isMirror": False, "isPrivate": False,
+            "isTemplate": False, "mergeCommitAllowed": True,
+            "watchers": {"totalCount": repo_id % 500}, "stargazers": {"totalCount": repo_id % 5000},
+            "commitComments": {"totalCount": 3}, "pullRequests": {"totalCount": 42},
+            "releases": {"totalCount": 7}, "primaryLanguage": {"name": "Python"},
+            "languages": {"nodes": [{"name": "Python"}, {"name": "Shell"}, {"name": "Dockerfile"}]},
+            "labels": {"totalCount": 9}, "licenseInfo": {"name": "MIT License"},
+            "deployments": {"totalCount": 0},
+            "repositoryTopics": {"nodes": [{"topic": {"name": "crawler"}}, {"topic": {"name": "github"}}]},
+        }
+
+    @staticmethod
+    def repo_id(owner, name):
+        return zlib.crc32(f"{owner}/{name}".encode('utf8')) % 10 ** 9
+
+    def lookup(self, owner, name):
+        """ 리파짓토리 조회 (not_found_rate 비율로 없는 리파짓토리)
+        """
+        if self.random.random() < self.not_found_rate:
+            return None
+        return self.repository(self.repo_id(owner, name), owner, name)
+
+    async def handle_graphql(self, request):
+        self.inflight += 1
+        try:
+            await self.delay()
+            key = request.headers.get("Authorization", "")
+            body = await request.json()
+            if self.max_concurrent is not None and self.inflight > self.max_concurrent \
+                    or self.random.random() < self.abuse_rate:
+                return web.json_response(
+                    {"message": "You have exceeded a secondary rate limit."}, status=403)
+            if self.random.random() < self.error_rate:
+                return web.Response(text="Bad Gateway", status=502)
+            return web.json_response(self.resolve(key, body.get("query", ""), body.get("variables") or {}))
+        finally:
+            self.inflight -= 1
+
+    def resolve(self, key, query, variables):
+        """ graphQL Query 모양에 따라 응답 만들기
+        """
+        if "nodes(ids" in query:
+            targets = [("nodes", i, node_id) for i, node_id in enumerate(variables.get("ids", []))]
+        elif "owner0" in variables:
+            size = sum(1 for k in variables if k.startswith("owner"))
+            targets = [(f"r{i}", None, (variables[f"owner{i}"], variables[f"name{i}"])) for i in range(size)]
+        elif "owner" in variables:
+            targets = [("repository", None, (variables["owner"], variables["name"]))]
+        else:
+            # rateLimit(dryRun:true)
+            return {"data": {"rateLimit": self.charge(key, 1, dry_run=True)}}
+
+        cost = max(int(math.ceil(len(targets) * CONNECTIONS_PER_REPOSITORY / 100)), 1)
+        rate_limit = self.charge(key, cost)
+        if rate_limit is None:
+            return {"data": None,
+                    "errors": [{"type": "RATE_LIMITED", "message": "API rate limit exceeded"}]}
+
+        data, errors, nodes = {"rateLimit": rate_limit}, [], []
+        for alias, index, target in targets:
+            if alias == "nodes":
+                try:
+                    repo_id = int(base64.b64decode(target).decode('utf8').split("Repository")[-1])
+                    repository = None if self.random.random() < self.not_found_rate \
+                        else self.repository(repo_id, f"owner{repo_id % 1000}", f"repo{repo_id}")
+                except ValueError:
+                    repository = None
+                nodes.append(repository)
+                path = ["nodes", index]
+            else:
+                repository = self.lookup(*target)
+                data[alias] = repository
+                path = [alias]
+            if repository is None:
+                errors.append({"type": "NOT_FOUND", "path": path,
+                               "message": f"Could not resolve to a Repository {target}"})
+        if nodes:
+            data["nodes"] = nodes
+
+        response = {"data": data}
+        if errors:
+            response["errors"] = errors
+        return response
+
+    async def handle_repository(self, request):
+        await self.delay()
+        repo_id = int(request.match_info["repo_id"])
+        if self.random.random() < self.not_found_rate:
+            return web.json_response({"message": "Not Found"}, status=404)
+        return web.json_response({"id": repo_id, "name": f"repo{repo_id}",
+                                  "owner": {"login": f"owner{repo_id % 1000}"}})
+
+
+def serve(port, host="127.0.0.1", **kwargs):
+    """ mock server 실행 (benchmark에서 별도 프로세스로 띄움)
+    """
+    MockGithub(**kwargs).run(host=host, port=port)
@@ -0,0 +1,295 @@
+"""
+Copyright 2020, All rights reserved.
+Author : SangJae Kang
+Mail : craftsangjae@gmail.com
+
+mock github server를 상대로 RepositoryCrawler 전체 pipeline의 처리량을 측정하는 benchmark
+
+    $ python -m benchmarks.run                        # 외부 서비스 없이 돌아가는 scenario 전체
+    $ python -m benchmarks.run batch-memory abuse-adaptive --repos 20000
+    $ python -m benchmarks.run redis-mongo --redis-host localhost --mongo-uri mongodb://localhost:27017/
+    $ python -m benchmarks.run --list
+
+scenario 별로 repos/sec, 리파짓토리 당 latency(브로커에서 꺼낸 후 저장되기까지) p50/p99,
+리파짓토리 당 CPU 시간(crawler 프로세스 기준, mock server는 별도 프로세스)을 출력한다.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import multiprocessing
+from collections import deque, OrderedDict
+from benchmarks.mock_github import serve
+
+# scenario 구성
+# keys : local(GithubKeyGen) / redis(RedisGithubKeyGen)
+# broker : memory / redis / redis-reliable / redis-stream / redis-priority
+# database : memory / file / file-gzip / parquet / mongo
+# messages : name(owner/name 메시지) / id(리파짓토리 id 메시지)
+# server : mock server 설정 (MockGithub 인자)
+SCENARIOS = OrderedDict([
+    ("single-memory", dict(keys="local", broker="memory", database="memory", batch_size=1)),
+    ("batch-memory", dict(keys="local", broker="memory", database="memory", batch_size=50)),
+    ("nodes-memory", dict(keys="local", broker="memory", database="memory", messages="id")),
+    ("batch-file", dict(keys="local", broker="memory", database="file", batch_size=50)),
+    ("batch-file-gzip", dict(keys="local", broker="memory", database="file-gzip", batch_size=50)),
+    ("batch-parquet", dict(keys="local", broker="memory", database="parquet", batch_size=50)),
+    ("abuse-adaptive", dict(keys="local", broker="memory", database="memory", batch_size=10, adaptive=True,
+                            server=dict(error_rate=0.02, max_concurrent=40))),
+    # 할당량 window를 60초로 줄여 planner의 pacing이 동작하도록 함
+    # (GithubKeyGen은 키의 limit을 최소 5000으로 보므로 limit은 줄이지 않음)
+    ("budget-planner", dict(keys="local", broker="memory", database="memory", batch_size=50, planner=True,
+                            server=dict(window=60.))),
+    ("redis-memory", dict(keys="redis", broker="redis-reliable", database="memory", batch_size=50)),
+    ("redis-stream", dict(keys="redis", broker="redis-stream", database="memory", batch_size=50)),
+    ("redis-priority", dict(keys="redis", broker="redis-priority", database="memory", batch_size=50)),
+    ("redis-mongo", dict(keys="redis", broker="redis-reliable", database="mongo", batch_size=50)),
+])
+
+# redis / mongo가 필요한 scenario (기본 실행에서 제외)
+EXTERNAL = {"redis", "redis-reliable", "redis-stream", "redis-priority", "mongo"}
+
+
+def needs_external(scenario):
+    return bool({scenario["keys"], scenario["broker"], scenario["database"]} & EXTERNAL)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_mock_server(port, **kwargs):
+    """ mock github server를 별도 프로세스로 띄우고, 접속할 수 있을 때까지 기다리기
+    """
+    process = multiprocessing.Process(target=serve, args=(port,), kwargs=kwargs, daemon=True)
+    process.start()
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.terminate()
+    raise IOError(f"mock github server is not ready on port {port}")
+
+
+def percentile(values, q):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+def make_messages(kind, n):
+    if kind == "id":
+        return [{"id": i + 1} for i in range(n)]
+    return [{"owner": f"owner{i % 1000}", "name": f"repo{i}"} for i in range(n)]
+
+
+def run_scenario(name, scenario, args):
+    """ scenario 하나를 실행하고 결과 반환
+    (GITHUB_URL이 정해진 후에 service 모듈을 import 해야 하므로 함수 안에서 import)
+    """
+    from service.consumer import BaseConsumer, RedisQueue, RedisStreamQueue, RedisPriorityQueue
+    from service.database import BaseDatabase, FileSystemDatabase, ParquetDatabase, MongoDatabase
+    from service.github import GithubKeyGen, RedisGithubKeyGen
+    from service.limiter import AdaptiveLimiter
+    from service.planner import BudgetPlanner
+    from service.retry import RetryPolicy
+    from service.worker import RepositoryCrawler
+
+    class MemoryQueue(BaseConsumer):
+        """ 프로세스 안에서만 쓰는 브로커 """
+        def __init__(self):
+            self.queue = deque()
+
+        def deleteAll(self):
+            self.queue.clear()
+
+        def isEmpty(self):
+            return not self.queue
+
+        def put(self, elem):
+            self.queue.append(elem)
+
+        def get(self):
+            return self.queue.popleft() if self.queue else None
+
+        def __len__(self):
+            return len(self.queue)
+
+    class MemoryDatabase(BaseDatabase):
+        """ document 수만 세는 데이터베이스 """
+        def __init__(self):
+            self.count = 0
+
+        async def put(self, document):
+            self.count += 1
+
+    class BenchmarkCrawler(RepositoryCrawler):
+        """ 메시지 별로 브로커에서 꺼낸 시각부터 처리가 끝난 시각까지의 latency를 기록 """
+        def __init__(self, *a, **kw):
+            super().__init__(*a, **kw)
+            self.dispatched = {}
+            self.samples = []
+
+        def dispatch(self, messages):
+            now = time.monotonic()
+            for message in messages:
+                self.dispatched[id(message)] = now
+            return super().dispatch(messages)
+
+        async def ack(self, message, document=None):
+            started = self.dispatched.pop(id(message), None)
+            if started is not None:
+                self.samples.append(time.monotonic() - started)
+            await super().ack(message, document)
+
+        def finished(self):
+            """ 처리가 끝난 (저장 / dead-letter / 버림) 메시지 수 """
+            return self.stats['success'] + self.stats['dead'] + self.stats['dropped']
+
+    workdir = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    key_path = os.path.join(workdir, "github.txt")
+    with open(key_path, "w") as f:
+        f.write("\n".join(f"bench-key-{i}" for i in range(args.keys)) + "\n")
+
+    namespace = f"bench:{name}:{os.getpid()}"
+    if scenario["keys"] == "redis":
+        githubkey = RedisGithubKeyGen(key_path, namespace=f"{namespace}:githubkey", host=args.redis_host)
+    else:
+        githubkey = GithubKeyGen(key_path)
+
+    if scenario["broker"] == "memory":
+        broker = MemoryQueue()
+    elif scenario["broker"] == "redis-stream":
+        broker = RedisStreamQueue(f"{namespace}:repository", host=args.redis_host, consumer="bench")
+        broker.deleteAll()
+    elif scenario["broker"] == "redis-priority":
+        broker = RedisPriorityQueue(f"{namespace}:repository", host=args.redis_host)
+        broker.deleteAll()
+    else:
+        broker = RedisQueue(f"{namespace}:repository", host=args.redis_host,
+                            reliable=scenario["broker"] == "redis-reliable", consumer="bench")
+        broker.deleteAll()
+
+    database = scenario["database"]
+    if database == "memory":
+        database = MemoryDatabase()
+    elif database in ("file", "file-gzip"):
+        database = FileSystemDatabase(os.path.join(workdir, "repository.jsonl"),
+                                      compression="gzip" if database == "file-gzip" else None)
+    elif database == "parquet":
+        database = ParquetDatabase(os.path.join(workdir, "parquet"))
+    else:
+        database = MongoDatabase(namespace.replace(":", "_"), uri=args.mongo_uri, bulk_size=100)
+
+    limiter = AdaptiveLimiter(initial_limit=min(20, args.concurrency), max_limit=args.concurrency) \
+        if scenario.get("adaptive") else None
+    planner = BudgetPlanner(githubkey, window=scenario.get("server", {}).get("window", 3600.)) \
+        if scenario.get("planner") else None
+    crawler = BenchmarkCrawler(broker, database, githubkey,
+                               num_concurrent=args.concurrency,
+                               batch_size=scenario.get("batch_size", 1),
+                               sleep=0.1,
+                               limiter=limiter,
+                               planner=planner,
+                               retry_policy=RetryPolicy(max_attempts=args.max_attempts,
+                                                        base_delay=0.1, quota_delay=1.))
+    broker.put_many(make_messages(scenario.get("messages", "name"), args.repos))
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    async def watch():
+        deadline = time.monotonic() + args.timeout
+        while crawler.finished() < args.repos and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        crawler.stop()
+
+    started, cpu_started = time.monotonic(), time.process_time()
+    try:
+        loop.run_until_complete(asyncio.gather(crawler.crawl_concurrent(), watch()))
+        elapsed, cpu = time.monotonic() - started, time.process_time() - cpu_started
+    finally:
+        if not isinstance(broker, MemoryQueue):
+            broker.deleteAll()
+        if isinstance(githubkey, RedisGithubKeyGen):
+            githubkey.rq.delete(*githubkey.redis_keys)
+        if isinstance(database, MongoDatabase):
+            loop.run_until_complete(database.deleteAll())
+        loop.run_until_complete(crawler.close())
+        loop.close()
+
+    success = crawler.stats['success']
+    return OrderedDict([
+        ("scenario", name),
+        ("repos", args.repos),
+        ("success", success),
+        ("seconds", round(elapsed, 3)),
+        ("repos_per_sec", round(success / elapsed, 1) if elapsed else 0.),
+        ("p50_ms", round(percentile(crawler.samples, 0.5) * 1000, 1)),
+        ("p99_ms", round(percentile(crawler.samples, 0.99) * 1000, 1)),
+        ("cpu_ms_per_repo", round(cpu * 1000 / max(success, 1), 3)),
+        ("retry", crawler.stats['retry']),
+        ("dead", crawler.stats['dead']),
+        ("overloaded", crawler.stats['overloaded']),
+    ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="RepositoryCrawler end-to-end benchmark")
+    parser.add_argument("scenarios", nargs="*", help="실행할 scenario (기본 : redis / mongo가 필요 없는 scenario 전체)")
+    parser.add_argument("--list", action="store_true", help="scenario 목록 출력")
+    parser.add_argument("--repos", type=int, default=5000, help="scenario 당 crawl할 리파짓토리 수")
+    parser.add_argument("--concurrency", type=int, default=100, help="동시 IO 수 (num_concurrent)")
+    parser.add_argument("--keys", type=int, default=4, help="github key 수")
+    parser.add_argument("--latency", type=float, default=0.05, help="mock server의 평균 응답 latency(초)")
+    parser.add_argument("--max-attempts", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=600., help="scenario 당 최대 실행 시간(초)")
+    parser.add_argument("--redis-host", default="localhost")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/")
+    parser.add_argument("--output", help="결과를 JSON Lines로 덧붙일 파일 (regression 비교용)")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, scenario in SCENARIOS.items():
+            print(f"{name:20s} {json.dumps(scenario)}")
+        return
+
+    names = args.scenarios or [name for name, scenario in SCENARIOS.items() if not needs_external(scenario)]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario : {', '.join(unknown)}")
+
+    results = []
+    for name in names:
+        scenario = SCENARIOS[name]
+        port = free_port()
+        server = start_mock_server(port, latency=args.latency, seed=0, **scenario.get("server", {}))
+        os.environ["GITHUB_URL"] = f"http://127.0.0.1:{port}"
+        # 이전 scenario에서 import한 URL을 쓰지 않도록 service 모듈을 다시 import
+        for module in [module for module in sys.modules if module == "service" or module.startswith("service.")]:
+            del sys.modules[module]
+        try:
+            result = run_scenario(name, scenario, args)
+        finally:
+            server.terminate()
+            server.join()
+        results.append(result)
+        print("  ".join(f"{k}={v}" for k, v in result.items()), flush=True)
+
+    if args.output:
+        with open(args.output, "a") as f:
+            for result in results:
+                f.write(json.dumps(dict(result, timestamp=time.time())) + "\n")
+
+
+if __name__ == "__main__":
+    main()
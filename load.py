@@ -0,0 +1,82 @@
+"""
+Copyright 2020, All rights reserved.
+Author : SangJae Kang
+Mail : craftsangjae@gmail.com
+
+seed 파일(JSON Lines, gzip 가능)의 리파짓토리들을 브로커에 담는 CLI
+
+    $ python load.py seeds.jsonl.gz --checkpoint seeds.offset
+    $ python load.py seeds.jsonl.gz --checkpoint seeds.offset --resume      # 중단된 위치부터 다시
+    $ python load.py seeds.jsonl --skip-crawled 86400 --check-database
+"""
+import os
+import argparse
+import asyncio
+from service.consumer import RedisQueue, RedisStreamQueue, RedisPriorityQueue
+from service.database import MongoDatabase
+from service.dedup import FreshnessFilter
+from service.loader import SeedLoader
+
+BROKER_HOST = os.environ.get("REPO_HOST", "redis")
+DATABASE_HOST = os.environ.get("MONGO_HOST", "mongodb://mongo:27017/")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="seed 파일의 리파짓토리들을 브로커에 담기")
+    parser.add_argument("path", help="seed 파일 ({\"owner\": ..., \"name\": ...} 혹은 {\"id\": ...} 한 줄에 하나, .gz 가능)")
+    parser.add_argument("--topic", default="repository", help="브로커 topic")
+    parser.add_argument("--broker", choices=["list", "stream", "priority"], default="list",
+                        help="브로커 종류 (crawler의 BROKER_TYPE과 같게)")
+    parser.add_argument("--batch-size", type=int, default=10000, help="한 번에 담는 메시지 수")
+    parser.add_argument("--expected", type=int, default=10000000,
+                        help="seed 수 (중복 확인용 bloom filter 크기, 넘으면 오탐이 늘어남)")
+    parser.add_argument("--bloom-only", action="store_true",
+                        help="bloom filter의 중복을 redis set({topic}:seeds, load를 마치면 지움)에서 "
+                             "다시 확인하지 않음 (오탐만큼 seed를 잃음)")
+    parser.add_argument("--skip-crawled", type=float, default=0, metavar="FRESHNESS",
+                        help="최근 FRESHNESS초 안에 crawl한 리파짓토리는 건너뜀 (0이면 확인하지 않음)")
+    parser.add_argument("--check-database", action="store_true",
+                        help="이미 데이터베이스에 저장된 리파짓토리(id 메시지)는 건너뜀")
+    parser.add_argument("--checkpoint", help="담은 위치(byte offset)를 기록할 파일")
+    parser.add_argument("--resume", action="store_true", help="checkpoint에 기록된 위치부터 다시 load")
+    parser.add_argument("--offset", type=int, default=0, help="이 위치(압축을 푼 기준 byte)부터 load")
+    parser.add_argument("--report-interval", type=float, default=10., help="진행 상황을 출력하는 주기(초)")
+    args = parser.parse_args(argv)
+
+    dedup = FreshnessFilter(args.skip_crawled, host=BROKER_HOST) if args.skip_crawled > 0 else None
+    database = MongoDatabase(args.topic, uri=DATABASE_HOST) if args.check_database else None
+    if args.broker == "stream":
+        broker = RedisStreamQueue(args.topic, host=BROKER_HOST)
+    elif args.broker == "priority":
+        # 이미 저장된 리파짓토리는 저장된 document로 순서를 정함 (--check-database와 함께 쓰면 건너뜀)
+        broker = RedisPriorityQueue(args.topic, host=BROKER_HOST,
+                                    database=MongoDatabase(args.topic, uri=DATABASE_HOST))
+    else:
+        broker = RedisQueue(args.topic, host=BROKER_HOST)
+    loader = SeedLoader(broker,
+                        batch_size=args.batch_size,
+                        dedup=dedup,
+                        database=database,
+                        capacity=args.expected,
+                        checkpoint=args.checkpoint,
+                        report_interval=args.report_interval,
+                        topic=f"{args.topic}:seeds",
+                        **({} if args.bloom_only else {"host": BROKER_HOST}))
+    offset = loader.resume_offset() if args.resume else args.offset
+
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(loader.load(args.path, offset=offset))
+    finally:
+        loop.run_until_complete(broker.close())
+        loop.run_until_complete(loader.close())
+        if dedup is not None:
+            loop.run_until_complete(dedup.close())
+        if database is not None:
+            loop.run_until_complete(database.close())
+        if isinstance(broker, RedisPriorityQueue):
+            loop.run_until_complete(broker.database.close())
+
+
+if __name__ == "__main__":
+    main()
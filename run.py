@@ -4,23 +4,128 @@ Author : SangJae Kang
 Mail : craftsangjae@gmail.com
 """
 import os
-from service.consumer import RedisQueue
+import socket
+from service.consumer import RedisQueue, RedisStreamQueue, RedisPriorityQueue
 from service.worker import RepositoryCrawler
 from service.database import MongoDatabase
-from service.github import GithubKeyGen
+from service.github import GithubKeyGen, RedisGithubKeyGen
+from service.supervisor import CrawlerSupervisor
+from service.dedup import FreshnessFilter
+from service.limiter import AdaptiveLimiter
+from service.planner import BudgetPlanner
+from service.retry import RetryPolicy
+from service.metrics import MetricsServer
+from service.tracing import Tracer, SamplingProfiler
+from service.priority import CrawlPriority
 
+BROKER_HOST = os.environ.get("REPO_HOST", "redis")
+DATABASE_HOST = os.environ.get("MONGO_HOST", "mongodb://mongo:27017/")
+NUM_CONCURRENT = int(os.environ.get('NUM_CONCURRENT', 100))
+# true이면 응답 latency / 오류에 따라 동시 IO 수를 조절 (NUM_CONCURRENT가 상한)
+ADAPTIVE_CONCURRENCY = os.environ.get('ADAPTIVE_CONCURRENCY', 'false').lower() == 'true'
+# crawler 프로세스 수 (2 이상이면 supervisor가 프로세스들을 띄우고 관리)
+NUM_PROCESS = int(os.environ.get('NUM_PROCESS', 1))
+STATS_INTERVAL = float(os.environ.get('STATS_INTERVAL', 60))
+BATCH_SIZE = int(os.environ.get('BATCH_SIZE', 1))
+BULK_SIZE = int(os.environ.get('BULK_SIZE', 1))
+# 브로커에서 미리 가져다 둘 최대 작업 수 (0이면 NUM_CONCURRENT)
+PREFETCH = int(os.environ.get('PREFETCH', 0))
+# 조회한 document를 한 번에 저장하는 최대 개수
+WRITE_BATCH_SIZE = int(os.environ.get('WRITE_BATCH_SIZE', 100))
+# 내용이 바뀌지 않은 document는 저장하지 않음 (바뀐 경우 바뀐 필드만 저장)
+SKIP_UNCHANGED = os.environ.get('SKIP_UNCHANGED', 'false').lower() == 'true'
+# list : redis list (RedisQueue), stream : redis stream + consumer group (RedisStreamQueue),
+# priority : 인기도 / 마지막 crawl 시각으로 정한 다음 crawl 시각 순서 (RedisPriorityQueue)
+BROKER_TYPE = os.environ.get('BROKER_TYPE', 'list')
+RELIABLE = os.environ.get('RELIABLE', 'false').lower() == 'true'
+# 가져온 메시지의 처리 기한을 연장하는 주기(초)
+# reliable list / stream / priority 브로커는 처리 기한(visibility_timeout, 기본 600초)이 지나도록
+# ack 받지 못한 메시지를 다시 담으므로, 키를 기다리는 동안(최대 3600초) 다시 담기지 않도록
+# 처리 기한보다 충분히 짧게 두어야 함 (처리 기한은 죽은 crawler의 메시지를 다시 담기까지의 시간이 됨)
+RENEW_INTERVAL = float(os.environ.get('RENEW_INTERVAL', 60))
+# stream broker의 최대 길이 (0이면 자르지 않음)
+STREAM_MAXLEN = int(os.environ.get('STREAM_MAXLEN', 0))
+# priority 브로커에서 인기도가 1(star / fork 없음)인 리파짓토리를 다시 crawl하는 기본 주기(초)
+REFRESH_INTERVAL = float(os.environ.get('REFRESH_INTERVAL', 7 * 86400))
+CONSUMER_NAME = os.environ.get('CONSUMER_NAME', socket.gethostname())
+# local : 프로세스 안에서만 할당량 관리, redis : 여러 프로세스 / 노드가 redis로 할당량을 공유
+# (NUM_PROCESS가 2 이상이면 항상 redis 사용)
+KEY_BACKEND = os.environ.get('KEY_BACKEND', 'local')
+# true이면 할당량을 resetAt까지 고르게 나누어 쓰도록 요청 속도 / 배치 크기를 조절
+PLAN_BUDGET = os.environ.get('PLAN_BUDGET', 'false').lower() == 'true'
+# 실패한 메시지를 dead-letter로 옮기기 전까지의 최대 시도 횟수
+MAX_ATTEMPTS = int(os.environ.get('MAX_ATTEMPTS', 5))
+# 최근 FRESHNESS초 안에 crawl한 리파짓토리는 건너뜀 (0이면 사용하지 않음)
+FRESHNESS = float(os.environ.get('FRESHNESS', 0))
+# Prometheus metrics endpoint(/metrics)의 port (0이면 사용하지 않음, multi-process 모드에서는 METRICS_PORT + index)
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 0))
+# 작업의 단계 별 span을 기록할 JSON Lines 파일 (비어있으면 사용하지 않음) 및 기록할 작업의 비율
+TRACE_PATH = os.environ.get('TRACE_PATH', '')
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 0.01))
+# 이벤트 루프 thread를 시작 PROFILE_DELAY초 후부터 PROFILE_SECONDS초 동안 sampling해
+# flamegraph용 collapsed stack 파일로 저장 (비어있으면 사용하지 않음)
+PROFILE_PATH = os.environ.get('PROFILE_PATH', '')
+PROFILE_SECONDS = float(os.environ.get('PROFILE_SECONDS', 30))
+PROFILE_DELAY = float(os.environ.get('PROFILE_DELAY', 60))
 
-if __name__ == "__main__":
-    BROKER_HOST = os.environ.get("REPO_HOST", "redis")
-    DATABASE_HOST = os.environ.get("MONGO_HOST", "mongodb://mongo:27017/")
-    NUM_CONCURRENT = int(os.environ.get('NUM_CONCURRENT', 100))
 
-    repo_broker = RedisQueue('repository', host=BROKER_HOST)
-    repo_database = MongoDatabase('repository', uri=DATABASE_HOST)
-    githubkey = GithubKeyGen("./credentials/github.txt")
+def create_crawler(index=None):
+    """ crawler 생성 (multi-process 모드에서는 각 자식 프로세스 안에서 호출)
+    """
+    consumer = CONSUMER_NAME if index is None else f"{CONSUMER_NAME}-{index}"
+    repo_database = MongoDatabase('repository', uri=DATABASE_HOST, bulk_size=BULK_SIZE,
+                                  skip_unchanged=SKIP_UNCHANGED)
+    if BROKER_TYPE == 'stream':
+        repo_broker = RedisStreamQueue('repository', host=BROKER_HOST,
+                                       consumer=consumer, maxlen=STREAM_MAXLEN or None)
+    elif BROKER_TYPE == 'priority':
+        repo_broker = RedisPriorityQueue('repository', host=BROKER_HOST, database=repo_database,
+                                         priority=CrawlPriority(base_interval=REFRESH_INTERVAL))
+    else:
+        repo_broker = RedisQueue('repository', host=BROKER_HOST,
+                                 reliable=RELIABLE, consumer=consumer)
+    if KEY_BACKEND == 'redis' or NUM_PROCESS > 1:
+        githubkey = RedisGithubKeyGen("./credentials/github.txt", host=BROKER_HOST)
+    else:
+        githubkey = GithubKeyGen("./credentials/github.txt")
+    dedup = FreshnessFilter(FRESHNESS, host=BROKER_HOST) if FRESHNESS > 0 else None
+    if ADAPTIVE_CONCURRENCY:
+        limiter = AdaptiveLimiter(initial_limit=min(20, NUM_CONCURRENT), max_limit=NUM_CONCURRENT)
+    else:
+        limiter = None
+    planner = BudgetPlanner(githubkey) if PLAN_BUDGET else None
+    # multi-process 모드에서는 프로세스 별로 파일을 나눔
+    suffix = "" if index is None else f".{index}"
+    tracer = Tracer(TRACE_PATH + suffix, sample_rate=TRACE_SAMPLE_RATE) if TRACE_PATH else None
+    if PROFILE_PATH:
+        profiler = SamplingProfiler(PROFILE_PATH + suffix, duration=PROFILE_SECONDS, delay=PROFILE_DELAY)
+    else:
+        profiler = None
+    if METRICS_PORT > 0:
+        metrics = MetricsServer(port=METRICS_PORT if index is None else METRICS_PORT + index)
+    else:
+        metrics = None
+
+    return RepositoryCrawler(repo_broker, repo_database, githubkey,
+                             num_concurrent=NUM_CONCURRENT,
+                             batch_size=BATCH_SIZE,
+                             dedup=dedup,
+                             limiter=limiter,
+                             planner=planner,
+                             retry_policy=RetryPolicy(max_attempts=MAX_ATTEMPTS),
+                             prefetch=PREFETCH or None,
+                             write_batch_size=WRITE_BATCH_SIZE,
+                             metrics=metrics,
+                             tracer=tracer,
+                             profiler=profiler,
+                             renew_interval=RENEW_INTERVAL)
 
-    crawler_server = RepositoryCrawler(repo_broker, repo_database, githubkey,
-                                       num_concurrent=NUM_CONCURRENT)
-    crawler_server.start()
-    crawler_server.join()
 
+if __name__ == "__main__":
+    if NUM_PROCESS > 1:
+        supervisor = CrawlerSupervisor(create_crawler, NUM_PROCESS, stats_interval=STATS_INTERVAL)
+        supervisor.run()
+    else:
+        crawler_server = create_crawler()
+        crawler_server.start()
+        crawler_server.join()
@@ -4,8 +4,16 @@ Author : SangJae Kang
 Mail : craftsangjae@gmail.com
 """
 import redis
+import redis.asyncio
 import json
 import abc
+import math
+import time
+import socket
+import asyncio
+import weakref
+from service.document import repository_node_id
+from service.priority import CrawlPriority
 
 
 class BaseConsumer:
@@ -46,18 +54,313 @@ class BaseConsumer:
         """
         pass
 
+    def put_many(self, elems):
+        """
+        브로커에 여러 메시지를 한 번에 담기
+        """
+        for elem in elems:
+            self.put(elem)
+
+    def get_many(self, n):
+        """
+        브로커에서 최대 n개의 메시지를 한 번에 가져오기
+        """
+        messages = []
+        for _ in range(n):
+            message = self.get()
+            if message is None:
+                break
+            messages.append(message)
+        return messages
+
+    async def put_async(self, elem):
+        """
+        브로커에 메시지를 비동기적으로 담기
+        """
+        self.put(elem)
+
+    async def put_many_async(self, elems):
+        """
+        브로커에 여러 메시지를 비동기적으로 담기
+        """
+        self.put_many(elems)
+
+    async def get_many_async(self, n, timeout=1.):
+        """
+        브로커에서 최대 n개의 메시지를 비동기적으로 가져오기
+        메시지가 없으면 최대 timeout초 동안 기다린 후 빈 리스트를 반환
+        """
+        messages = self.get_many(n)
+        if not messages:
+            await asyncio.sleep(timeout)
+        return messages
+
+    def ack(self, message):
+        """
+        처리가 끝난 메시지를 브로커에 알리기
+        """
+        pass
+
+    def nack(self, message, requeue=True):
+        """
+        처리에 실패한 메시지를 브로커에 알리기
+        requeue가 True면 다시 담고, False면 버림
+        """
+        if requeue:
+            self.put(message)
+
+    def reap(self):
+        """
+        처리 기한이 지난 메시지들을 다시 담고, 다시 담은 메시지 수를 반환
+        """
+        return 0
+
+    def renew(self):
+        """
+        가져온 후 아직 처리 완료 / 실패를 알리지 않은 메시지들의 처리 기한을 연장하고, 연장한 메시지 수를 반환
+        """
+        return 0
+
+    def retry(self, message, delay):
+        """
+        처리에 실패한 메시지를 delay초 후에 다시 담기
+        (지연을 지원하지 않는 브로커는 바로 다시 담음)
+        """
+        self.nack(message, requeue=True)
+
+    def bury(self, message, reason=None):
+        """
+        처리에 실패한 메시지를 dead-letter로 옮기기 (dead-letter가 없는 브로커는 버림)
+        """
+        self.nack(message, requeue=False)
+
+    def promote(self):
+        """
+        기다리는 시간이 지난 메시지들을 다시 담고, 다시 담은 메시지 수를 반환
+        """
+        return 0
+
+    async def ack_async(self, message, document=None):
+        """
+        처리가 끝난 메시지를 브로커에 알리기
+        (document는 crawl한 결과로, 다음 crawl 시각을 정하는 브로커에서 사용)
+        """
+        self.ack(message)
+
+    async def skip_async(self, message, delay):
+        """
+        최근에 처리한 메시지를 건너뛰었음을 브로커에 알리기
+        (기본은 처리 완료, 다시 crawl할 메시지를 들고 있는 브로커는 delay초 후로 미룸)
+        """
+        await self.ack_async(message)
+
+    async def nack_async(self, message, requeue=True):
+        self.nack(message, requeue)
+
+    async def reap_async(self):
+        return self.reap()
+
+    async def renew_async(self):
+        return self.renew()
+
+    async def retry_async(self, message, delay):
+        self.retry(message, delay)
+
+    async def bury_async(self, message, reason=None):
+        self.bury(message, reason)
+
+    async def promote_async(self):
+        return self.promote()
+
+    async def len_async(self):
+        """
+        브로커에 남아있는 메시지 수를 비동기적으로 가져오기
+        """
+        return len(self)
+
+    async def close(self):
+        """
+        브로커와의 연결 닫기
+        """
+        pass
+
+
+# 메시지를 processing list로 옮기고, 처리 기한(lease)을 기록
+# KEYS : topic, processing, leases / ARGV : 메시지 수, 처리 기한
+LEASE_SCRIPT = """
+local elems = {}
+for i = 1, tonumber(ARGV[1]) do
+    local elem = redis.call('RPOPLPUSH', KEYS[1], KEYS[2])
+    if not elem then
+        break
+    end
+    redis.call('ZADD', KEYS[3], ARGV[2], elem)
+    elems[#elems + 1] = elem
+end
+return elems
+"""
+
+# 처리가 끝난 메시지를 processing list에서 제거
+# KEYS : processing, leases, deliveries / ARGV : 메시지
+ACK_SCRIPT = """
+redis.call('LREM', KEYS[1], 1, ARGV[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[3], ARGV[1])
+"""
+
+# 실패한 메시지를 processing list에서 제거 후, 다시 topic에 담거나 (실패 횟수 초과 시) dead-letter로
+# KEYS : processing, leases, deliveries, topic, dead / ARGV : 메시지, 최대 실패 횟수, requeue 여부
+NACK_SCRIPT = """
+redis.call('LREM', KEYS[1], 1, ARGV[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+if ARGV[3] == '1' and redis.call('HINCRBY', KEYS[3], ARGV[1], 1) < tonumber(ARGV[2]) then
+    redis.call('LPUSH', KEYS[4], ARGV[1])
+else
+    redis.call('HDEL', KEYS[3], ARGV[1])
+    redis.call('LPUSH', KEYS[5], ARGV[1])
+end
+"""
+
+# 처리 기한이 지난 메시지를 processing list에서 꺼내 다시 topic에 담거나 dead-letter로
+# (lease가 기록되기 전의 메시지는 기본 처리 기한으로 lease를 기록)
+# KEYS : processing, leases, deliveries, topic, dead / ARGV : 현재 시각, 최대 실패 횟수, 기본 처리 기한
+REAP_SCRIPT = """
+local expired = 0
+for _, elem in ipairs(redis.call('LRANGE', KEYS[1], 0, -1)) do
+    local deadline = redis.call('ZSCORE', KEYS[2], elem)
+    if tonumber(deadline or ARGV[3]) <= tonumber(ARGV[1]) then
+        redis.call('LREM', KEYS[1], 1, elem)
+        redis.call('ZREM', KEYS[2], elem)
+        if redis.call('HINCRBY', KEYS[3], elem, 1) < tonumber(ARGV[2]) then
+            redis.call('LPUSH', KEYS[4], elem)
+        else
+            redis.call('HDEL', KEYS[3], elem)
+            redis.call('LPUSH', KEYS[5], elem)
+        end
+        expired = expired + 1
+    elseif not deadline then
+        redis.call('ZADD', KEYS[2], ARGV[3], elem)
+    end
+end
+return expired
+"""
+
+# 실패한 메시지를 processing list에서 제거 후, 다시 담을 시각을 score로 delayed sorted set에 담기
+# KEYS : processing, leases, deliveries, delayed / ARGV : 원본 메시지 (없으면 ''), 담을 메시지, 다시 담을 시각
+RETRY_SCRIPT = """
+if ARGV[1] ~= '' then
+    redis.call('LREM', KEYS[1], 1, ARGV[1])
+    redis.call('ZREM', KEYS[2], ARGV[1])
+    redis.call('HDEL', KEYS[3], ARGV[1])
+end
+redis.call('ZADD', KEYS[4], ARGV[3], ARGV[2])
+"""
+
+# 실패한 메시지를 processing list에서 제거 후, dead-letter로
+# KEYS : processing, leases, deliveries, dead / ARGV : 원본 메시지 (없으면 ''), 담을 메시지
+BURY_SCRIPT = """
+if ARGV[1] ~= '' then
+    redis.call('LREM', KEYS[1], 1, ARGV[1])
+    redis.call('ZREM', KEYS[2], ARGV[1])
+    redis.call('HDEL', KEYS[3], ARGV[1])
+end
+redis.call('LPUSH', KEYS[4], ARGV[2])
+"""
+
+# 다시 담을 시각이 지난 메시지들을 delayed sorted set에서 꺼내 topic에 담기
+# (바로 처리되도록 꺼내는 쪽에 담음)
+# KEYS : delayed, topic / ARGV : 현재 시각, 최대 메시지 수
+PROMOTE_SCRIPT = """
+local elems = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, elem in ipairs(elems) do
+    redis.call('ZREM', KEYS[1], elem)
+    redis.call('RPUSH', KEYS[2], elem)
+end
+return #elems
+"""
+
 
 class RedisQueue(BaseConsumer):
     """
         redis로 이루어진 FIFO Queue Style Broker 클래스
+
+        reliable 모드에서는 메시지를 꺼낼 때 지우지 않고 consumer 별 processing list로 옮겨두고,
+        ack을 받으면 지움. 처리 기한(visibility_timeout)이 지나도록 ack을 받지 못한 메시지는
+        reap 시 다시 topic에 담기며, max_deliveries번 실패한 메시지는 dead-letter list({topic}:dead)로 옮김
+
+        retry로 다시 시도할 메시지는 다시 담을 시각과 함께 delayed sorted set({topic}:delayed)에 두었다가,
+        promote 시 시각이 지난 메시지만 topic에 담음
+
+        Arguments
+            reliable: reliable 모드 사용 여부
+            consumer: processing list를 구분하기 위한 consumer 이름 (기본 hostname)
+            visibility_timeout: 메시지 처리 기한(초)
+            max_deliveries: dead-letter로 옮기기 전까지의 최대 실패 횟수
     """
 
-    def __init__(self, topic, **redis_kwargs):
+    def __init__(self, topic, reliable=False, consumer=None,
+                 visibility_timeout=600, max_deliveries=5, **redis_kwargs):
         """
             host='localhost', port=6379, db=0
         """
         self.topic = topic
+        self.redis_kwargs = redis_kwargs
         self.rq = redis.Redis(**redis_kwargs)
+        # 비동기 client는 생성된 이벤트 루프에 묶이기 때문에, 이벤트 루프 별로 하나씩 생성
+        self.arqs = weakref.WeakKeyDictionary()
+
+        self.reliable = reliable
+        self.consumer = consumer or socket.gethostname()
+        self.visibility_timeout = visibility_timeout
+        self.max_deliveries = max_deliveries
+
+        self.consumers_key = f"{topic}:consumers"
+        self.processing_key = f"{topic}:processing:{self.consumer}"
+        self.leases_key = f"{topic}:leases:{self.consumer}"
+        self.deliveries_key = f"{topic}:deliveries"
+        self.dead_key = f"{topic}:dead"
+        self.delayed_key = f"{topic}:delayed"
+        # 처리 중인 메시지 -> 브로커에 저장된 원본 (ack / nack 시 원본으로 processing list에서 제거)
+        self.inflight = {}
+
+        self.scripts = self.register_scripts(self.rq)
+        if self.reliable:
+            self.rq.sadd(self.consumers_key, self.consumer)
+            # 이전에 같은 consumer로 처리하다 멈춘 메시지들을 다시 topic으로
+            self.recover()
+
+    @staticmethod
+    def register_scripts(client):
+        return {"lease": client.register_script(LEASE_SCRIPT),
+                "ack": client.register_script(ACK_SCRIPT),
+                "nack": client.register_script(NACK_SCRIPT),
+                "reap": client.register_script(REAP_SCRIPT),
+                "retry": client.register_script(RETRY_SCRIPT),
+                "bury": client.register_script(BURY_SCRIPT),
+                "promote": client.register_script(PROMOTE_SCRIPT)}
+
+    def get_async_client(self):
+        loop = asyncio.get_event_loop()
+        arq = self.arqs.get(loop)
+        if arq is None:
+            arq = redis.asyncio.Redis(**self.redis_kwargs)
+            arq.scripts = self.register_scripts(arq)
+            self.arqs[loop] = arq
+        return arq
+
+    def decode(self, elems):
+        messages = []
+        for elem in elems:
+            if not elem:
+                continue
+            message = json.loads(elem)
+            if self.reliable:
+                self.inflight[id(message)] = (message, elem)
+            messages.append(message)
+        return messages
+
+    def deadline(self):
+        return time.time() + self.visibility_timeout
 
     def deleteAll(self):
         return self.rq.delete(self.topic)
@@ -69,6 +372,10 @@ class RedisQueue(BaseConsumer):
         self.rq.lpush(self.topic, json.dumps(elem))
 
     def get(self):
+        if self.reliable:
+            messages = self.get_many(1)
+            return messages[0] if messages else None
+
         elem = self.rq.rpop(self.topic)
         if elem:
             return json.loads(elem)
@@ -78,4 +385,822 @@ class RedisQueue(BaseConsumer):
     def __len__(self):
         return self.rq.llen(self.topic)
 
+    async def len_async(self):
+        return await self.get_async_client().llen(self.topic)
+
+    def put_many(self, elems):
+        if elems:
+            # 하나의 LPUSH로 여러 메시지를 담음 (순서는 elems 순서대로 유지)
+            self.rq.lpush(self.topic, *[json.dumps(elem) for elem in elems])
+
+    def get_many(self, n):
+        if self.reliable:
+            elems = self.scripts["lease"](
+                keys=[self.topic, self.processing_key, self.leases_key], args=[n, self.deadline()])
+            return self.decode(elems)
+
+        with self.rq.pipeline(transaction=False) as pipe:
+            for _ in range(n):
+                pipe.rpop(self.topic)
+            elems = pipe.execute()
+        return [json.loads(elem) for elem in elems if elem]
+
+    async def put_async(self, elem):
+        await self.get_async_client().lpush(self.topic, json.dumps(elem))
+
+    async def put_many_async(self, elems):
+        if elems:
+            await self.get_async_client().lpush(self.topic, *[json.dumps(elem) for elem in elems])
+
+    async def get_many_async(self, n, timeout=1.):
+        """ 최대 n개의 메시지 가져오기
+        1. BRPOP으로 첫번째 메시지를 가져옴 (비어있으면 timeout초 동안 blocking으로 대기)
+        2. 나머지 n-1개는 pipeline으로 한 번에 RPOP
+        """
+        arq = self.get_async_client()
+        if self.reliable:
+            # lease를 기록하기 전에 reap 되더라도 기본 처리 기한이 적용되므로 안전함
+            elem = await arq.brpoplpush(self.topic, self.processing_key,
+                                        timeout=max(math.ceil(timeout), 1))
+            if not elem:
+                return []
+            await arq.zadd(self.leases_key, {elem: self.deadline()})
+            elems = [elem]
+            if n > 1:
+                elems.extend(await arq.scripts["lease"](
+                    keys=[self.topic, self.processing_key, self.leases_key],
+                    args=[n - 1, self.deadline()]))
+            return self.decode(elems)
+
+        elem = await arq.brpop(self.topic, timeout=max(math.ceil(timeout), 1))
+        if not elem:
+            return []
+        elems = [elem[1]]
+        if n > 1:
+            async with arq.pipeline(transaction=False) as pipe:
+                for _ in range(n - 1):
+                    pipe.rpop(self.topic)
+                elems.extend(await pipe.execute())
+        return [json.loads(elem) for elem in elems if elem]
+
+    def ack(self, message):
+        if not self.reliable:
+            return
+        _, elem = self.inflight.pop(id(message), (None, None))
+        if elem is not None:
+            self.scripts["ack"](keys=[self.processing_key, self.leases_key, self.deliveries_key],
+                                args=[elem])
+
+    def nack(self, message, requeue=True):
+        if not self.reliable:
+            return super().nack(message, requeue)
+        _, elem = self.inflight.pop(id(message), (None, None))
+        if elem is not None:
+            self.scripts["nack"](keys=self.nack_keys(),
+                                 args=[elem, self.max_deliveries, int(requeue)])
+
+    def reap(self):
+        if not self.reliable:
+            return 0
+        expired = 0
+        for consumer in self.rq.smembers(self.consumers_key):
+            expired += self.scripts["reap"](keys=self.reap_keys(consumer.decode('utf8')),
+                                            args=[time.time(), self.max_deliveries, self.deadline()])
+        return expired
+
+    def renew(self):
+        if not self.reliable or not self.inflight:
+            return 0
+        # 이미 처리 완료 / reap된 메시지는 lease가 없으므로 다시 기록하지 않음 (XX)
+        leases = {elem: self.deadline() for _, elem in list(self.inflight.values())}
+        return self.rq.zadd(self.leases_key, leases, xx=True, ch=True)
+
+    async def renew_async(self):
+        if not self.reliable or not self.inflight:
+            return 0
+        leases = {elem: self.deadline() for _, elem in list(self.inflight.values())}
+        return await self.get_async_client().zadd(self.leases_key, leases, xx=True, ch=True)
+
+    def recover(self):
+        """ 현재 consumer의 processing list에 남아 있는 메시지를 모두 처리 기한이 지난 것으로 보고 reap
+        """
+        return self.scripts["reap"](keys=self.reap_keys(self.consumer),
+                                    args=[time.time(), self.max_deliveries, 0])
+
+    async def ack_async(self, message, document=None):
+        if not self.reliable:
+            return
+        _, elem = self.inflight.pop(id(message), (None, None))
+        if elem is not None:
+            await self.get_async_client().scripts["ack"](
+                keys=[self.processing_key, self.leases_key, self.deliveries_key], args=[elem])
+
+    async def nack_async(self, message, requeue=True):
+        if not self.reliable:
+            if requeue:
+                await self.put_async(message)
+            return
+        _, elem = self.inflight.pop(id(message), (None, None))
+        if elem is not None:
+            await self.get_async_client().scripts["nack"](
+                keys=self.nack_keys(), args=[elem, self.max_deliveries, int(requeue)])
+
+    async def reap_async(self):
+        if not self.reliable:
+            return 0
+        arq = self.get_async_client()
+        expired = 0
+        for consumer in await arq.smembers(self.consumers_key):
+            expired += await arq.scripts["reap"](keys=self.reap_keys(consumer.decode('utf8')),
+                                                 args=[time.time(), self.max_deliveries, self.deadline()])
+        return expired
+
+    def retry(self, message, delay):
+        _, elem = self.inflight.pop(id(message), (None, None))
+        self.scripts["retry"](keys=self.retry_keys(self.delayed_key),
+                              args=[elem or '', json.dumps(message), time.time() + delay])
+
+    def bury(self, message, reason=None):
+        _, elem = self.inflight.pop(id(message), (None, None))
+        self.scripts["bury"](keys=self.retry_keys(self.dead_key),
+                             args=[elem or '', self.dead_letter(message, reason)])
+
+    def promote(self, count=1000):
+        return self.scripts["promote"](keys=[self.delayed_key, self.topic], args=[time.time(), count])
+
+    async def retry_async(self, message, delay):
+        _, elem = self.inflight.pop(id(message), (None, None))
+        await self.get_async_client().scripts["retry"](
+            keys=self.retry_keys(self.delayed_key),
+            args=[elem or '', json.dumps(message), time.time() + delay])
+
+    async def bury_async(self, message, reason=None):
+        _, elem = self.inflight.pop(id(message), (None, None))
+        await self.get_async_client().scripts["bury"](
+            keys=self.retry_keys(self.dead_key), args=[elem or '', self.dead_letter(message, reason)])
+
+    async def promote_async(self, count=1000):
+        return await self.get_async_client().scripts["promote"](
+            keys=[self.delayed_key, self.topic], args=[time.time(), count])
+
+    @staticmethod
+    def dead_letter(message, reason=None):
+        """ dead-letter에 담을 메시지 (실패 원인을 "_error" 필드로 기록)
+        """
+        if isinstance(message, dict) and reason is not None:
+            message = dict(message, _error=reason)
+        return json.dumps(message)
+
+    def retry_keys(self, key):
+        return [self.processing_key, self.leases_key, self.deliveries_key, key]
+
+    def nack_keys(self):
+        return [self.processing_key, self.leases_key, self.deliveries_key, self.topic, self.dead_key]
+
+    def reap_keys(self, consumer):
+        return [f"{self.topic}:processing:{consumer}", f"{self.topic}:leases:{consumer}",
+                self.deliveries_key, self.topic, self.dead_key]
+
+    async def close(self):
+        arq = self.arqs.pop(asyncio.get_event_loop(), None)
+        if arq is not None:
+            await arq.close()
+
+
+# 다시 담을 시각이 지난 메시지들을 delayed sorted set에서 꺼내 stream에 담기
+# KEYS : delayed, stream / ARGV : 현재 시각, 최대 메시지 수, stream 최대 길이 (0이면 자르지 않음)
+STREAM_PROMOTE_SCRIPT = """
+local elems = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, elem in ipairs(elems) do
+    redis.call('ZREM', KEYS[1], elem)
+    if tonumber(ARGV[3]) > 0 then
+        redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[3], '*', 'm', elem)
+    else
+        redis.call('XADD', KEYS[2], '*', 'm', elem)
+    end
+end
+return #elems
+"""
+
+
+class RedisStreamQueue(BaseConsumer):
+    """
+        redis stream과 consumer group으로 이루어진 Broker 클래스
+
+        consumer 별로 XREADGROUP으로 메시지를 나누어 가져가고 (여러 노드에서 중복 없이 처리),
+        처리가 끝난 메시지는 XACK 후 stream에서 지움. 가져간 후 visibility_timeout이 지나도록 ack을 받지 못한
+        메시지(죽은 consumer가 처리 중이던 메시지 등)와 nack한 메시지는 같은 entry로 pending에 남아 있다가,
+        다음 get에서 새 메시지보다 먼저 XAUTOCLAIM으로 가져옴
+
+        전달 횟수는 consumer group이 entry 별로 세는 횟수(XPENDING의 times_delivered)만 사용하며,
+        max_deliveries번 전달된 메시지가 실패하거나 처리 기한이 지나면 원인과 함께 dead-letter list({topic}:dead)로 옮김
+        (처리 기한이 지난 메시지는 reap에서 옮김)
+
+        retry / dead-letter는 RedisQueue와 같은 key({topic}:delayed, {topic}:dead)와 형식을 사용
+
+        stream({topic}:stream)의 entry는 메시지(m)로 이루어짐
+
+        Arguments
+            group: consumer group 이름
+            consumer: group 안에서 consumer를 구분하는 이름 (기본 hostname)
+            visibility_timeout: 메시지 처리 기한(초)
+            max_deliveries: dead-letter로 옮기기 전까지의 최대 전달 횟수
+            maxlen: stream의 최대 길이 (넘으면 오래된 entry부터 대략적으로 자름, None이면 자르지 않음)
+    """
+
+    def __init__(self, topic, group="crawler", consumer=None,
+                 visibility_timeout=600, max_deliveries=5, maxlen=None, **redis_kwargs):
+        """
+            host='localhost', port=6379, db=0
+        """
+        self.topic = topic
+        self.redis_kwargs = redis_kwargs
+        self.rq = redis.Redis(**redis_kwargs)
+        self.arqs = weakref.WeakKeyDictionary()
+
+        self.group = group
+        self.consumer = consumer or socket.gethostname()
+        self.visibility_timeout = visibility_timeout
+        self.max_deliveries = max_deliveries
+        self.maxlen = maxlen
+
+        self.stream_key = f"{topic}:stream"
+        self.dead_key = f"{topic}:dead"
+        self.delayed_key = f"{topic}:delayed"
+        # 처리 중인 메시지 -> (메시지, stream entry id, 전달 횟수)
+        self.inflight = {}
+
+        self.promote_script = self.rq.register_script(STREAM_PROMOTE_SCRIPT)
+        self.create_group()
+
+    def create_group(self):
+        try:
+            self.rq.xgroup_create(self.stream_key, self.group, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            # 이미 group이 있는 경우
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def get_async_client(self):
+        loop = asyncio.get_event_loop()
+        arq = self.arqs.get(loop)
+        if arq is None:
+            arq = redis.asyncio.Redis(**self.redis_kwargs)
+            arq.promote_script = arq.register_script(STREAM_PROMOTE_SCRIPT)
+            self.arqs[loop] = arq
+        return arq
+
+    def decode(self, response, deliveries=None):
+        """ XREADGROUP / XAUTOCLAIM 응답의 entry들을 메시지로 변환
+
+        :param deliveries: entry id -> 전달 횟수 (없으면 처음 전달한 것으로 봄)
+        """
+        messages = []
+        for entry_id, fields in response:
+            if not fields:
+                continue
+            message = json.loads(fields[b'm'])
+            self.inflight[id(message)] = (message, entry_id, (deliveries or {}).get(entry_id, 1))
+            messages.append(message)
+        return messages
+
+    def idle_time(self):
+        """ 처리 기한이 지난 것으로 보는 idle 시간(ms) """
+        return int(self.visibility_timeout * 1000)
+
+    def count_pipe(self, pipe, entries):
+        """ entry 별 전달 횟수 조회 (XPENDING) """
+        for entry_id, _ in entries:
+            pipe.xpending_range(self.stream_key, self.group, entry_id, entry_id, 1)
+
+    def claimed(self, pipe, entries, pendings):
+        """ XAUTOCLAIM으로 가져온 entry들 중 전달 횟수를 넘은 메시지는 dead-letter로 옮기고, 나머지를 메시지로 변환
+        """
+        deliveries = {}
+        for (entry_id, fields), pending in zip(entries, pendings):
+            count = pending[0]['times_delivered'] if pending else 1
+            if not fields:
+                # 이미 stream에서 지워진 entry
+                pipe.xack(self.stream_key, self.group, entry_id)
+            elif count > self.max_deliveries:
+                self.bury_entry(pipe, entry_id, fields, count - 1)
+            else:
+                deliveries[entry_id] = count
+        return self.decode([entry for entry in entries if entry[0] in deliveries], deliveries)
+
+    def bury_entry(self, pipe, entry_id, fields, deliveries):
+        """ 전달 횟수를 넘은 entry를 원인과 함께 dead-letter로 """
+        self.remove(pipe, entry_id)
+        pipe.lpush(self.dead_key, RedisQueue.dead_letter(json.loads(fields[b'm']),
+                                                         f"delivered {deliveries} times"))
+
+    def add(self, pipe, elem):
+        pipe.xadd(self.stream_key, {"m": elem}, maxlen=self.maxlen, approximate=True)
+
+    def remove(self, pipe, entry_id):
+        pipe.xack(self.stream_key, self.group, entry_id)
+        pipe.xdel(self.stream_key, entry_id)
+
+    def deleteAll(self):
+        self.rq.delete(self.stream_key)
+        self.create_group()
+
+    def isEmpty(self):
+        return len(self) == 0
+
+    def put(self, elem):
+        self.put_many([elem])
+
+    def get(self):
+        messages = self.get_many(1)
+        return messages[0] if messages else None
+
+    def __len__(self):
+        """ 아직 가져가지 않은 메시지 수 (stream 길이 - 처리 중인 메시지 수)
+        """
+        with self.rq.pipeline(transaction=False) as pipe:
+            pipe.xlen(self.stream_key)
+            pipe.xpending(self.stream_key, self.group)
+            length, pending = pipe.execute()
+        return length - pending['pending']
+
+    async def len_async(self):
+        async with self.get_async_client().pipeline(transaction=False) as pipe:
+            pipe.xlen(self.stream_key)
+            pipe.xpending(self.stream_key, self.group)
+            length, pending = await pipe.execute()
+        return length - pending['pending']
+
+    def put_many(self, elems):
+        if elems:
+            with self.rq.pipeline(transaction=False) as pipe:
+                for elem in elems:
+                    self.add(pipe, json.dumps(elem))
+                pipe.execute()
+
+    def get_many(self, n):
+        messages = self.reclaim(n)
+        if len(messages) < n:
+            response = self.rq.xreadgroup(self.group, self.consumer, {self.stream_key: ">"},
+                                          count=n - len(messages))
+            messages += self.decode(response[0][1]) if response else []
+        return messages
+
+    def reclaim(self, n):
+        """ 처리 기한이 지났거나 nack한 메시지를 XAUTOCLAIM으로 최대 n개 가져오기
+        """
+        _, entries = self.rq.xautoclaim(self.stream_key, self.group, self.consumer,
+                                        self.idle_time(), count=n)[:2]
+        if not entries:
+            return []
+        with self.rq.pipeline(transaction=False) as pipe:
+            self.count_pipe(pipe, entries)
+            pendings = pipe.execute()
+        with self.rq.pipeline() as pipe:
+            messages = self.claimed(pipe, entries, pendings)
+            pipe.execute()
+        return messages
+
+    async def put_async(self, elem):
+        await self.put_many_async([elem])
+
+    async def put_many_async(self, elems):
+        if elems:
+            async with self.get_async_client().pipeline(transaction=False) as pipe:
+                for elem in elems:
+                    self.add(pipe, json.dumps(elem))
+                await pipe.execute()
+
+    async def get_many_async(self, n, timeout=1.):
+        """ 최대 n개의 메시지 가져오기
+        (stream이 비어있으면 XREADGROUP BLOCK으로 timeout초 동안 대기)
+        """
+        messages = await self.reclaim_async(n)
+        if messages:
+            return messages
+        response = await self.get_async_client().xreadgroup(
+            self.group, self.consumer, {self.stream_key: ">"}, count=n, block=max(int(timeout * 1000), 1))
+        return self.decode(response[0][1]) if response else []
+
+    async def reclaim_async(self, n):
+        arq = self.get_async_client()
+        _, entries = (await arq.xautoclaim(self.stream_key, self.group, self.consumer,
+                                           self.idle_time(), count=n))[:2]
+        if not entries:
+            return []
+        async with arq.pipeline(transaction=False) as pipe:
+            self.count_pipe(pipe, entries)
+            pendings = await pipe.execute()
+        async with arq.pipeline() as pipe:
+            messages = self.claimed(pipe, entries, pendings)
+            await pipe.execute()
+        return messages
+
+    def ack(self, message):
+        _, entry_id, _ = self.inflight.pop(id(message), (None, None, None))
+        if entry_id is not None:
+            with self.rq.pipeline() as pipe:
+                self.remove(pipe, entry_id)
+                pipe.execute()
+
+    async def ack_async(self, message, document=None):
+        _, entry_id, _ = self.inflight.pop(id(message), (None, None, None))
+        if entry_id is not None:
+            async with self.get_async_client().pipeline() as pipe:
+                self.remove(pipe, entry_id)
+                await pipe.execute()
+
+    def requeue(self, pipe, message, entry_id, deliveries, requeue=True):
+        """ 실패한 메시지를 pending에 남겨 바로 다시 가져가게 하거나 (전달 횟수 초과 시) 원인과 함께 dead-letter로
+        """
+        if requeue and entry_id is None:
+            self.add(pipe, json.dumps(message))
+        elif requeue and deliveries < self.max_deliveries:
+            # idle 시간을 처리 기한으로 바꿔 다음 XAUTOCLAIM에서 가져가도록 함 (JUSTID : 전달 횟수는 그대로)
+            pipe.xclaim(self.stream_key, self.group, self.consumer, 0, [entry_id],
+                        idle=self.idle_time(), justid=True)
+        else:
+            if entry_id is not None:
+                self.remove(pipe, entry_id)
+            reason = f"delivered {deliveries} times" if requeue else "rejected"
+            pipe.lpush(self.dead_key, RedisQueue.dead_letter(message, reason))
+
+    def nack(self, message, requeue=True):
+        _, entry_id, deliveries = self.inflight.pop(id(message), (None, None, 0))
+        with self.rq.pipeline() as pipe:
+            self.requeue(pipe, message, entry_id, deliveries, requeue)
+            pipe.execute()
+
+    async def nack_async(self, message, requeue=True):
+        _, entry_id, deliveries = self.inflight.pop(id(message), (None, None, 0))
+        async with self.get_async_client().pipeline() as pipe:
+            self.requeue(pipe, message, entry_id, deliveries, requeue)
+            await pipe.execute()
+
+    def retry(self, message, delay):
+        _, entry_id, _ = self.inflight.pop(id(message), (None, None, None))
+        with self.rq.pipeline() as pipe:
+            if entry_id is not None:
+                self.remove(pipe, entry_id)
+            pipe.zadd(self.delayed_key, {json.dumps(message): time.time() + delay})
+            pipe.execute()
+
+    async def retry_async(self, message, delay):
+        _, entry_id, _ = self.inflight.pop(id(message), (None, None, None))
+        async with self.get_async_client().pipeline() as pipe:
+            if entry_id is not None:
+                self.remove(pipe, entry_id)
+            pipe.zadd(self.delayed_key, {json.dumps(message): time.time() + delay})
+            await pipe.execute()
+
+    def bury(self, message, reason=None):
+        _, entry_id, _ = self.inflight.pop(id(message), (None, None, None))
+        with self.rq.pipeline() as pipe:
+            if entry_id is not None:
+                self.remove(pipe, entry_id)
+            pipe.lpush(self.dead_key, RedisQueue.dead_letter(message, reason))
+            pipe.execute()
+
+    async def bury_async(self, message, reason=None):
+        _, entry_id, _ = self.inflight.pop(id(message), (None, None, None))
+        async with self.get_async_client().pipeline() as pipe:
+            if entry_id is not None:
+                self.remove(pipe, entry_id)
+            pipe.lpush(self.dead_key, RedisQueue.dead_letter(message, reason))
+            await pipe.execute()
+
+    def promote(self, count=1000):
+        return self.promote_script(keys=[self.delayed_key, self.stream_key],
+                                   args=[time.time(), count, self.maxlen or 0])
+
+    async def promote_async(self, count=1000):
+        return await self.get_async_client().promote_script(
+            keys=[self.delayed_key, self.stream_key], args=[time.time(), count, self.maxlen or 0])
+
+    def reap(self, count=1000):
+        """ 처리 기한이 지난 메시지 중 max_deliveries번 전달된 메시지를 dead-letter로 옮기고
+        (나머지는 다음 get에서 XAUTOCLAIM으로 가져감), 처리 중인 메시지가 없는 죽은 consumer는 group에서 제거
+
+        :return: 처리 기한이 지난 메시지 수
+        """
+        pendings = self.rq.xpending_range(self.stream_key, self.group, "-", "+", count, idle=self.idle_time())
+        exhausted = self.exhausted(pendings)
+        if exhausted:
+            entries = self.rq.xclaim(self.stream_key, self.group, self.consumer,
+                                     self.idle_time(), list(exhausted))
+            with self.rq.pipeline() as pipe:
+                self.bury_exhausted(pipe, entries, exhausted)
+                pipe.execute()
+        for consumer in self.rq.xinfo_consumers(self.stream_key, self.group):
+            if self.is_dead(consumer):
+                self.rq.xgroup_delconsumer(self.stream_key, self.group, consumer['name'])
+        return len(pendings)
+
+    async def reap_async(self, count=1000):
+        arq = self.get_async_client()
+        pendings = await arq.xpending_range(self.stream_key, self.group, "-", "+", count, idle=self.idle_time())
+        exhausted = self.exhausted(pendings)
+        if exhausted:
+            entries = await arq.xclaim(self.stream_key, self.group, self.consumer,
+                                       self.idle_time(), list(exhausted))
+            async with arq.pipeline() as pipe:
+                self.bury_exhausted(pipe, entries, exhausted)
+                await pipe.execute()
+        for consumer in await arq.xinfo_consumers(self.stream_key, self.group):
+            if self.is_dead(consumer):
+                await arq.xgroup_delconsumer(self.stream_key, self.group, consumer['name'])
+        return len(pendings)
+
+    def exhausted(self, pendings):
+        """ max_deliveries번 전달된 entry id -> 전달 횟수 """
+        return {pending['message_id']: pending['times_delivered'] for pending in pendings
+                if pending['times_delivered'] >= self.max_deliveries}
+
+    def bury_exhausted(self, pipe, entries, exhausted):
+        for entry_id, fields in entries:
+            if not fields:
+                # 이미 stream에서 지워진 entry
+                pipe.xack(self.stream_key, self.group, entry_id)
+            else:
+                self.bury_entry(pipe, entry_id, fields, exhausted.get(entry_id, self.max_deliveries))
+
+    def renew(self):
+        entry_ids = [entry_id for _, entry_id, _ in list(self.inflight.values())]
+        if not entry_ids:
+            return 0
+        # XCLAIM으로 idle 시간을 0으로 되돌림 (이미 ack / reap되어 pending이 아닌 entry는 무시됨)
+        return len(self.rq.xclaim(self.stream_key, self.group, self.consumer, 0, entry_ids, justid=True))
+
+    async def renew_async(self):
+        entry_ids = [entry_id for _, entry_id, _ in list(self.inflight.values())]
+        if not entry_ids:
+            return 0
+        return len(await self.get_async_client().xclaim(
+            self.stream_key, self.group, self.consumer, 0, entry_ids, justid=True))
+
+    def is_dead(self, consumer):
+        name = consumer['name']
+        name = name.decode('utf8') if isinstance(name, bytes) else name
+        return (name != self.consumer and consumer['pending'] == 0
+                and consumer['idle'] > self.visibility_timeout * 1000)
+
+    async def close(self):
+        arq = self.arqs.pop(asyncio.get_event_loop(), None)
+        if arq is not None:
+            await arq.close()
+
+
+# 시각(score)이 지난 메시지를 score 순으로 꺼내고, 처리 기한을 score로 기록 (ack 받지 못하면 처리 기한 후 다시 꺼냄)
+# KEYS : frontier / ARGV : 현재 시각, 최대 메시지 수, 처리 기한
+FRONTIER_LEASE_SCRIPT = """
+local elems = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, elem in ipairs(elems) do
+    redis.call('ZADD', KEYS[1], 'XX', ARGV[3], elem)
+end
+return elems
+"""
+
+
+class RedisPriorityQueue(BaseConsumer):
+    """
+        redis sorted set({topic}:frontier)으로 이루어진 우선순위 Broker 클래스
+
+        score는 메시지를 처리할 시각으로, 시각이 지난 메시지를 score가 작은(오래 기다린) 순서대로 꺼냄.
+        crawl이 끝나면 ack_async에서 document에 따라 정한 다음 crawl 시각(CrawlPriority)으로 score를 바꾸므로,
+        인기 있고 활발한 리파짓토리일수록 자주, 오래 방치된 리파짓토리는 드물게 다시 crawl 함
+
+        * 새로 담는 메시지는 score 0 (가장 먼저), database가 있으면 저장된 document로 정함 (id 메시지만)
+          (database가 있으면 put_many_async로만 담을 수 있음)
+          이미 frontier에 있는 메시지는 다시 담아도 score를 바꾸지 않음
+        * 꺼낸 메시지는 지우지 않고 score를 처리 기한(visibility_timeout)으로 바꿔둠
+          (ack 받지 못한 메시지는 처리 기한이 지나면 다시 꺼내지므로 reap이 필요 없음)
+        * retry는 다시 시도할 시각을 score로 담고, bury는 {topic}:dead list로 옮김
+
+        Arguments
+            priority: 다음 crawl 시각을 정하는 CrawlPriority
+            database: 새 메시지의 score를 정할 때 조회할 데이터베이스 (MongoDatabase)
+            visibility_timeout: 메시지 처리 기한(초)
+    """
+
+    def __init__(self, topic, priority:CrawlPriority=None, database=None,
+                 visibility_timeout=600, **redis_kwargs):
+        """
+            host='localhost', port=6379, db=0
+        """
+        self.topic = topic
+        self.redis_kwargs = redis_kwargs
+        self.rq = redis.Redis(**redis_kwargs)
+        self.arqs = weakref.WeakKeyDictionary()
+
+        self.priority = priority or CrawlPriority()
+        self.database = database
+        self.visibility_timeout = visibility_timeout
+
+        self.frontier_key = f"{topic}:frontier"
+        self.dead_key = f"{topic}:dead"
+        # 처리 중인 메시지 -> frontier에 저장된 원본
+        self.inflight = {}
+
+        self.lease_script = self.rq.register_script(FRONTIER_LEASE_SCRIPT)
+
+    def get_async_client(self):
+        loop = asyncio.get_event_loop()
+        arq = self.arqs.get(loop)
+        if arq is None:
+            arq = redis.asyncio.Redis(**self.redis_kwargs)
+            arq.lease_script = arq.register_script(FRONTIER_LEASE_SCRIPT)
+            self.arqs[loop] = arq
+        return arq
+
+    @staticmethod
+    def encode(message):
+        # 같은 메시지는 같은 member가 되도록 key 순서를 고정
+        return json.dumps(message, sort_keys=True)
+
+    def decode(self, elems):
+        messages = []
+        for elem in elems:
+            message = json.loads(elem)
+            self.inflight[id(message)] = (message, elem)
+            messages.append(message)
+        return messages
+
+    def lease_args(self, n):
+        now = time.time()
+        return [now, n, now + self.visibility_timeout]
+
+    def deleteAll(self):
+        return self.rq.delete(self.frontier_key)
+
+    def isEmpty(self):
+        return len(self) == 0
+
+    def put(self, elem):
+        self.put_many([elem])
+
+    def get(self):
+        messages = self.get_many(1)
+        return messages[0] if messages else None
+
+    def __len__(self):
+        """ 처리할 시각이 지난 메시지 수
+        """
+        return self.rq.zcount(self.frontier_key, '-inf', time.time())
+
+    async def len_async(self):
+        return await self.get_async_client().zcount(self.frontier_key, '-inf', time.time())
+
+    def put_many(self, elems):
+        """ database 없이 담기 (모두 score 0)
+        database가 있으면 저장된 document로 score를 정해야 하므로 put_many_async를 사용해야 함
+        """
+        if self.database is not None:
+            raise ValueError("RedisPriorityQueue with database should use put_many_async to score messages")
+        if elems:
+            self.rq.zadd(self.frontier_key, {self.encode(elem): 0. for elem in elems}, nx=True)
+
+    def get_many(self, n):
+        return self.decode(self.lease_script(keys=[self.frontier_key], args=self.lease_args(n)))
+
+    async def put_async(self, elem):
+        await self.put_many_async([elem])
+
+    async def put_many_async(self, elems):
+        if elems:
+            scores = await self.initial_scores(elems)
+            await self.get_async_client().zadd(
+                self.frontier_key, {self.encode(elem): score for elem, score in zip(elems, scores)}, nx=True)
+
+    async def initial_scores(self, elems):
+        """ 새로 담는 메시지들의 score (저장된 document가 있으면 다음 crawl 시각, 없으면 0)
+        """
+        scores = [0.] * len(elems)
+        if self.database is None:
+            return scores
+        node_ids = {repository_node_id(elem['id']): i
+                    for i, elem in enumerate(elems) if isinstance(elem, dict) and 'id' in elem}
+        if node_ids:
+            stored = await self.database.get_many(
+                list(node_ids), projection=['crawledAt', 'pushedAt', 'stargazers', 'forkCount'])
+            for node_id, document in stored.items():
+                scores[node_ids[node_id]] = self.priority.score(document)
+        return scores
+
+    def renew(self):
+        if not self.inflight:
+            return 0
+        # 이미 다음 crawl 시각으로 바뀐 메시지는 그대로 둠 (GT : 처리 기한보다 늦은 score는 바꾸지 않음)
+        deadline = time.time() + self.visibility_timeout
+        leases = {elem: deadline for _, elem in list(self.inflight.values())}
+        return self.rq.zadd(self.frontier_key, leases, xx=True, gt=True, ch=True)
+
+    async def renew_async(self):
+        if not self.inflight:
+            return 0
+        deadline = time.time() + self.visibility_timeout
+        leases = {elem: deadline for _, elem in list(self.inflight.values())}
+        return await self.get_async_client().zadd(self.frontier_key, leases, xx=True, gt=True, ch=True)
+
+    async def get_many_async(self, n, timeout=1.):
+        """ 처리할 시각이 지난 메시지를 score 순으로 최대 n개 가져오기
+        (없으면 다음 메시지의 시각까지, 최대 timeout초 동안 기다린 후 빈 리스트를 반환)
+        """
+        arq = self.get_async_client()
+        messages = self.decode(await arq.lease_script(keys=[self.frontier_key], args=self.lease_args(n)))
+        if not messages:
+            upcoming = await arq.zrange(self.frontier_key, 0, 0, withscores=True)
+            wait = upcoming[0][1] - time.time() if upcoming else timeout
+            await asyncio.sleep(min(max(wait, 0.), timeout))
+        return messages
+
+    def ack(self, message):
+        _, elem = self.inflight.pop(id(message), (None, None))
+        if elem is not None:
+            self.rq.zrem(self.frontier_key, elem)
+
+    async def ack_async(self, message, document=None):
+        """ 처리가 끝난 메시지를 document로 정한 다음 crawl 시각에 다시 담기
+        (document가 없으면 (없는 리파짓토리 등) frontier에서 지움)
+        """
+        _, elem = self.inflight.pop(id(message), (None, None))
+        if document is None:
+            if elem is not None:
+                await self.get_async_client().zrem(self.frontier_key, elem)
+            return
+        await self.replace(elem, message, self.priority.next_score(document))
+
+    async def skip_async(self, message, delay):
+        """ 최근에 crawl한 리파짓토리의 메시지는 지우지 않고 delay초 후로 미룸
+        """
+        _, elem = self.inflight.pop(id(message), (None, None))
+        await self.replace(elem, message, time.time() + delay)
+
+    async def replace(self, elem, message, score):
+        """ 꺼낸 원본(elem)을 재시도 횟수 등 "_"로 시작하는 필드를 뺀 메시지로 바꾸고 score를 정하기
+        (하나의 transaction으로 진행하므로 중간에 실패하더라도 frontier에서 사라지지 않음)
+        """
+        if isinstance(message, dict):
+            message = {k: v for k, v in message.items() if not k.startswith('_')}
+        member = self.encode(message)
+        async with self.get_async_client().pipeline(transaction=True) as pipe:
+            if elem is not None and elem != member.encode('utf8'):
+                pipe.zrem(self.frontier_key, elem)
+            pipe.zadd(self.frontier_key, {member: score})
+            await pipe.execute()
+
+    def nack(self, message, requeue=True):
+        _, elem = self.inflight.pop(id(message), (None, None))
+        if elem is None:
+            return super().nack(message, requeue)
+        if requeue:
+            self.rq.zadd(self.frontier_key, {elem: time.time()}, xx=True)
+        else:
+            self.rq.zrem(self.frontier_key, elem)
+
+    async def nack_async(self, message, requeue=True):
+        _, elem = self.inflight.pop(id(message), (None, None))
+        arq = self.get_async_client()
+        if elem is None:
+            if requeue:
+                await self.put_async(message)
+        elif requeue:
+            await arq.zadd(self.frontier_key, {elem: time.time()}, xx=True)
+        else:
+            await arq.zrem(self.frontier_key, elem)
+
+    def retry(self, message, delay):
+        _, elem = self.inflight.pop(id(message), (None, None))
+        with self.rq.pipeline() as pipe:
+            if elem is not None:
+                pipe.zrem(self.frontier_key, elem)
+            pipe.zadd(self.frontier_key, {self.encode(message): time.time() + delay})
+            pipe.execute()
+
+    async def retry_async(self, message, delay):
+        _, elem = self.inflight.pop(id(message), (None, None))
+        async with self.get_async_client().pipeline() as pipe:
+            if elem is not None:
+                pipe.zrem(self.frontier_key, elem)
+            pipe.zadd(self.frontier_key, {self.encode(message): time.time() + delay})
+            await pipe.execute()
+
+    def bury(self, message, reason=None):
+        _, elem = self.inflight.pop(id(message), (None, None))
+        with self.rq.pipeline() as pipe:
+            if elem is not None:
+                pipe.zrem(self.frontier_key, elem)
+            pipe.lpush(self.dead_key, RedisQueue.dead_letter(message, reason))
+            pipe.execute()
+
+    async def bury_async(self, message, reason=None):
+        _, elem = self.inflight.pop(id(message), (None, None))
+        async with self.get_async_client().pipeline() as pipe:
+            if elem is not None:
+                pipe.zrem(self.frontier_key, elem)
+            pipe.lpush(self.dead_key, RedisQueue.dead_letter(message, reason))
+            await pipe.execute()
 
+    async def close(self):
+        arq = self.arqs.pop(asyncio.get_event_loop(), None)
+        if arq is not None:
+            await arq.close()
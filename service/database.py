@@ -5,9 +5,29 @@ Mail : craftsangjae@gmail.com
 """
 import os
 import abc
+import gzip
 import json
+import time
+import fcntl
+import itertools
+import asyncio
+import weakref
+import threading
+from datetime import datetime, timezone
+from collections import OrderedDict
 from motor.motor_asyncio import AsyncIOMotorClient
-import aiofiles
+from pymongo import ReplaceOne, UpdateOne, IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, PyMongoError
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+from service.document import field_digests, document_digest
 
 
 class BaseDatabase:
@@ -23,65 +43,753 @@ class BaseDatabase:
         """
         pass
 
+    async def put_many(self, documents):
+        """
+        데이터베이스에 여러 document를 저장하기 (기본은 document 별로 put)
+
+        :param documents: document 목록
+        :return: document 별 결과 (성공하면 None, 실패하면 예외)
+        """
+        results = await asyncio.gather(*[self.put(document) for document in documents],
+                                       return_exceptions=True)
+        return [result if isinstance(result, Exception) else None for result in results]
+
+    async def setup(self):
+        """
+        데이터베이스를 사용하기 전 준비 작업 (인덱스 생성 등)
+        """
+        pass
+
+    async def close(self):
+        """
+        남아있는 document를 모두 저장하고 연결 닫기
+        """
+        pass
+
 
 class MongoDatabase(BaseDatabase):
     """
     Crawling document을 MongoDB에 비동기적으로 저장하는 데이터베이스 클래스
+
+    Arguments
+        bulk_size: 모아서 한 번에 저장할 document 수 (1이면 document 별로 바로 저장)
+        flush_interval: bulk_size만큼 모이지 않더라도 저장하기까지 기다리는 최대 시간(초)
+        skip_unchanged: True이면 내용이 바뀌지 않은 document는 저장하지 않고,
+            바뀐 document는 바뀐 필드만 $set으로 저장
+        digest_cache_size: skip_unchanged일 때 메모리에 들고 있을 document digest 수
     """
 
+    # put / get / 재crawl 대상 조회에 사용하는 인덱스
+    INDEXES = [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("repo_id", ASCENDING)], name="repo_id"),
+        IndexModel([("crawledAt", DESCENDING)], name="crawledAt"),
+    ]
+
     def __init__(self,
                  collection,
                  dbname='github',
-                 uri="mongodb://localhost:27017/"):
+                 uri="mongodb://localhost:27017/",
+                 bulk_size=1,
+                 flush_interval=0.5,
+                 skip_unchanged=False,
+                 digest_cache_size=100000):
         self.uri = uri
         self.collection = collection
         self.dbname = dbname
+        self.bulk_size = bulk_size
+        self.flush_interval = flush_interval
+        self.skip_unchanged = skip_unchanged
+        self.digest_cache_size = digest_cache_size
 
-    async def put(self, document: dict):
-        # caution : 이벤트 루프가 충돌할 수 있기 때문에, 넣을 때마다 매번 client를 선언해 주어야 함
-        client = AsyncIOMotorClient(self.uri)
-        collection = client[self.dbname][self.collection]
+        # motor client는 생성된 이벤트 루프에 묶이기 때문에, 이벤트 루프 별로 하나씩 생성해 재사용
+        self.clients = weakref.WeakKeyDictionary()
+        # 이벤트 루프 별로 저장 대기 중인 (upsert 요청, 결과를 전달할 future) 목록
+        self.pending = weakref.WeakKeyDictionary()
+        # id -> (document digest, 필드 별 digest), 마지막으로 저장한 내용 (LRU)
+        self.digests = OrderedDict()
+        self.unchanged = 0
 
+    def get_collection(self):
+        loop = asyncio.get_event_loop()
+        client = self.clients.get(loop)
+        if client is None:
+            client = AsyncIOMotorClient(self.uri)
+            self.clients[loop] = client
+        return client[self.dbname][self.collection]
+
+    async def setup(self):
+        await self.ensure_indexes()
+
+    async def ensure_indexes(self):
+        """ INDEXES 생성 (이미 있는 인덱스는 그대로 둠)
+        """
+        try:
+            await self.get_collection().create_indexes(self.INDEXES)
+        except PyMongoError as e:
+            raise IOError(str(e)) from e
+
+    async def put(self, document: dict):
         if 'id' not in document:
             raise ValueError("document should contain id")
 
-        await collection.replace_one({"id": document["id"]}, document, upsert=True)
-        client.close()
+        if self.bulk_size <= 1:
+            error, = await self.put_many([document])
+            if error is not None:
+                raise error
+            return
+
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        pending = self.pending.setdefault(loop, [])
+        pending.append((document, future))
+        if len(pending) >= self.bulk_size:
+            loop.create_task(self.bulk_write(self.pending.pop(loop)))
+        elif len(pending) == 1:
+            loop.call_later(self.flush_interval, lambda: loop.create_task(self.flush()))
+
+        # flush 결과(성공 / 실패)를 document 별로 전달 받음
+        await future
 
-    async def get(self, document_id):
-        # caution : 이벤트 루프가 충돌할 수 있기 때문에, 넣을 때마다 매번 client를 선언해 주어야 함
-        client = AsyncIOMotorClient(self.uri)
-        collection = client[self.dbname][self.collection]
+    async def make_requests(self, documents):
+        """ document 별 저장 요청 만들기
 
-        res = await collection.find_one({"id": document_id})
-        if res:
-            res.pop('_id', None)
-        client.close()
-        return res
+        skip_unchanged이면 마지막으로 저장한 내용과 비교해서
+        * 처음 저장하는 document : 전체 replace (내용의 digest를 _digest 필드로 함께 저장)
+        * 바뀌지 않은 document : crawledAt만 $set
+        * 바뀐 document : 바뀐 필드만 $set, 없어진 필드는 $unset
+        바뀌지 않은 / 바뀐 document의 요청은 저장된 _digest가 비교한 내용과 같을 때만 적용됨
+        (다른 프로세스가 먼저 저장한 경우, write_requests에서 전체 replace로 다시 저장)
+
+        :param documents: 저장할 document 목록
+        :return: document 순서대로 (저장 요청 (저장할 필요가 없으면 None), 저장 후 기억할 (digest, 필드 별 digest))
+        """
+        if not self.skip_unchanged:
+            return [(ReplaceOne({"id": document["id"]}, document, upsert=True), None)
+                    for document in documents]
+
+        # 캐시에 없는 document는 저장되어 있는 document와 비교
+        missing = list({document['id'] for document in documents} - set(self.digests))
+        if missing:
+            async for stored in self.get_collection().find({"id": {"$in": missing}}):
+                fields = field_digests(stored)
+                self.remember(stored['id'], document_digest(stored, fields), fields)
+
+        requests = []
+        for document in documents:
+            fields = field_digests(document)
+            digest = document_digest(document, fields)
+            prev = self.digests.get(document['id'])
+
+            if prev is None:
+                request = ReplaceOne({"id": document["id"]}, dict(document, _digest=digest), upsert=True)
+            elif prev[0] == digest:
+                self.unchanged += 1
+                # crawl 시각은 digest에 포함되지 않으므로 crawl 시각만 갱신
+                request = None
+                if 'crawledAt' in document:
+                    request = UpdateOne({"id": document["id"], "_digest": prev[0]},
+                                        {"$set": {"crawledAt": document['crawledAt']}})
+            else:
+                update = {"$set": {k: document[k] for k, v in fields.items() if prev[1].get(k) != v}}
+                update["$set"]["_digest"] = digest
+                if 'crawledAt' in document:
+                    update["$set"]["crawledAt"] = document['crawledAt']
+                removed = set(prev[1]) - set(fields)
+                if removed:
+                    update["$unset"] = {k: "" for k in removed}
+                request = UpdateOne({"id": document["id"], "_digest": prev[0]}, update)
+            requests.append((request, (digest, fields)))
+        return requests
+
+    async def write_requests(self, documents, requests, indices):
+        """ indices에 해당하는 저장 요청들을 unordered bulk_write로 저장하고,
+        _digest가 맞지 않아 적용되지 않은 요청의 document는 전체 replace로 다시 저장
+
+        :return: {document 순서: 저장하지 못한 원인(IOError)}
+        """
+        collection = self.get_collection()
+        errors = {}
+        try:
+            result = await collection.bulk_write([requests[i][0] for i in indices], ordered=False)
+            applied = result.matched_count + result.upserted_count
+        except BulkWriteError as e:
+            errors = {indices[error['index']]: IOError(error.get('errmsg', str(error)))
+                      for error in e.details.get('writeErrors', [])}
+            applied = e.details.get('nMatched', 0) + e.details.get('nUpserted', 0)
+        if applied + len(errors) >= len(indices):
+            return errors
+
+        # 조건부 요청 중 적용되지 않은 document 찾기 (저장된 _digest가 저장하려던 digest와 다름)
+        conditional = {documents[i]['id']: i for i in indices
+                       if i not in errors and isinstance(requests[i][0], UpdateOne)}
+        stale = dict(conditional)
+        async for stored in collection.find({"id": {"$in": list(conditional)}}, ["id", "_digest"]):
+            if stored.get('_digest') == requests[conditional[stored['id']]][1][0]:
+                stale.pop(stored['id'], None)
+        if not stale:
+            return errors
+
+        retries = list(stale.values())
+        try:
+            await collection.bulk_write([
+                ReplaceOne({"id": documents[i]["id"]}, dict(documents[i], _digest=requests[i][1][0]), upsert=True)
+                for i in retries], ordered=False)
+        except BulkWriteError as e:
+            errors.update({retries[error['index']]: IOError(error.get('errmsg', str(error)))
+                           for error in e.details.get('writeErrors', [])})
+        return errors
+
+    def remember(self, document_id, digest, fields):
+        self.digests[document_id] = (digest, fields)
+        self.digests.move_to_end(document_id)
+        while len(self.digests) > self.digest_cache_size:
+            self.digests.popitem(last=False)
+
+    async def put_many(self, documents):
+        """ 여러 document를 bulk_size와 관계없이 한 번의 bulk_write로 저장
+        """
+        loop = asyncio.get_event_loop()
+        pending = [(document, loop.create_future()) for document in documents]
+        if pending:
+            await self.bulk_write(pending)
+        return [future.exception() for _, future in pending]
+
+    async def flush(self):
+        """ 저장 대기 중인 document들을 모두 저장
+        """
+        pending = self.pending.pop(asyncio.get_event_loop(), None)
+        if pending:
+            await self.bulk_write(pending)
+
+    async def bulk_write(self, pending):
+        """ (document, future) 목록을 unordered bulk_write로 한 번에 저장하고,
+        document 별 결과를 future로 전달
+        """
+        documents, futures = zip(*pending)
+
+        errors = {}
+        requests = None
+        try:
+            requests = await self.make_requests(documents)
+            # 저장할 필요가 없는 document는 제외
+            indices = [i for i, (request, _) in enumerate(requests) if request is not None]
+            if indices:
+                errors = await self.write_requests(documents, requests, indices)
+        except Exception as e:
+            # 연결 오류 등으로 bulk_write 자체가 실패한 경우, 모든 document에 실패 전달
+            errors = {i: IOError(str(e)) for i in range(len(futures))}
+
+        for i, future in enumerate(futures):
+            if i in errors:
+                # 저장하지 못한 document는 다음 저장 때 다시 비교
+                self.digests.pop(documents[i]['id'], None)
+            elif requests is not None and requests[i][1] is not None:
+                # 저장에 성공한 내용만 기억
+                self.remember(documents[i]['id'], *requests[i][1])
+            # 요청한 쪽에서 timeout으로 취소한 경우
+            if future.done():
+                continue
+            if i in errors:
+                future.set_exception(errors[i])
+            else:
+                future.set_result(None)
+
+    async def close(self):
+        await self.flush()
+        client = self.clients.pop(asyncio.get_event_loop(), None)
+        if client is not None:
+            client.close()
+
+    async def get(self, document_id, projection=None):
+        """ id로 document 조회
+
+        :param document_id: document의 id
+        :param projection: 가져올 필드 목록 (None이면 전체)
+        :return: document (없으면 None)
+        """
+        res = await self.get_collection().find_one({"id": document_id}, projection)
+        return self.strip(res)
+
+    async def get_many(self, document_ids, projection=None):
+        """ 여러 id의 document를 한 번의 요청으로 조회
+
+        :param document_ids: document id 목록
+        :param projection: 가져올 필드 목록 (None이면 전체)
+        :return: {id: document} (없는 id는 제외)
+        """
+        if projection is not None and 'id' not in projection:
+            projection = list(projection) + ['id']
+        documents = {}
+        async for res in self.get_collection().find({"id": {"$in": list(document_ids)}}, projection):
+            documents[res['id']] = self.strip(res)
+        return documents
+
+    @staticmethod
+    def strip(document):
+        """ 저장할 때 붙는 필드(_id, _digest) 제외
+        """
+        if document:
+            document.pop('_id', None)
+            document.pop('_digest', None)
+        return document
 
     async def deleteAll(self):
-        client = AsyncIOMotorClient(self.uri)
-        collection = client[self.dbname][self.collection]
-        await collection.drop()
-        client.close()
+        await self.get_collection().drop()
 
-    async def count(self):
-        client = AsyncIOMotorClient(self.uri)
-        collection = client[self.dbname][self.collection]
-        res = await collection.count_documents({})
-        client.close()
-        return res
+    async def count(self, query=None):
+        """ document 수 (query가 없으면 collection 메타데이터로 추정한 값, 전체 scan 하지 않음)
+        """
+        if query is None:
+            return await self.get_collection().estimated_document_count()
+        return await self.get_collection().count_documents(query)
 
 
 class FileSystemDatabase(BaseDatabase):
     """
-    Crawling document을 FileSystem에 비동기적으로 저장하는 데이터베이스 클래스
+    Crawling document을 FileSystem에 JSON Lines로 저장하는 데이터베이스 클래스
+    * 하나의 writer task가 bounded queue에서 document들을 모아 chunk 단위로 기록
+      (파일 I/O와 압축은 executor에서 진행해 이벤트 루프를 막지 않음)
+    * put은 document가 파일에 기록된 후 반환 (기록에 실패하면 IOError)
+    * max_bytes / rotate_interval을 넘으면 새 파일로 교체
+      (rotation을 사용하면 파일 이름은 {fpath 이름}-{열린 시각}-{번호}{확장자})
+
+    Arguments
+        fpath: 저장할 파일 경로
+        compression: None, 'gzip', 'zstd' (zstd는 zstandard 패키지 필요)
+        max_bytes: 파일 하나의 최대 크기 (압축 후 기준, None이면 제한 없음)
+        rotate_interval: 파일 하나에 기록하는 최대 시간(초, None이면 제한 없음)
+        queue_size: 기록 대기 중인 document의 최대 수 (가득 차면 put이 대기)
+        chunk_size: 한 번에 기록하는 최대 크기(byte)
+        flush_interval: chunk_size만큼 모이지 않더라도 기록하기까지 기다리는 최대 시간(초)
+        fsync_interval: 디스크에 fsync하는 주기(초, None이면 파일을 닫을 때만)
     """
+    SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+    def __init__(self,
+                 fpath,
+                 compression=None,
+                 max_bytes=None,
+                 rotate_interval=None,
+                 queue_size=10000,
+                 chunk_size=1 << 20,
+                 flush_interval=1.,
+                 fsync_interval=None):
+        if compression not in self.SUFFIXES:
+            raise ValueError(f"compression should be one of {list(self.SUFFIXES)}")
+        if compression == "zstd" and zstandard is None:
+            raise ValueError("zstd compression requires zstandard package")
 
-    def __init__(self, fpath):
         self.fpath = fpath
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.queue_size = queue_size
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
         os.makedirs(os.path.dirname(self.fpath), exist_ok=True)
 
+        # 이벤트 루프 별 (queue, writer task)
+        self.writers = weakref.WeakKeyDictionary()
+        # 현재 기록 중인 파일 (executor 스레드에서 사용)
+        self.lock = threading.Lock()
+        self.raw = None
+        self.stream = None
+        self.opened_at = 0.
+        self.synced_at = 0.
+        self.num_files = 0
+
+    def get_queue(self):
+        loop = asyncio.get_event_loop()
+        writer = self.writers.get(loop)
+        if writer is None:
+            queue = asyncio.Queue(self.queue_size)
+            writer = (queue, loop.create_task(self.write_forever(queue)))
+            self.writers[loop] = writer
+        return writer[0]
+
     async def put(self, document: dict):
-        async with aiofiles.open(self.fpath, 'a+') as f:
-            await f.write(json.dumps(document) + '\n')
+        future = asyncio.get_event_loop().create_future()
+        await self.get_queue().put(((json.dumps(document) + '\n').encode('utf8'), future, False))
+        await future
+
+    async def put_many(self, documents):
+        """ 여러 document를 하나의 chunk로 기록 (이미 모아서 저장하므로 flush_interval을 기다리지 않음)
+        """
+        if not documents:
+            return []
+        future = asyncio.get_event_loop().create_future()
+        data = "".join(json.dumps(document) + '\n' for document in documents).encode('utf8')
+        await self.get_queue().put((data, future, True))
+        try:
+            await future
+        except IOError as e:
+            return [e] * len(documents)
+        return [None] * len(documents)
+
+    async def write_forever(self, queue):
+        """ queue에서 document들을 chunk_size 혹은 flush_interval만큼 모아 기록
+        (put_many로 받은 chunk는 바로 기록, None을 받으면 남은 document를 기록하고 파일을 닫은 후 종료)
+        """
+        loop = asyncio.get_event_loop()
+        closed = False
+        while not closed:
+            lines, futures = [], []
+            size = 0
+            deadline = None
+            while size < self.chunk_size:
+                try:
+                    if deadline is None:
+                        item = await queue.get()
+                        deadline = loop.time() + self.flush_interval
+                    else:
+                        item = await asyncio.wait_for(queue.get(), max(deadline - loop.time(), 0))
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    closed = True
+                    break
+                data, future, urgent = item
+                lines.append(data)
+                futures.append(future)
+                size += len(data)
+                if urgent:
+                    break
+
+            error = None
+            try:
+                if lines:
+                    await loop.run_in_executor(None, self.write_chunk, b"".join(lines))
+                if closed:
+                    await loop.run_in_executor(None, self.close_file)
+            except Exception as e:
+                print(e)
+                error = IOError(str(e))
+
+            for future in futures:
+                # 요청한 쪽에서 timeout으로 취소한 경우
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(None)
+
+    def write_chunk(self, data):
+        """ (executor) 필요하면 파일을 교체하고 chunk 기록
+        """
+        with self.lock:
+            now = time.time()
+            if self.stream is None:
+                self.open_file(now)
+            elif ((self.max_bytes and self.raw.tell() >= self.max_bytes)
+                  or (self.rotate_interval and now - self.opened_at >= self.rotate_interval)):
+                self.finish_file()
+                self.open_file(now)
+
+            self.stream.write(data)
+            if self.fsync_interval is not None and now - self.synced_at >= self.fsync_interval:
+                self.sync()
+                self.synced_at = now
+
+    def file_name(self, now):
+        if not self.max_bytes and not self.rotate_interval:
+            return self.fpath + self.SUFFIXES[self.compression]
+        root, ext = os.path.splitext(self.fpath)
+        opened = time.strftime("%Y%m%dT%H%M%S", time.gmtime(now))
+        return f"{root}-{opened}-{self.num_files:04d}{ext}{self.SUFFIXES[self.compression]}"
+
+    def open_file(self, now):
+        self.raw = open(self.file_name(now), 'ab')
+        if self.compression == "gzip":
+            self.stream = gzip.GzipFile(fileobj=self.raw, mode='ab')
+        elif self.compression == "zstd":
+            self.stream = zstandard.ZstdCompressor().stream_writer(self.raw)
+        else:
+            self.stream = self.raw
+        self.opened_at = self.synced_at = now
+        self.num_files += 1
+
+    def sync(self):
+        self.stream.flush()
+        self.raw.flush()
+        os.fsync(self.raw.fileno())
+
+    def close_file(self):
+        """ (executor) 현재 파일 닫기
+        """
+        with self.lock:
+            self.finish_file()
+
+    def finish_file(self):
+        """ 압축 스트림을 마무리하고 fsync 후 파일 닫기
+        """
+        if self.stream is None:
+            return
+        try:
+            if self.stream is not self.raw:
+                # 압축 스트림을 닫아야 마지막 블록이 기록됨 (raw 파일은 닫지 않음)
+                if self.compression == "zstd":
+                    self.stream.flush(zstandard.FLUSH_FRAME)
+                else:
+                    self.stream.close()
+            self.raw.flush()
+            os.fsync(self.raw.fileno())
+        finally:
+            self.raw.close()
+            self.raw = self.stream = None
+
+    async def close(self):
+        writer = self.writers.pop(asyncio.get_event_loop(), None)
+        if writer is not None:
+            queue, task = writer
+            await queue.put(None)
+            await task
+
+
+# ParquetDatabase의 고정 schema (parse_repository 결과의 필드 + crawl 시각)
+REPOSITORY_COLUMNS = [
+    ("id", "string"), ("repo_id", "int64"), ("name", "string"), ("owner", "string"),
+    ("homepageUrl", "string"), ("openGraphImageUrl", "string"), ("description", "string"),
+    ("createdAt", "timestamp"), ("updatedAt", "timestamp"), ("pushedAt", "timestamp"),
+    ("crawledAt", "timestamp"),
+    ("diskUsage", "int64"), ("forkCount", "int64"),
+    ("hasWikiEnabled", "bool"), ("hasIssuesEnabled", "bool"), ("hasProjectsEnabled", "bool"),
+    ("isFork", "bool"), ("isArchived", "bool"), ("isDisabled", "bool"), ("isEmpty", "bool"),
+    ("isLocked", "bool"), ("isMirror", "bool"), ("isPrivate", "bool"), ("isTemplate", "bool"),
+    ("mergeCommitAllowed", "bool"),
+    ("watchers", "int64"), ("stargazers", "int64"), ("commitComments", "int64"),
+    ("pullRequests", "int64"), ("releases", "int64"), ("labels", "int64"), ("deployments", "int64"),
+    ("primaryLanguage", "string"), ("licenseInfo", "string"),
+    ("languages", "list<string>"), ("repositoryTopics", "list<string>"),
+]
+
+
+def parse_timestamp(value):
+    """ github의 ISO 8601 시각 문자열을 UTC datetime으로 변환 (없거나 형식이 다르면 None)
+    """
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+
+class ParquetDatabase(BaseDatabase):
+    """
+    Crawling document을 고정 schema(REPOSITORY_COLUMNS)의 Parquet 파일로 저장하는 데이터베이스 클래스
+    (pyarrow 패키지 필요)
+    * crawl 날짜 별로 {root}/dt=YYYY-MM-DD/ 아래에 partition해서 저장
+    * schema에 없는 필드는 버리고, 없는 필드는 null로 기록
+
+    parquet 파일은 footer를 쓰기 전에는 읽을 수 없으므로, document는 먼저 write-ahead log({root}/_wal/)에 기록
+    * put / put_many는 document를 log에 기록(fsync)한 후 반환 (기록에 실패하면 IOError,
+      schema로 변환할 수 없는 document는 ValueError)
+    * log에 row_group_size개가 쌓이면 partition 별로 parquet 파일 하나씩 기록(임시 파일에 쓴 후 이름 변경)하고 log를 지움
+    * 파일로 옮기기 전에 프로세스가 죽으면, 다음 setup 때 남아있는 log를 parquet 파일로 옮김
+      (log는 쓰는 동안 flock으로 잠가두므로, 다른 프로세스가 쓰고 있는 log는 옮기지 않음)
+
+    Arguments
+        root: 저장할 디렉토리
+        row_group_size: 파일 하나(row group 하나)의 최대 document 수
+        compression: parquet 압축 방식 ('zstd', 'snappy', 'gzip', None)
+        fsync: put 마다 log를 디스크에 fsync할지 여부
+    """
+    TYPES = {
+        "string": lambda: pyarrow.string(),
+        "int64": lambda: pyarrow.int64(),
+        "bool": lambda: pyarrow.bool_(),
+        "timestamp": lambda: pyarrow.timestamp('s', tz='UTC'),
+        "list<string>": lambda: pyarrow.list_(pyarrow.string()),
+    }
+
+    def __init__(self, root, row_group_size=100000, compression='zstd', fsync=True):
+        if pyarrow is None:
+            raise ValueError("ParquetDatabase requires pyarrow package")
+        self.root = root
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.fsync = fsync
+        self.schema = pyarrow.schema([(name, self.TYPES[kind]()) for name, kind in REPOSITORY_COLUMNS])
+        self.wal_dir = os.path.join(self.root, "_wal")
+        os.makedirs(self.wal_dir, exist_ok=True)
+
+        # 현재 log 파일과 log에 기록한 partition 별 table 목록 (executor 스레드에서 사용)
+        self.lock = threading.Lock()
+        self.wal = None
+        self.tables = {}
+        self.num_rows = 0
+        # log / parquet 파일 이름의 번호 (여러 executor 스레드에서 사용)
+        self.counter = itertools.count(1)
+
+    @staticmethod
+    def partition(document):
+        crawled_at = document.get('crawledAt')
+        if isinstance(crawled_at, str) and len(crawled_at) >= 10:
+            return crawled_at[:10]
+        return time.strftime("%Y-%m-%d", time.gmtime())
+
+    async def setup(self):
+        """ 이전에 죽은 프로세스가 남긴 log를 parquet 파일로 옮기기
+        """
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, self.recover)
+        except Exception as e:
+            raise IOError(str(e))
+
+    async def put(self, document: dict):
+        result = (await self.put_many([document]))[0]
+        if result is not None:
+            raise result
+
+    async def put_many(self, documents):
+        """ document들을 log에 기록 (row_group_size개가 쌓였으면 parquet 파일로 옮긴 후 반환)
+
+        :return: document 별 결과 (성공하면 None, 실패하면 예외)
+        """
+        if not documents:
+            return []
+        try:
+            return await asyncio.get_event_loop().run_in_executor(None, self.write_documents, documents)
+        except Exception as e:
+            print(e)
+            return [IOError(str(e))] * len(documents)
+
+    def write_documents(self, documents):
+        """ (executor) schema로 변환한 document들을 log에 기록하고, 쌓인 document가 많으면 parquet 파일로 옮기기
+        """
+        results, groups = self.to_tables(documents)
+        with self.lock:
+            if self.wal is None:
+                self.open_wal()
+            self.wal.write("".join(json.dumps(document) + '\n'
+                                   for document, result in zip(documents, results) if result is None))
+            self.wal.flush()
+            if self.fsync:
+                os.fsync(self.wal.fileno())
+            for partition, table in groups.items():
+                self.tables.setdefault(partition, []).append(table)
+                self.num_rows += table.num_rows
+            checkpoint = self.rotate() if self.num_rows >= self.row_group_size else None
+        if checkpoint is not None:
+            self.checkpoint(*checkpoint)
+        return results
+
+    def to_tables(self, documents):
+        """ document들을 partition 별 table로 변환 (변환할 수 없는 document는 결과에 ValueError)
+
+        :return: (document 별 결과, {partition: table})
+        """
+        results = [None] * len(documents)
+        batches = {}
+        for i, document in enumerate(documents):
+            if 'id' not in document:
+                results[i] = ValueError("document should contain id")
+            else:
+                batches.setdefault(self.partition(document), []).append(i)
+
+        groups = {}
+        for partition, indices in batches.items():
+            try:
+                groups[partition] = self.to_table([documents[i] for i in indices])
+                continue
+            except (ValueError, TypeError, pyarrow.ArrowException):
+                pass
+            # 변환할 수 없는 document만 골라내기
+            valid = []
+            for i in indices:
+                try:
+                    self.to_table([documents[i]])
+                    valid.append(i)
+                except (ValueError, TypeError, pyarrow.ArrowException) as e:
+                    results[i] = ValueError(f"invalid document {documents[i].get('id')}: {e}")
+            if valid:
+                groups[partition] = self.to_table([documents[i] for i in valid])
+        return results, groups
+
+    def to_table(self, documents):
+        """ document 목록을 schema에 맞는 column들로 변환
+        """
+        columns = {}
+        for name, kind in REPOSITORY_COLUMNS:
+            values = [document.get(name) for document in documents]
+            if kind == "timestamp":
+                values = [parse_timestamp(value) for value in values]
+            columns[name] = values
+        return pyarrow.Table.from_pydict(columns, schema=self.schema)
+
+    def open_wal(self):
+        path = os.path.join(self.wal_dir, f"{os.getpid()}-{int(time.time())}-{next(self.counter):05d}.jsonl")
+        self.wal = open(path, 'a')
+        fcntl.flock(self.wal.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def rotate(self):
+        """ (lock 안에서) 현재 log와 table들을 떼어내고 새 log로 교체
+
+        :return: (떼어낸 log 파일, {partition: [table, ...]})
+        """
+        wal, tables = self.wal, self.tables
+        self.wal, self.tables, self.num_rows = None, {}, 0
+        return wal, tables
+
+    def checkpoint(self, wal, tables):
+        """ (executor) 떼어낸 log의 table들을 parquet 파일로 옮긴 후 log 지우기
+        (실패하면 log를 남겨두고 다음 setup 때 다시 옮김)
+        """
+        try:
+            for partition, parts in tables.items():
+                self.write_file(partition, pyarrow.concat_tables(parts))
+        except Exception as e:
+            print(e)
+            wal.close()
+            return
+        os.remove(wal.name)
+        wal.close()
+
+    def write_file(self, partition, table):
+        """ (executor) 임시 파일에 기록 후 이름을 바꿔, 완성된 parquet 파일만 보이도록 함
+        """
+        dirname = os.path.join(self.root, f"dt={partition}")
+        os.makedirs(dirname, exist_ok=True)
+        created = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+        name = f"part-{created}-{os.getpid()}-{next(self.counter):05d}.parquet"
+        temp = os.path.join(dirname, f".{name}.tmp")
+        pyarrow.parquet.write_table(table, temp, row_group_size=table.num_rows, compression=self.compression)
+        with open(temp, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(temp, os.path.join(dirname, name))
+
+    def recover(self):
+        """ (executor) 잠겨있지 않은(쓰던 프로세스가 죽은) log들을 parquet 파일로 옮기기
+        """
+        for name in sorted(os.listdir(self.wal_dir)):
+            path = os.path.join(self.wal_dir, name)
+            with open(path) as wal:
+                try:
+                    fcntl.flock(wal.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue
+                documents = []
+                for line in wal:
+                    try:
+                        documents.append(json.loads(line))
+                    except ValueError:
+                        # 죽기 직전 기록하다 만 줄
+                        continue
+                _, groups = self.to_tables(documents)
+                for partition, table in groups.items():
+                    self.write_file(partition, table)
+                os.remove(path)
+
+    async def close(self):
+        def close_wal():
+            with self.lock:
+                checkpoint = self.rotate() if self.wal is not None else None
+            if checkpoint is not None:
+                self.checkpoint(*checkpoint)
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, close_wal)
+        except Exception as e:
+            print(e)
@@ -0,0 +1,164 @@
+"""
+Copyright 2020, All rights reserved.
+Author : SangJae Kang
+Mail : craftsangjae@gmail.com
+"""
+import time
+import asyncio
+import weakref
+import redis.asyncio
+from collections import OrderedDict
+
+
+class FreshnessFilter(object):
+    """
+    최근에 crawl한 리파짓토리의 메시지를 걸러내는 클래스
+    freshness초 안에 crawl한 리파짓토리, 그리고 지금 crawl 중인 리파짓토리는 다시 가져오지 않는다.
+
+    * in-process LRU : 리파짓토리 -> 마지막 crawl 시각 (최대 maxsize개)
+    * redis sorted set ({topic}) : 리파짓토리 -> 마지막 crawl 시각, 여러 프로세스 / 노드가 공유
+      (redis_kwargs가 없으면 in-process LRU만 사용)
+
+    리파짓토리는 "owner/name"(소문자)와 "id:{repo_id}" 두 가지 key로 구분하며,
+    crawl이 끝나면 document로부터 두 key를 모두 기록한다.
+
+    Usages
+
+    >>> dedup = FreshnessFilter(freshness=86400, host="redis")
+
+    # crawl할 메시지와 건너뛸 메시지 나누기
+    >>> messages, skipped = (await dedup.filter_async(messages))
+
+    # crawl 완료 / 실패
+    >>> (await dedup.mark_async(message, document))
+    >>> dedup.release(message)
+
+    """
+    def __init__(self, freshness=86400, maxsize=1000000, topic="crawled", **redis_kwargs):
+        self.freshness = freshness
+        self.maxsize = maxsize
+        self.topic = topic
+        self.redis_kwargs = redis_kwargs
+        self.arqs = weakref.WeakKeyDictionary()
+
+        self.cache = OrderedDict()
+        self.inflight = set()
+        self.skipped = 0
+        self.num_marked = 0
+
+    def get_async_client(self):
+        if not self.redis_kwargs:
+            return None
+        loop = asyncio.get_event_loop()
+        arq = self.arqs.get(loop)
+        if arq is None:
+            arq = redis.asyncio.Redis(**self.redis_kwargs)
+            self.arqs[loop] = arq
+        return arq
+
+    @staticmethod
+    def message_key(message):
+        if not isinstance(message, dict):
+            return None
+        if 'owner' in message and 'name' in message:
+            return f"{message['owner']}/{message['name']}".lower()
+        if 'id' in message:
+            return f"id:{message['id']}"
+        return None
+
+    @staticmethod
+    def document_keys(document):
+        keys = []
+        if document.get('owner') and document.get('name'):
+            keys.append(f"{document['owner']}/{document['name']}".lower())
+        if document.get('repo_id', -1) != -1:
+            keys.append(f"id:{document['repo_id']}")
+        return keys
+
+    def is_fresh(self, crawled_at, now):
+        return crawled_at is not None and now - float(crawled_at) < self.freshness
+
+    async def filter_async(self, messages):
+        """ crawl할 메시지와 건너뛸 메시지 나누기
+
+        :param messages: 브로커에서 가져온 메시지 목록
+        :return: (crawl할 메시지 목록, 건너뛸 메시지 목록)
+        """
+        now = time.time()
+        keys = [self.message_key(message) for message in messages]
+
+        # in-process LRU에 없는 key만 redis에서 확인
+        remote = [key for key in set(keys) if key is not None
+                  and key not in self.inflight and not self.is_fresh(self.cache.get(key), now)]
+        arq = self.get_async_client()
+        if arq is not None and remote:
+            async with arq.pipeline(transaction=False) as pipe:
+                for key in remote:
+                    pipe.zscore(self.topic, key)
+                for key, crawled_at in zip(remote, await pipe.execute()):
+                    if crawled_at is not None:
+                        self.remember(key, crawled_at)
+
+        fresh_messages, skipped_messages = [], []
+        for message, key in zip(messages, keys):
+            if key is not None and (key in self.inflight or self.is_fresh(self.cache.get(key), now)):
+                skipped_messages.append(message)
+            else:
+                if key is not None:
+                    self.inflight.add(key)
+                fresh_messages.append(message)
+        self.skipped += len(skipped_messages)
+        return fresh_messages, skipped_messages
+
+    async def crawled_async(self, messages):
+        """ 메시지 별로 freshness 안에 crawl한 리파짓토리인지 확인 (crawl 중 목록에 넣지 않음)
+
+        :param messages: 메시지 목록
+        :return: 메시지 별 bool
+        """
+        now = time.time()
+        keys = [self.message_key(message) for message in messages]
+        scores = dict.fromkeys(keys)
+        arq = self.get_async_client()
+        remote = [key for key in scores if key is not None]
+        if arq is not None and remote:
+            async with arq.pipeline(transaction=False) as pipe:
+                for key in remote:
+                    pipe.zscore(self.topic, key)
+                scores.update(zip(remote, await pipe.execute()))
+        return [key is not None and (self.is_fresh(scores[key], now) or self.is_fresh(self.cache.get(key), now))
+                for key in keys]
+
+    async def mark_async(self, message, document=None):
+        """ crawl이 끝난 리파짓토리 기록하기
+        """
+        now = time.time()
+        self.release(message)
+        keys = {self.message_key(message)} | set(self.document_keys(document or {}))
+        keys.discard(None)
+        for key in keys:
+            self.remember(key, now)
+
+        arq = self.get_async_client()
+        if arq is not None and keys:
+            await arq.zadd(self.topic, {key: now for key in keys})
+            # 주기적으로 freshness가 지난 기록 지우기
+            self.num_marked += 1
+            if self.num_marked % 10000 == 0:
+                await arq.zremrangebyscore(self.topic, '-inf', now - self.freshness)
+
+    def release(self, message):
+        """ crawl이 실패한 리파짓토리를 crawl 중 목록에서 제외
+        """
+        self.inflight.discard(self.message_key(message))
+
+    def remember(self, key, crawled_at):
+        self.cache[key] = float(crawled_at)
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+
+    async def close(self):
+        arq = self.arqs.pop(asyncio.get_event_loop(), None)
+        if arq is not None:
+            await arq.close()
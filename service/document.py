@@ -3,18 +3,57 @@ Copyright 2020, All rights reserved.
 Author : SangJae Kang
 Mail : craftsangjae@gmail.com
 """
+import json
 import base64
+import hashlib
 from dateutil.parser import parse as parse_date
 
 
-def parse_repository(query):
-    if 'data' in query and 'repository' in query['data']:
-        document = query['data']['repository']
+def parse_repository(query, alias='repository'):
+    """ graphQL 응답에서 alias에 해당하는 리파짓토리 정보를 document로 변환
+
+    :param query: graphQL 응답
+    :param alias: 리파짓토리 필드의 이름 (배치 Query의 경우 r0, r1, ...)
+    :return: document
+    """
+    if 'data' in query and isinstance(query['data'], dict) and alias in query['data']:
+        document = query['data'][alias]
         if not isinstance(document, dict):
-            raise ValueError(str(query))
+            # 배치 Query의 경우, 해당 alias의 에러만 전달
+            raise ValueError(str(parse_errors(query).get(alias, query)))
     else:
         raise ValueError("query" + str(query))
+    return parse_repository_document(document)
+
+
+def parse_repository_nodes(query):
+    """ nodes(ids: [...]) 응답을 document 목록으로 변환
+
+    :param query: graphQL 응답
+    :return: 요청한 id 순서대로 document (조회하지 못한 id는 ValueError)
+    """
+    if 'data' in query and isinstance(query['data'], dict) and isinstance(query['data'].get('nodes'), list):
+        nodes = query['data']['nodes']
+    else:
+        raise ValueError("query" + str(query))
+
+    errors = {}
+    for error in parse_errors(query).get('nodes', []):
+        if len(error.get('path', [])) > 1:
+            errors[error['path'][1]] = error
 
+    documents = []
+    for i, node in enumerate(nodes):
+        if isinstance(node, dict) and 'id' in node:
+            documents.append(parse_repository_document(node))
+        else:
+            documents.append(ValueError(str(errors.get(i, node))))
+    return documents
+
+
+def parse_repository_document(document):
+    """ graphQL의 Repository 필드를 저장할 document 형태로 변환
+    """
     for k, v in document.items():
         if k == 'owner':
             document[k] = v.get('login', "")
@@ -57,6 +96,54 @@ def parse_repository(query):
     return document
 
 
+def parse_errors(query):
+    """ graphQL 응답의 errors를 path의 첫번째 필드(alias) 별로 묶기
+
+    :param query: graphQL 응답
+    :return: {alias: [error, ...]}
+    """
+    errors = {}
+    for error in query.get('errors') or []:
+        path = error.get('path') or [None]
+        errors.setdefault(path[0], []).append(error)
+    return errors
+
+
+def repository_node_id(repo_id):
+    """ 리파짓토리의 숫자 id를 graphQL의 global node id로 변환 (document의 repo_id를 구하는 과정의 역)
+
+    >>> repository_node_id(142940093)
+    'MDEwOlJlcG9zaXRvcnkxNDI5NDAwOTM='
+    """
+    return base64.b64encode(f"010:Repository{repo_id}".encode('utf8')).decode('utf8')
+
+
+# digest 계산에서 제외하는 필드 (저장할 때 붙는 메타 정보, crawl 시각)
+DIGEST_EXCLUDE_FIELDS = {'_id', '_digest', 'crawledAt'}
+
+
+def field_digests(document):
+    """ document의 필드 별 digest
+
+    :param document: parse_repository의 결과
+    :return: {필드: 값의 digest}
+    """
+    return {k: hashlib.sha1(json.dumps(v, sort_keys=True, default=str).encode('utf8')).hexdigest()[:16]
+            for k, v in document.items() if k not in DIGEST_EXCLUDE_FIELDS}
+
+
+def document_digest(document, digests=None):
+    """ document 내용의 digest (필드 순서와 무관하게 같은 내용이면 같은 값)
+
+    :param document: parse_repository의 결과
+    :param digests: 미리 계산한 field_digests(document)
+    :return: digest 문자열
+    """
+    if digests is None:
+        digests = field_digests(document)
+    return hashlib.sha1(json.dumps(digests, sort_keys=True).encode('utf8')).hexdigest()
+
+
 def parse_rateLimit(query):
     if "data" in query and 'rateLimit' in query['data']:
         limit_result = query['data']['rateLimit']
@@ -65,3 +152,11 @@ def parse_rateLimit(query):
     else:
         raise ValueError(str(query))
 
+
+def parse_cost(query):
+    """ graphQL 응답의 rateLimit에서 요청에 실제로 쓰인 할당량(cost) 가져오기 (없으면 None)
+    """
+    try:
+        return int(query['data']['rateLimit']['cost'])
+    except (KeyError, TypeError, ValueError):
+        return None
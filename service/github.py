@@ -4,27 +4,45 @@ Author : SangJae Kang
 Mail : craftsangjae@gmail.com
 """
 import asyncio
-import requests
-from collections import OrderedDict
+import heapq
+import time
+import random
+import hashlib
+import itertools
+import weakref
+import aiohttp
+import redis
+import redis.asyncio
+from collections import OrderedDict, deque
 from datetime import datetime, timedelta
 import dateutil
-from dateutil.parser import parse as parse_date
 from service.query import GETLIMIT_QUERY, GITHUB_GQL
+from service.document import parse_rateLimit
 import os
 
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 GITHUB_KEY_PATH = os.path.join(ROOT_DIR, "credentials/github.txt")
+# Github graphQL API의 시간당 기본 할당량
+DEFAULT_LIMIT = 5000
 
 
 class GithubKeyGen(object):
     """
     복수개의 Github API Key를 관리하는 Singleton 객체를 생성하는 클래스
     GITHUB_KEY_PATH 에는 line 별로 github API Key가 저장되어 있다.
-    github key가 Round-Robin 방식으로 돌면서 할당량을 소모해간다.
+    할당량이 가장 많이 남은 키부터 할당량을 예약(reserve)해 사용한다.
 
-    **의견**
-        Github Key가 수백개로 넘어가게 되면, Max-Heap 방식을 고민할 테지만,
-        지금은 Round-Robin 방식으로도 충분하다고 생각
+    **구현**
+        Github Key가 수백개로 넘어가더라도 O(log n)으로 키를 할당하기 위해 아래 두 Heap을 사용
+        * key heap : 남은 할당량이 많은 순 (같으면 resetAt이 빠른 키 우선)
+        * reset heap : resetAt이 빠른 순
+        Heap의 원소는 갱신 시 무효화(lazy deletion)하고 새로 추가한다.
+
+        모든 키의 할당량이 바닥난 경우, 가장 빠른 resetAt에 맞춰 초기화된 키의 할당량만큼만
+        대기 중인 요청을 깨운다.
+
+        키의 검증 / 할당량 조회는 비동기로 최대 concurrency개씩 동시에 진행하며,
+        resetAt이 지난 키만 background에서 다시 조회한다. (폐기된 키는 pool에서 제외)
 
     Issues
     * https://github.com/vienna-project/recohub/issues/2
@@ -34,30 +52,95 @@ class GithubKeyGen(object):
     # 아래에 선언된 GithubKey을 이용해야 함
     >>> GithubKey = GithubKeyGen()
 
-    # API 할당량이 남은 키 가져오기
+    # 코루틴 안에서는 키를 불러오지 않고 만든 후 await setup() (이벤트 루프를 중첩해 실행할 수 없음)
+    >>> GithubKey = GithubKeyGen(load=False)
+    >>> (await GithubKey.setup())
+
+    # API 할당량이 남은 키 가져오기 (할당량 1 예약)
     >>> (await GithubKey.get_async())
 
-    # 키의 할당량 갱신하기
-    >>> (await GithubKey.set_async(remain, resetAt))
+    # 응답으로 받은 rateLimit으로 키의 할당량 갱신하기 (예약 확정)
+    >>> (await GithubKey.set_async(key, remain, resetAt))
+
+    # 요청이 실패한 경우, 예약한 할당량 돌려주기
+    >>> GithubKey.release(key)
 
     """
-    def __init__(self, github_key_path):
+    def __init__(self, github_key_path, concurrency=20, timeout=10., load=True):
         self.key_cache = OrderedDict()
+        # 키 별 할당량 최대값 / 응답을 기다리는 예약량 / 현재 window에서 관측한 가장 작은 remain
+        self.key_limit = {}
+        self.key_inflight = {}
+        self.key_observed = {}
+
+        self.key_heap = []
+        self.reset_heap = []
+        self.key_entries = {}
+        self.reset_entries = {}
+        self.counter = itertools.count()
+
+        # 할당량을 기다리는 요청들 (future)
+        self.waiters = deque()
+        self.reset_timer = None
+
+        self.concurrency = concurrency
+        self.timeout = timeout
         self.github_key_path = github_key_path
-        self.load_keys()
+        self.loaded = False
+        if load:
+            self.load_keys()
+
+    def run_sync(self, coro, alternative):
+        """ 동기 함수에서 새 이벤트 루프로 coroutine을 실행하고, 그 루프에 묶인 client를 닫기
+        (실행 중인 이벤트 루프 안에서는 루프를 중첩해 실행할 수 없으므로 alternative를 안내하는 RuntimeError)
+        """
+        # python 3.6에는 asyncio.get_running_loop가 없음
+        if asyncio._get_running_loop() is not None:
+            coro.close()
+            raise RuntimeError(f"cannot run {type(self).__name__} synchronously inside a running event loop, "
+                               f"use {alternative} instead")
+
+        async def run():
+            try:
+                return await coro
+            finally:
+                await self.close()
+
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(run())
+        finally:
+            loop.close()
 
     def load_keys(self):
+        self.run_sync(self.load_keys_async(), "load=False and await setup()")
+
+    async def setup(self):
+        """ 아직 키를 불러오지 않았으면 불러오기 (crawl을 시작할 때 호출)
+        """
+        if not self.loaded:
+            await self.load_keys_async()
+
+    async def load_keys_async(self):
+        """ 파일에 있는 키들을 동시에 검증하고, 할당량을 조회
+        """
         with open(self.github_key_path, 'r') as f:
-            for key in f.readlines():
-                key = key.strip()
-                try:
-                    remain, resetAt = self.get_resource_limit(key)
-                except ValueError as e:
-                    print(e)
-                    continue
-                self.key_cache[key] = (remain, resetAt)
+            keys = list(OrderedDict.fromkeys(key.strip() for key in f.readlines() if key.strip()))
+
+        now = datetime.now(tz=dateutil.tz.tzutc())
+        for key, result in zip(keys, await self.get_resource_limits_async(keys)):
+            if isinstance(result, ValueError):
+                # 폐기된 키
+                print(result)
+            elif isinstance(result, Exception):
+                # 일시적인 오류 : 할당량이 없는 것으로 두고 바로 다시 조회하도록 함
+                print(f"{key[:4]}... - {result!r}")
+                self.update(key, 0, now)
+            else:
+                self.update(key, *result)
         if len(self.key_cache) == 0:
             raise ValueError(f"{self.github_key_path} have no github key.")
+        self.loaded = True
 
     def __repr__(self):
         key_infos = []
@@ -68,71 +151,452 @@ class GithubKeyGen(object):
     def __len__(self):
         return sum(remain for remain, _ in self.key_cache.values())
 
-    async def get_async(self):
+    def update(self, key, remain, resetAt, observed=None):
+        """ 키의 할당량 정보를 갱신하고, heap에 반영
+        """
+        prev = self.key_cache.get(key)
+        self.key_cache[key] = (remain, resetAt)
+        self.key_limit[key] = max(self.key_limit.get(key, DEFAULT_LIMIT), remain)
+        self.key_inflight.setdefault(key, 0)
+        if observed is not None or prev is None:
+            self.key_observed[key] = remain if observed is None else observed
+
+        entry = self.key_entries.get(key)
+        if entry is not None:
+            entry[-1] = None
+        entry = [-remain, resetAt, next(self.counter), key]
+        self.key_entries[key] = entry
+        heapq.heappush(self.key_heap, entry)
+
+        if prev is None or prev[1] != resetAt or key not in self.reset_entries:
+            entry = self.reset_entries.get(key)
+            if entry is not None:
+                entry[-1] = None
+            entry = [resetAt, next(self.counter), key]
+            self.reset_entries[key] = entry
+            heapq.heappush(self.reset_heap, entry)
+
+        # 무효화된 원소가 많이 쌓이면 heap을 새로 구성
+        if len(self.key_heap) > 4 * len(self.key_cache) + 64:
+            self.key_heap = [entry for entry in self.key_heap if entry[-1] is not None]
+            heapq.heapify(self.key_heap)
+        if len(self.reset_heap) > 4 * len(self.key_cache) + 64:
+            self.reset_heap = [entry for entry in self.reset_heap if entry[-1] is not None]
+            heapq.heapify(self.reset_heap)
+
+    def remove(self, key):
+        """ 키를 pool에서 제외
+        """
+        self.key_cache.pop(key, None)
+        for entries in (self.key_entries, self.reset_entries):
+            entry = entries.pop(key, None)
+            if entry is not None:
+                entry[-1] = None
+
+    def reserve(self, cost=1):
+        """ 할당량이 가장 많이 남은 키에서 cost만큼 예약 (남은 키가 없으면 None)
+        """
+        while self.key_heap and self.key_heap[0][-1] is None:
+            heapq.heappop(self.key_heap)
+        if not self.key_heap or -self.key_heap[0][0] < cost:
+            return None
+
+        key = self.key_heap[0][-1]
+        remain, resetAt = self.key_cache[key]
+        self.key_inflight[key] += cost
+        self.update(key, remain - cost, resetAt)
+        return key
+
+    async def release_async(self, key: str, cost=1):
+        self.release(key, cost)
+
+    async def revoke_async(self, key: str):
+        self.revoke(key)
+
+    def revoke(self, key: str):
+        """ 폐기된 키(401)를 pool에서 제외
+        """
+        if key in self.key_cache:
+            print(f"{key[:4]}... is revoked")
+        self.remove(key)
+
+    def release(self, key: str, cost=1):
+        """ 요청이 실패한 경우, 예약한 할당량 돌려주기
+        """
+        if key not in self.key_cache:
+            return
+        remain, resetAt = self.key_cache[key]
+        self.key_inflight[key] = max(self.key_inflight[key] - cost, 0)
+        self.update(key, min(remain + cost, self.key_limit[key]), resetAt)
+        self.wake(cost)
+
+    def wake(self, quota):
+        """ 대기 중인 요청을 할당량(quota)만큼만 깨우기
+        """
+        while quota > 0 and self.waiters:
+            future = self.waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                quota -= 1
+
+    async def get_async(self, cost=1):
         """ API 할당량이 남은 키 가져오기
+        :param cost: 예약할 할당량
         :return: key
         """
-        while True:
-            min_resetAt = None
-            for _ in range(len(self.key_cache)):
-                key, (remain, resetAt) = self.key_cache.popitem(last=False)
-                self.key_cache[key] = (remain - 1, resetAt)
-                min_resetAt = min(min_resetAt, resetAt) if min_resetAt else resetAt
+        while self.key_cache:
+            self.schedule_reset()
+            key = self.reserve(cost)
+            if key is not None:
+                return key
 
-                if remain > 0:
-                    return key
+            # key를 반환하지 못한 경우 : 할당량이 바닥남
+            # 이 경우 resetAt이 가장 빠르게 도래하는 키가 초기화될 때까지 waiting 해주어야 함
+            future = asyncio.get_event_loop().create_future()
+            self.waiters.append(future)
+            await future
+        # key_cache가 없는 상황 (예외 상황)
+        return None
 
-            if min_resetAt:
-                # key를 반환하지 못한 경우 : 할당량이 바닥남
-                # 이 경우 resetAt이 가장 빠르게 도래하는 것을 기준으로 waiting 해주어야 함
-                duration = (min_resetAt.replace(tzinfo=None)
-                            - datetime.utcnow().replace(tzinfo=None)
-                            + timedelta(seconds=10)).total_seconds()
-                if duration > 0:
-                    await asyncio.sleep(duration)
+    def schedule_reset(self):
+        """ 가장 빠른 resetAt(+10초)에 초기화 작업을 예약
+        """
+        if self.reset_timer is not None:
+            return
+        while self.reset_heap and self.reset_heap[0][-1] is None:
+            heapq.heappop(self.reset_heap)
+        if not self.reset_heap:
+            return
+        resetAt = self.reset_heap[0][0]
+        duration = (resetAt - datetime.now(tz=dateutil.tz.tzutc())
+                    + timedelta(seconds=10)).total_seconds()
+        self.reset_timer = asyncio.get_event_loop().call_later(max(duration, 0), self.reset_keys)
 
-                # resource 갱신
-                self.update_resource_limit()
+    def reset_keys(self):
+        """ resetAt이 지난 키들의 할당량을 background에서 다시 조회
+        """
+        self.reset_timer = None
+        now = datetime.now(tz=dateutil.tz.tzutc())
+        keys = []
+        while self.reset_heap and (self.reset_heap[0][-1] is None or self.reset_heap[0][0] <= now):
+            _, _, key = heapq.heappop(self.reset_heap)
+            if key is None:
+                continue
+            self.reset_entries.pop(key, None)
+            keys.append(key)
+        if keys:
+            asyncio.get_event_loop().create_task(self.refresh_keys(keys))
+        self.schedule_reset()
 
+    async def refresh_keys(self, keys):
+        """ 키들의 할당량을 다시 조회해 갱신하고, 늘어난 할당량만큼 대기 중인 요청을 깨우기
+        """
+        quota = 0
+        for key, result in zip(keys, await self.get_resource_limits_async(keys)):
+            if key not in self.key_cache:
+                continue
+            curr_remain, curr_resetAt = self.key_cache[key]
+            if isinstance(result, ValueError):
+                await self.revoke_async(key)
+                continue
+            elif isinstance(result, Exception):
+                # 조회에 실패한 경우, 할당량이 초기화되었다고 가정
+                remain = self.key_limit[key]
+                resetAt = max(curr_resetAt, datetime.now(tz=dateutil.tz.tzutc())) + timedelta(hours=1)
             else:
-                # key_cache가 없는 상황 (예외 상황)
-                break
+                remain, resetAt = result
+            new_remain = remain - self.key_inflight[key]
+            self.update(key, new_remain, resetAt, observed=remain)
+            quota += max(new_remain - max(curr_remain, 0), 0)
+        self.wake(quota)
 
-    async def set_async(self, key: str, remain: int, resetAt: datetime=None):
-        """ 키의 할당량, 시간을 저장
+    async def set_async(self, key: str, remain: int, resetAt: datetime=None, cost=1):
+        """ 응답으로 받은 rateLimit으로 키의 할당량, 시간을 갱신 (cost만큼의 예약 확정)
         """
         if resetAt is None:
             resetAt = datetime.now(tz=dateutil.tz.tzutc()) + timedelta(hours=1)
 
         curr_remain, curr_resetAt = self.key_cache[key]
-        # 비동기적으로 갱신하기 때문에 Skew가 발생할 수 있기 때문에
-        # 비교를 통해 최소/ 최대값으로 넣어주어야 함
-        self.key_cache[key] = (min(remain, curr_remain),
-                               max(resetAt, curr_resetAt))
+        self.key_inflight[key] = max(self.key_inflight[key] - cost, 0)
+
+        # 비동기적으로 갱신하기 때문에 응답의 순서가 뒤바뀔 수 있음
+        # 새 window이거나, 같은 window에서 지금까지 관측한 것 중 가장 최신(가장 작은 remain)일 때만
+        # 반영하고, 아직 응답을 받지 못한 예약량은 제외
+        if resetAt > curr_resetAt or (resetAt == curr_resetAt and remain <= self.key_observed[key]):
+            new_remain = remain - self.key_inflight[key]
+            self.update(key, new_remain, resetAt, observed=remain)
+            if new_remain > curr_remain:
+                self.wake(new_remain - curr_remain)
+
+    @staticmethod
+    def key_id(key):
+        """ 키를 드러내지 않고 구분하기 위한 id (키의 hash)
+        """
+        return hashlib.sha1(key.encode('utf8')).hexdigest()[:16]
+
+    async def quota_async(self):
+        """ 키 별 할당량 현황 (모니터링용, 키 대신 key_id로 구분)
+
+        :return: {key_id: (남은 할당량, 할당량 최대값, resetAt)}
+        """
+        return {self.key_id(key): (remain, self.key_limit[key], resetAt)
+                for key, (remain, resetAt) in self.key_cache.items()}
+
+    async def budget_async(self):
+        """ 키 별 할당량 현황 (BudgetPlanner에서 사용)
+
+        :return: [(남은 할당량, 할당량 최대값, resetAt), ...]
+        """
+        return list((await self.quota_async()).values())
+
+    async def close(self):
+        pass
 
     def update_resource_limit(self):
         """ github Key의 resource limit을 조회 후 갱신하는 함수
         """
-        for key in self.key_cache:
-            remain, resetAt = self.get_resource_limit(key)
-            self.key_cache[key] = (remain, resetAt)
+        self.run_sync(self.refresh_keys(list(self.key_cache)), "await refresh_keys(keys)")
+
+    async def get_resource_limits_async(self, keys):
+        """ 여러 Key의 resource limit을 최대 concurrency개씩 동시에 가져오는 함수
+
+        :param keys: githubAPI Key 목록
+        :return: Key 별 (remain, resetAt) 혹은 Exception
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def get(sess, key):
+            async with semaphore:
+                return await self.get_resource_limit_async(sess, key)
+
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(timeout=timeout) as sess:
+            return await asyncio.gather(*[get(sess, key) for key in keys], return_exceptions=True)
 
     @staticmethod
-    def get_resource_limit(key: str):
+    async def get_resource_limit_async(sess, key: str):
         """ 해당 Key의 resource limit을 가져오는 함수
 
+        :param sess: aiohttp session
         :param key: githubAPI Key
         :return:
         """
         auth = {"Authorization": "bearer " + key}
         query = {"query": GETLIMIT_QUERY}
 
-        with requests.post(GITHUB_GQL, headers=auth, json=query) as res:
-            if res.status_code == 200:
-                query_results = res.json()
+        async with sess.post(GITHUB_GQL, headers=auth, json=query) as res:
+            if res.status == 200:
+                try:
+                    return parse_rateLimit(await res.json())
+                except ValueError as e:
+                    raise IOError(str(e))
+            elif res.status == 401:
+                raise ValueError(f"{key} is Bad credentials")
+            else:
+                raise IOError(f"status code : {res.status}")
+
+
+# resetAt이 지난 키의 할당량을 limit으로 되돌린 뒤, 할당량이 가장 많이 남은 키에서 cost만큼 예약
+# 남은 키가 없으면 가장 빠른 resetAt을 반환
+# KEYS : remain, reset, limit, observed / ARGV : cost, 현재 시각, 기본 할당량
+RESERVE_SCRIPT = """
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[2])) do
+    redis.call('ZADD', KEYS[1], redis.call('HGET', KEYS[3], id) or ARGV[3], id)
+    redis.call('ZADD', KEYS[2], tonumber(ARGV[2]) + 3600, id)
+    redis.call('HDEL', KEYS[4], id)
+end
+local top = redis.call('ZREVRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+if #top == 0 then
+    return {'empty', ''}
+end
+if tonumber(top[2]) >= tonumber(ARGV[1]) then
+    redis.call('ZINCRBY', KEYS[1], -tonumber(ARGV[1]), top[1])
+    return {'ok', top[1]}
+end
+return {'wait', redis.call('ZRANGE', KEYS[2], 0, 0, 'WITHSCORES')[2]}
+"""
+
+# 응답으로 받은 rateLimit으로 할당량 갱신
+# (새 window이거나, 같은 window에서 가장 최신 응답일 때만 반영, 응답을 기다리는 예약량은 제외, 폐기된 키는 무시)
+# KEYS : remain, reset, limit, observed, revoked / ARGV : id, remain, resetAt, 예약량, 기본 할당량
+COMMIT_SCRIPT = """
+if redis.call('SISMEMBER', KEYS[5], ARGV[1]) == 1 then
+    return 0
+end
+local remain, resetAt = tonumber(ARGV[2]), tonumber(ARGV[3])
+local curr_resetAt = tonumber(redis.call('ZSCORE', KEYS[2], ARGV[1]) or 0)
+local observed = redis.call('HGET', KEYS[4], ARGV[1])
+if resetAt > curr_resetAt or not observed then
+    redis.call('ZADD', KEYS[1], remain - tonumber(ARGV[4]), ARGV[1])
+elseif resetAt == curr_resetAt and remain <= tonumber(observed) then
+    local curr = tonumber(redis.call('ZSCORE', KEYS[1], ARGV[1]) or remain)
+    redis.call('ZADD', KEYS[1], math.min(curr, remain - tonumber(ARGV[4])), ARGV[1])
+else
+    return 0
+end
+redis.call('ZADD', KEYS[2], resetAt, ARGV[1])
+redis.call('HSET', KEYS[4], ARGV[1], remain)
+if remain > tonumber(redis.call('HGET', KEYS[3], ARGV[1]) or ARGV[5]) then
+    redis.call('HSET', KEYS[3], ARGV[1], remain)
+end
+return 1
+"""
+
+# 예약한 할당량 돌려주기 (limit을 넘지 않도록, ledger에서 빠진 키는 무시)
+# KEYS : remain, limit / ARGV : id, cost, 기본 할당량
+RELEASE_SCRIPT = """
+if not redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    return
+end
+local remain = tonumber(redis.call('ZINCRBY', KEYS[1], ARGV[2], ARGV[1]))
+local limit = tonumber(redis.call('HGET', KEYS[2], ARGV[1]) or ARGV[3])
+if remain > limit then
+    redis.call('ZADD', KEYS[1], limit, ARGV[1])
+end
+"""
+
+# 폐기된 키를 ledger에서 지우고, 다시 반영되지 않도록 revoked에 기록
+# KEYS : remain, reset, limit, observed, revoked / ARGV : id
+REVOKE_SCRIPT = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[3], ARGV[1])
+redis.call('HDEL', KEYS[4], ARGV[1])
+return redis.call('SADD', KEYS[5], ARGV[1])
+"""
+
+
+class RedisGithubKeyGen(GithubKeyGen):
+    """
+    여러 crawler 프로세스 / 노드가 하나의 Github Key pool을 공유하도록, 키의 할당량을 redis에 저장하는 클래스
+    키의 예약 / 확정 / 반환은 Lua script로 원자적으로 처리하며, GithubKeyGen과 같은 인터페이스를 가진다.
+
+    redis에는 키 대신 키의 hash(id)만 저장하므로, 같은 namespace를 쓰는 프로세스들은
+    같은 github key 파일을 사용해야 한다.
+
+    * {namespace}:remain   (sorted set) id -> 남은 할당량
+    * {namespace}:reset    (sorted set) id -> resetAt (epoch)
+    * {namespace}:limit    (hash) id -> 할당량 최대값
+    * {namespace}:observed (hash) id -> 현재 window에서 관측한 가장 작은 remain
+    * {namespace}:revoked  (set) 폐기된(401) 키의 id (다시 검증에 성공한 프로세스가 시작할 때까지 ledger에 반영하지 않음)
+
+    Usages
 
-                remain = query_results['data']['rateLimit']['remaining']
-                resetAt = parse_date(query_results['data']['rateLimit']['resetAt'])
-                return remain, resetAt
+    >>> GithubKey = RedisGithubKeyGen("./credentials/github.txt", host="redis")
+
+    """
+    def __init__(self, github_key_path, namespace="githubkey", concurrency=20, timeout=10., load=True,
+                 **redis_kwargs):
+        self.namespace = namespace
+        self.redis_keys = [f"{namespace}:remain", f"{namespace}:reset",
+                           f"{namespace}:limit", f"{namespace}:observed", f"{namespace}:revoked"]
+        self.redis_kwargs = redis_kwargs
+        self.rq = redis.Redis(**redis_kwargs)
+        self.arqs = weakref.WeakKeyDictionary()
+        self.scripts = self.register_scripts(self.rq)
+        self.key_ids = {}
+        super().__init__(github_key_path, concurrency=concurrency, timeout=timeout, load=load)
+
+    async def load_keys_async(self):
+        await super().load_keys_async()
+        # 조회한 할당량을 공유 ledger에 반영 (검증에 성공한 키는 폐기 기록을 지움)
+        arq = self.get_async_client()
+        for key, (remain, resetAt) in self.key_cache.items():
+            self.key_ids[self.key_id(key)] = key
+            await arq.srem(self.redis_keys[4], self.key_id(key))
+            await arq.scripts["commit"](keys=self.redis_keys,
+                                        args=[self.key_id(key), remain, resetAt.timestamp(), 0, DEFAULT_LIMIT])
+
+    def __len__(self):
+        return int(sum(remain for _, remain in self.rq.zrange(self.redis_keys[0], 0, -1, withscores=True)))
+
+    @staticmethod
+    def register_scripts(client):
+        return {"reserve": client.register_script(RESERVE_SCRIPT),
+                "commit": client.register_script(COMMIT_SCRIPT),
+                "release": client.register_script(RELEASE_SCRIPT),
+                "revoke": client.register_script(REVOKE_SCRIPT)}
+
+    def get_async_client(self):
+        loop = asyncio.get_event_loop()
+        arq = self.arqs.get(loop)
+        if arq is None:
+            arq = redis.asyncio.Redis(**self.redis_kwargs)
+            arq.scripts = self.register_scripts(arq)
+            self.arqs[loop] = arq
+        return arq
+
+    async def get_async(self, cost=1):
+        """ 공유 ledger에서 할당량이 가장 많이 남은 키를 예약
+        모든 키의 할당량이 바닥난 경우, 가장 빠른 resetAt까지 기다림
+        (프로세스들이 동시에 깨어나지 않도록 jitter를 더함)
+        """
+        arq = self.get_async_client()
+        while self.key_ids:
+            status, value = await arq.scripts["reserve"](
+                keys=self.redis_keys, args=[cost, time.time(), DEFAULT_LIMIT])
+            if status == b'ok':
+                key = self.key_ids.get(value.decode('utf8'))
+                if key is not None:
+                    self.key_inflight[key] = self.key_inflight.get(key, 0) + cost
+                    return key
+                # 다른 키 파일을 사용하는 프로세스의 키
+                await arq.scripts["release"](keys=[self.redis_keys[0], self.redis_keys[2]],
+                                             args=[value, cost, DEFAULT_LIMIT])
+                await asyncio.sleep(random.uniform(0, 1))
+            elif status == b'wait':
+                await asyncio.sleep(max(float(value) - time.time(), 0) + 10 + random.uniform(0, 5))
             else:
-                raise ValueError(f"{key} is Bad credentials")
+                break
+        return None
+
+    async def set_async(self, key: str, remain: int, resetAt: datetime=None, cost=1):
+        if resetAt is None:
+            resetAt = datetime.now(tz=dateutil.tz.tzutc()) + timedelta(hours=1)
+        self.key_inflight[key] = max(self.key_inflight.get(key, 0) - cost, 0)
+        self.key_cache[key] = (remain, resetAt)
+        await self.get_async_client().scripts["commit"](
+            keys=self.redis_keys,
+            args=[self.key_id(key), remain, resetAt.timestamp(), self.key_inflight[key], DEFAULT_LIMIT])
+
+    async def release_async(self, key: str, cost=1):
+        self.key_inflight[key] = max(self.key_inflight.get(key, 0) - cost, 0)
+        await self.get_async_client().scripts["release"](
+            keys=[self.redis_keys[0], self.redis_keys[2]], args=[self.key_id(key), cost, DEFAULT_LIMIT])
+
+    def release(self, key: str, cost=1):
+        self.key_inflight[key] = max(self.key_inflight.get(key, 0) - cost, 0)
+        self.scripts["release"](keys=[self.redis_keys[0], self.redis_keys[2]],
+                                args=[self.key_id(key), cost, DEFAULT_LIMIT])
+
+    async def revoke_async(self, key: str):
+        """ 폐기된 키를 공유 ledger에서 지워, 다른 프로세스에도 더 이상 할당하지 않음
+        """
+        super().revoke(key)
+        self.key_ids.pop(self.key_id(key), None)
+        await self.get_async_client().scripts["revoke"](keys=self.redis_keys, args=[self.key_id(key)])
+
+    def revoke(self, key: str):
+        super().revoke(key)
+        self.key_ids.pop(self.key_id(key), None)
+        self.scripts["revoke"](keys=self.redis_keys, args=[self.key_id(key)])
+
+    async def quota_async(self):
+        """ 공유 ledger의 키 별 할당량 현황 (redis에는 키의 id만 저장되어 있음)
+        """
+        arq = self.get_async_client()
+        async with arq.pipeline(transaction=False) as pipe:
+            pipe.zrange(self.redis_keys[0], 0, -1, withscores=True)
+            pipe.zrange(self.redis_keys[1], 0, -1, withscores=True)
+            pipe.hgetall(self.redis_keys[2])
+            remains, resets, limits = await pipe.execute()
+        resets = dict(resets)
+        now = time.time()
+        return {id.decode('utf8'): (remain, int(limits.get(id, DEFAULT_LIMIT)),
+                                    datetime.fromtimestamp(resets.get(id, now), tz=dateutil.tz.tzutc()))
+                for id, remain in remains}
+
+    async def close(self):
+        arq = self.arqs.pop(asyncio.get_event_loop(), None)
+        if arq is not None:
+            await arq.close()
@@ -0,0 +1,93 @@
+"""
+Copyright 2020, All rights reserved.
+Author : SangJae Kang
+Mail : craftsangjae@gmail.com
+"""
+import time
+
+
+class AdaptiveLimiter(object):
+    """
+    github API 응답 결과에 따라 동시에 처리할 요청 수(limit)를 조절하는 클래스 (AIMD + latency gradient)
+
+    * 성공 : 평균 latency가 기준(최소 latency * tolerance) 이하이면 limit을 조금씩 늘림
+      (성공 한 번에 increase / limit, 즉 limit만큼 성공하면 increase만큼)
+      기준을 넘으면 (기준 / 평균 latency) 비율에 맞춰 limit을 서서히 줄임
+    * 과부하(403 abuse, 5xx, timeout, 연결 오류) : limit을 backoff배로 줄임
+      (동시에 실패한 요청들로 여러 번 줄이지 않도록 cooldown초 안에는 한 번만)
+
+    최소 latency는 네트워크 상황이 바뀌는 것을 반영하도록 성공할 때마다 drift배씩 조금씩 올라감
+
+    Usages
+
+    >>> limiter = AdaptiveLimiter(initial_limit=20, max_limit=200)
+    >>> limiter.limit
+    20
+
+    # 요청 결과 알려주기
+    >>> limiter.on_success(latency)
+    >>> limiter.on_overload()
+
+    """
+    def __init__(self,
+                 initial_limit=20,
+                 min_limit=1,
+                 max_limit=200,
+                 increase=1.,
+                 backoff=0.5,
+                 tolerance=2.,
+                 smoothing=0.1,
+                 drift=1.001,
+                 cooldown=1.):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.drift = drift
+        self.cooldown = cooldown
+
+        self.current = float(min(max(initial_limit, min_limit), max_limit))
+        self.latency = None
+        self.min_latency = None
+        self.last_backoff = float('-inf')
+        self.num_overloaded = 0
+
+    @property
+    def limit(self):
+        return int(self.current)
+
+    def on_success(self, latency):
+        """ 요청이 성공한 경우 (latency : 요청에 걸린 시간(초))
+        """
+        if self.latency is None:
+            self.latency = self.min_latency = latency
+        else:
+            self.latency += self.smoothing * (latency - self.latency)
+            self.min_latency = min(latency, self.min_latency * self.drift)
+
+        gradient = self.min_latency * self.tolerance / max(self.latency, 1e-6)
+        if gradient >= 1.:
+            self.current += self.increase / self.current
+        else:
+            self.current -= self.smoothing * (1. - gradient) * self.current
+        self.clip()
+
+    def on_overload(self):
+        """ github이 과부하로 요청을 거절했거나 응답하지 못한 경우
+        """
+        self.num_overloaded += 1
+        now = time.monotonic()
+        if now - self.last_backoff >= self.cooldown:
+            self.current *= self.backoff
+            self.last_backoff = now
+            self.clip()
+
+    def clip(self):
+        self.current = min(max(self.current, self.min_limit), self.max_limit)
+
+    def gauges(self):
+        """ 현재 상태 (모니터링용, 여러 프로세스의 값을 더할 수 있는 값만)
+        """
+        return {"concurrency_limit": self.limit}
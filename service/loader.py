@@ -0,0 +1,305 @@
+"""
+Copyright 2020, All rights reserved.
+Author : SangJae Kang
+Mail : craftsangjae@gmail.com
+"""
+import os
+import re
+import gzip
+import json
+import math
+import time
+import asyncio
+import hashlib
+import weakref
+import redis.asyncio
+from collections import Counter
+from service.consumer import BaseConsumer
+from service.database import MongoDatabase
+from service.dedup import FreshnessFilter
+from service.document import repository_node_id
+
+# github의 owner / 리파짓토리 이름 규칙
+OWNER_PATTERN = re.compile(r"^[A-Za-z0-9](?:[A-Za-z0-9-]{0,38})$")
+NAME_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,100}$")
+
+
+def parse_seed(line):
+    """ seed 한 줄(JSON)을 브로커에 담을 메시지로 변환 (올바르지 않으면 None)
+
+    * {"owner": ..., "name": ...} -> {"owner": ..., "name": ...}
+    * {"id": 리파짓토리 숫자 id} -> {"id": ...}
+    """
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(record, dict):
+        return None
+
+    owner, name = record.get('owner'), record.get('name')
+    if isinstance(owner, str) and isinstance(name, str):
+        if OWNER_PATTERN.match(owner) and NAME_PATTERN.match(name) and name not in (".", ".."):
+            return {"owner": owner, "name": name}
+        return None
+
+    repo_id = record.get('id')
+    if isinstance(repo_id, str) and repo_id.isdigit():
+        repo_id = int(repo_id)
+    if isinstance(repo_id, int) and not isinstance(repo_id, bool) and repo_id > 0:
+        return {"id": repo_id}
+    return None
+
+
+class BloomFilter(object):
+    """
+    정해진 크기의 bit 배열로 이미 본 key인지 확인하는 bloom filter
+    (capacity개를 넣었을 때 오탐 비율이 error_rate가 되도록 크기를 정하며, 넣은 수와 관계없이 메모리는 일정)
+    """
+    def __init__(self, capacity=10000000, error_rate=0.001):
+        self.capacity = capacity
+        self.count = 0
+        self.num_bits = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.num_hashes = max(int(round(self.num_bits / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def add(self, key):
+        """ key를 넣고, 이미 있었는지(오탐 가능) 반환
+        """
+        digest = hashlib.blake2b(key.encode('utf8'), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        exists = True
+        for i in range(self.num_hashes):
+            position = (h1 + i * h2) % self.num_bits
+            byte, mask = position >> 3, 1 << (position & 7)
+            if not self.bits[byte] & mask:
+                exists = False
+                self.bits[byte] |= mask
+        if not exists:
+            self.count += 1
+        return exists
+
+
+class SeedLoader(object):
+    """
+    JSON Lines seed 파일(gzip 가능)을 읽어 브로커에 담는 클래스
+
+    * 한 줄씩 읽으므로 파일 크기와 관계없이 메모리는 일정 (중복 확인용 bloom filter 크기만큼)
+    * 올바르지 않은 줄, 이번 load에서 이미 담은 리파짓토리, 이미 crawl한 리파짓토리는 건너뜀
+      - bloom filter : 이번 load에서 이미 담은 리파짓토리 (오탐 가능)
+      - redis set ({topic}, redis_kwargs가 있을 때) : bloom filter에 있다고 나온 리파짓토리를 다시 확인
+        (redis_kwargs가 없으면 오탐(capacity개일 때 error_rate, 넘으면 더 많음)만큼 seed를 잃음)
+        redis set은 load 중에만 유지 (처음부터 load할 때 지우고, load를 끝까지 마치면 지움)하므로
+        담은 seed 수만큼 커지며, 중단된 load를 다시 시작하면 redis set으로 bloom filter를 다시 채움
+      - dedup(FreshnessFilter) : freshness 안에 crawl한 리파짓토리 (redis의 crawl 기록)
+      - database(MongoDatabase) : 이미 저장된 리파짓토리 (id 메시지만, document id로 조회)
+    * batch_size개씩 모아 한 번에 담고, 담는 동안 다음 batch를 executor에서 읽음
+    * 담은 batch의 끝 위치(압축을 푼 기준 byte offset)를 checkpoint 파일에 기록해, 중단되면 그 위치부터 다시 load
+
+    Usages
+
+    >>> loader = SeedLoader(RedisQueue("repository", host="redis"), checkpoint="./seeds.offset",
+    ...                     topic="repository:seeds", host="redis")
+    >>> stats = loop.run_until_complete(loader.load("./seeds.jsonl.gz", offset=loader.resume_offset()))
+
+    """
+    def __init__(self,
+                 broker:BaseConsumer,
+                 batch_size=10000,
+                 dedup:FreshnessFilter=None,
+                 database:MongoDatabase=None,
+                 capacity=10000000,
+                 error_rate=0.001,
+                 checkpoint=None,
+                 report_interval=10.,
+                 topic="seeds",
+                 **redis_kwargs):
+        self.broker = broker
+        self.batch_size = batch_size
+        self.dedup = dedup
+        self.database = database
+        self.seen = BloomFilter(capacity, error_rate)
+        self.checkpoint = checkpoint
+        self.report_interval = report_interval
+        self.topic = topic
+        self.redis_kwargs = redis_kwargs
+        self.arqs = weakref.WeakKeyDictionary()
+        self.warned = False
+
+        # read : 읽은 줄, invalid : 올바르지 않은 줄, duplicate : 이번 load에서 중복,
+        # crawled : 이미 crawl한 리파짓토리, pushed : 브로커에 담은 메시지
+        self.stats = Counter()
+        self.offset = 0
+
+    def get_async_client(self):
+        if not self.redis_kwargs:
+            return None
+        loop = asyncio.get_event_loop()
+        arq = self.arqs.get(loop)
+        if arq is None:
+            arq = redis.asyncio.Redis(**self.redis_kwargs)
+            self.arqs[loop] = arq
+        return arq
+
+    async def close(self):
+        for arq in list(self.arqs.values()):
+            await arq.close()
+        self.arqs.clear()
+
+    def resume_offset(self):
+        """ checkpoint 파일에 기록된 offset (없으면 0)
+        """
+        if self.checkpoint is None or not os.path.exists(self.checkpoint):
+            return 0
+        with open(self.checkpoint) as f:
+            return int(f.read().strip() or 0)
+
+    def save_offset(self, offset):
+        if self.checkpoint is None:
+            return
+        temp = self.checkpoint + ".tmp"
+        with open(temp, 'w') as f:
+            f.write(str(offset))
+        os.replace(temp, self.checkpoint)
+
+    @staticmethod
+    def open(path):
+        if path.endswith(".gz"):
+            return gzip.open(path, 'rb')
+        return open(path, 'rb')
+
+    async def load(self, path, offset=0):
+        """ seed 파일을 offset(압축을 푼 기준 byte)부터 읽어 브로커에 담기
+
+        :return: 통계 (Counter)
+        """
+        loop = asyncio.get_event_loop()
+        started = reported = time.monotonic()
+        pushing = None
+
+        arq = self.get_async_client()
+        if arq is not None and not offset:
+            # 처음부터 load하면 이전 load에서 담은 기록을 지움
+            await arq.delete(self.topic)
+        elif arq is not None:
+            # 중단된 위치부터 다시 load하면 이미 담은 리파짓토리를 bloom filter에 다시 넣음
+            async for key in arq.sscan_iter(self.topic, count=self.batch_size):
+                self.seen.add(key.decode('utf8'))
+
+        with self.open(path) as f:
+            if offset:
+                # gzip은 앞부분을 풀면서 건너뜀
+                f.seek(offset)
+            self.offset = offset
+            while True:
+                # 파일을 읽고 푸는 동안 이전 batch를 담음
+                entries, counts, end = await loop.run_in_executor(None, self.read_batch, f)
+                self.stats.update(counts)
+                self.offset = end
+
+                # 이전 batch를 다 담은 후에 다음 batch를 담음 (checkpoint 순서 보장, 담은 리파짓토리 기록)
+                if pushing is not None:
+                    await pushing
+                    pushing = None
+                if entries:
+                    messages, keys = await self.confirm(entries)
+                    messages = await self.skip_crawled(messages)
+                    pushing = loop.create_task(self.push(messages, keys, self.offset))
+
+                if time.monotonic() - reported >= self.report_interval:
+                    reported = time.monotonic()
+                    self.report(started)
+                if not entries:
+                    break
+            self.save_offset(self.offset)
+
+        if arq is not None:
+            # 끝까지 담았으면 더 이상 다시 시작할 일이 없으므로 담은 기록을 지움
+            await arq.delete(self.topic)
+
+        self.report(started)
+        return self.stats
+
+    def read_batch(self, f):
+        """ 메시지 batch_size개(혹은 파일 끝)까지 읽기 (executor에서 실행)
+
+        :return: [(메시지, key, bloom filter에 있었는지)], 통계, 읽은 끝 위치
+        """
+        entries, counts, offset = [], Counter(), self.offset
+        for line in f:
+            offset += len(line)
+            counts['read'] += 1
+            message = parse_seed(line)
+            if message is None:
+                if line.strip():
+                    counts['invalid'] += 1
+                continue
+            key = FreshnessFilter.message_key(message)
+            entries.append((message, key, self.seen.add(key)))
+            if len(entries) >= self.batch_size:
+                break
+        return entries, counts, offset
+
+    async def confirm(self, entries):
+        """ bloom filter에 있다고 나온 메시지가 정말 이미 담은 것인지 확인하고, 중복을 제외
+
+        :return: 담을 메시지들, 이번 batch의 key들
+        """
+        arq = self.get_async_client()
+        hits = [key for _, key, exists in entries if exists]
+        stored = {}
+        if arq is not None and hits:
+            pipe = arq.pipeline(transaction=False)
+            for key in hits:
+                pipe.sismember(self.topic, key)
+            stored = dict(zip(hits, await pipe.execute()))
+        elif arq is None and not self.warned and self.seen.count > self.seen.capacity:
+            self.warned = True
+            print(f"WARNING : more than {self.seen.capacity} seeds, "
+                  f"bloom filter false positives will drop more seeds", flush=True)
+
+        messages, keys = [], set()
+        for message, key, exists in entries:
+            if key in keys or (exists and (arq is None or stored[key])):
+                self.stats['duplicate'] += 1
+                continue
+            if exists:
+                self.stats['false_positive'] += 1
+            keys.add(key)
+            messages.append(message)
+        return messages, keys
+
+    async def skip_crawled(self, messages):
+        """ 이미 crawl한 리파짓토리의 메시지 제외
+        """
+        if self.dedup is not None:
+            crawled = await self.dedup.crawled_async(messages)
+            self.stats['crawled'] += sum(crawled)
+            messages = [message for message, exists in zip(messages, crawled) if not exists]
+
+        if self.database is not None:
+            node_ids = {repository_node_id(message['id']): message
+                        for message in messages if 'id' in message}
+            if node_ids:
+                stored = await self.database.get_many(list(node_ids), projection=['id'])
+                self.stats['crawled'] += len(stored)
+                skipped = {id(node_ids[node_id]) for node_id in stored}
+                messages = [message for message in messages if id(message) not in skipped]
+        return messages
+
+    async def push(self, messages, keys, offset):
+        """ 메시지들을 한 번에 담고, 담은 리파짓토리와 담은 위치까지 checkpoint에 기록
+        """
+        if messages:
+            await self.broker.put_many_async(messages)
+        self.stats['pushed'] += len(messages)
+        arq = self.get_async_client()
+        if arq is not None and keys:
+            await arq.sadd(self.topic, *keys)
+        self.save_offset(offset)
+
+    def report(self, started):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        print(f"offset {self.offset} | " +
+              ", ".join(f"{k} : {self.stats[k]}" for k in ('read', 'pushed', 'duplicate', 'crawled', 'invalid')) +
+              f" | {self.stats['read'] / elapsed:.0f} lines/s", flush=True)
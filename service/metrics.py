@@ -0,0 +1,171 @@
+"""
+Copyright 2020, All rights reserved.
+Author : SangJae Kang
+Mail : craftsangjae@gmail.com
+"""
+import time
+import asyncio
+from bisect import bisect_left
+from aiohttp import web
+
+# latency histogram의 bucket 상한(초)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30.)
+
+
+class Histogram(object):
+    """
+    latency 분포를 기록하는 histogram (Prometheus histogram과 같은 누적 bucket)
+
+    Usages
+
+    >>> histogram = Histogram()
+    >>> histogram.observe(0.3)
+    >>> histogram.render("crawler_stage_latency_seconds", {"stage": "fetch"})
+
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels=None):
+        """ Prometheus text format의 _bucket / _sum / _count 줄
+        """
+        labels = dict(labels or {})
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == float('inf') else repr(bound)
+            lines.append(sample(f"{name}_bucket", dict(labels, le=le), cumulative))
+        lines.append(sample(f"{name}_sum", labels, self.sum))
+        lines.append(sample(f"{name}_count", labels, self.count))
+        return lines
+
+
+def sample(name, labels, value):
+    """ Prometheus text format의 한 줄
+    """
+    if labels:
+        label_text = ",".join('{}="{}"'.format(
+            k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+            for k, v in labels.items())
+        return f"{name}{{{label_text}}} {float(value)!r}"
+    return f"{name} {float(value)!r}"
+
+
+class MetricsServer(object):
+    """
+    crawler의 상태를 Prometheus text format으로 내보내는 HTTP endpoint (GET /metrics)
+    crawler와 같은 이벤트 루프에서 동작하며, 요청이 올 때마다 아래 값을 모아서 응답
+
+    * crawler_events_total{event} : 처리 결과 별 누적 횟수 (success, retry, dead, ...)
+      (처리 속도는 Prometheus에서 rate(crawler_events_total{event="success"}[1m]))
+    * crawler_stage_latency_seconds{stage} : 단계 별 latency histogram
+      (key_wait : 할당량 / 키 대기, fetch : graphQL 요청, parse : 응답 파싱, write : 데이터베이스 저장)
+    * crawler_inflight_tasks : github API로 조회 중인 작업 수
+    * crawler_{gauge} : crawler.gauges()의 값 (동시 IO 수 상한, queue 길이 등)
+    * crawler_broker_queue_depth : 브로커에 남아있는 메시지 수
+    * github_key_remaining / github_key_limit / github_key_reset_timestamp_seconds{key} :
+      키 별 할당량 (키 대신 키의 hash로 구분)
+    * crawler_event_loop_lag_seconds : 이벤트 루프가 lag_interval마다 깨어나는 시각이 늦어진 정도
+
+    Usages
+
+    >>> crawler = RepositoryCrawler(broker, database, githubkey, metrics=MetricsServer(port=9100))
+
+    """
+    def __init__(self, port=9100, host="0.0.0.0", lag_interval=0.5):
+        self.port = port
+        self.host = host
+        self.lag_interval = lag_interval
+
+        self.crawler = None
+        self.runner = None
+        self.lag_monitor = None
+        self.loop_lag = 0.
+        self.max_loop_lag = 0.
+
+    async def start(self, crawler):
+        """ 현재 이벤트 루프에서 HTTP 서버와 이벤트 루프 lag 측정 시작
+        """
+        self.crawler = crawler
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.lag_monitor = asyncio.get_event_loop().create_task(self.monitor_loop_lag())
+
+    async def close(self):
+        if self.lag_monitor is not None:
+            self.lag_monitor.cancel()
+            self.lag_monitor = None
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def monitor_loop_lag(self):
+        """ lag_interval초 sleep이 실제로 얼마나 늦게 깨어나는지 측정
+        """
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.lag_interval)
+            self.loop_lag = max(time.monotonic() - started - self.lag_interval, 0.)
+            self.max_loop_lag = max(self.max_loop_lag, self.loop_lag)
+
+    async def handle(self, request):
+        text = "\n".join(await self.collect()) + "\n"
+        return web.Response(text=text, content_type="text/plain")
+
+    async def collect(self):
+        """ 현재 상태를 Prometheus text format의 줄 목록으로 모으기
+        """
+        crawler = self.crawler
+        lines = []
+
+        lines.append("# TYPE crawler_events_total counter")
+        for event, count in sorted(crawler.stats.items()):
+            lines.append(sample("crawler_events_total", {"event": event}, count))
+
+        lines.append("# TYPE crawler_stage_latency_seconds histogram")
+        for stage, histogram in crawler.latencies.items():
+            lines.extend(histogram.render("crawler_stage_latency_seconds", {"stage": stage}))
+
+        lines.append("# TYPE crawler_inflight_tasks gauge")
+        lines.append(sample("crawler_inflight_tasks", None, crawler.num_inflight))
+        for name, value in sorted(crawler.gauges().items()):
+            lines.append(f"# TYPE crawler_{name} gauge")
+            lines.append(sample(f"crawler_{name}", None, value))
+
+        try:
+            depth = await crawler.broker.len_async()
+            lines.append("# TYPE crawler_broker_queue_depth gauge")
+            lines.append(sample("crawler_broker_queue_depth", None, depth))
+        except Exception as e:
+            # 브로커에 연결하지 못하더라도 나머지 값은 내보냄
+            print(e)
+
+        try:
+            quota = await crawler.githubkey.quota_async()
+            for name, index in (("github_key_remaining", 0), ("github_key_limit", 1)):
+                lines.append(f"# TYPE {name} gauge")
+                lines.extend(sample(name, {"key": key}, values[index])
+                             for key, values in sorted(quota.items()))
+            lines.append("# TYPE github_key_reset_timestamp_seconds gauge")
+            lines.extend(sample("github_key_reset_timestamp_seconds", {"key": key}, resetAt.timestamp())
+                         for key, (_, _, resetAt) in sorted(quota.items()))
+        except Exception as e:
+            print(e)
+
+        lines.append("# TYPE crawler_event_loop_lag_seconds gauge")
+        lines.append(sample("crawler_event_loop_lag_seconds", None, self.loop_lag))
+        lines.append("# TYPE crawler_event_loop_max_lag_seconds gauge")
+        lines.append(sample("crawler_event_loop_max_lag_seconds", None, self.max_loop_lag))
+        return lines
@@ -0,0 +1,123 @@
+"""
+Copyright 2020, All rights reserved.
+Author : SangJae Kang
+Mail : craftsangjae@gmail.com
+"""
+import math
+import time
+import asyncio
+from datetime import datetime
+import dateutil
+from service.github import GithubKeyGen
+from service.query import MAX_BATCH_SIZE
+
+
+class BudgetPlanner(object):
+    """
+    github key pool의 할당량(point)을 resetAt까지 고르게 나누어 쓰도록 요청 속도를 조절하는 클래스
+
+    **계획**
+        키 별로 window(1시간) 동안 할당량을 일정한 속도로 쓴다고 보고,
+        resetAt까지 남은 시간에 비례하는 만큼은 남겨둔다. (burst만큼은 미리 쓸 수 있음)
+            남겨둘 할당량 = limit * (resetAt까지 남은 시간 / window) - limit * burst
+        pool 전체에서 남겨둘 할당량을 넘는 부분(surplus)이 요청의 cost보다 적으면,
+        pool의 할당량이 쌓이는 속도(sum(limit) / window)에 맞춰 기다린다.
+        redis로 할당량을 공유하는 경우에도 공유된 현황으로 계산하므로 프로세스 수와 무관하게 동작한다.
+
+    **cost 학습**
+        rateLimit.cost로 query 모양(단건, 배치 n개, nodes n개) 별 실제 cost를 지수 이동 평균으로 학습해
+        키를 예약할 때 사용한다. 최근 cooldown초 안에 할당량이 부족해 기다린 적이 있으면,
+        리파짓토리 당 cost가 가장 작은 배치 크기를 추천한다.
+
+    Usages
+
+    >>> planner = BudgetPlanner(GithubKey)
+
+    # 요청 전 : 예상 cost만큼 할당량이 쌓일 때까지 기다리기
+    >>> cost = (await planner.pace(("batch", 50)))
+
+    # 응답 후 : 실제 cost 학습
+    >>> planner.observe(("batch", 50), 1)
+
+    """
+    def __init__(self,
+                 githubkey:GithubKeyGen,
+                 window=3600.,
+                 burst=0.02,
+                 refresh_interval=1.,
+                 smoothing=0.2,
+                 max_wait=10.,
+                 cooldown=60.):
+        self.githubkey = githubkey
+        self.window = window
+        self.burst = burst
+        self.refresh_interval = refresh_interval
+        self.smoothing = smoothing
+        self.max_wait = max_wait
+        self.cooldown = cooldown
+
+        # query 모양 별 cost (지수 이동 평균)
+        self.costs = {}
+        # 마지막으로 조회한 (surplus, 할당량이 쌓이는 속도) 및 그 이후 쓴 할당량
+        self.surplus = 0.
+        self.rate = 0.
+        self.refreshed_at = None
+        self.spent = 0.
+        self.throttled_at = float('-inf')
+        self.num_throttled = 0
+
+    def expected_cost(self, shape):
+        """ 학습한 cost (처음 보는 모양이면 최소 cost인 1)
+        """
+        return max(int(math.ceil(self.costs.get(shape, 1.))), 1)
+
+    def observe(self, shape, cost):
+        """ 응답의 rateLimit.cost로 query 모양 별 cost 학습
+        """
+        if cost is None:
+            return
+        prev = self.costs.get(shape)
+        self.costs[shape] = cost if prev is None else prev + self.smoothing * (cost - prev)
+
+    async def refresh(self):
+        """ key pool의 현황으로 surplus와 할당량이 쌓이는 속도 다시 계산
+        """
+        now = datetime.now(tz=dateutil.tz.tzutc())
+        surplus, rate = 0., 0.
+        for remain, limit, resetAt in await self.githubkey.budget_async():
+            left = min(max((resetAt - now).total_seconds(), 0.), self.window)
+            reserved = max(limit * (left / self.window - self.burst), 0.)
+            surplus += max(remain - reserved, 0.)
+            rate += limit / self.window
+        self.surplus, self.rate = surplus, rate
+        self.refreshed_at = time.monotonic()
+        self.spent = 0.
+
+    async def pace(self, shape):
+        """ 예상 cost만큼 계획된 할당량이 쌓일 때까지 기다리기
+
+        :param shape: query 모양 (예: ("repository", 1), ("batch", 50), ("nodes", 100))
+        :return: 예상 cost (키를 예약할 때 사용)
+        """
+        cost = self.expected_cost(shape)
+        while True:
+            if self.refreshed_at is None or time.monotonic() - self.refreshed_at >= self.refresh_interval:
+                await self.refresh()
+            if self.surplus - self.spent >= cost or self.rate <= 0:
+                self.spent += cost
+                return cost
+
+            self.num_throttled += 1
+            self.throttled_at = time.monotonic()
+            wait = (cost - (self.surplus - self.spent)) / self.rate
+            await asyncio.sleep(min(max(wait, self.refresh_interval), self.max_wait))
+
+    def batch_size(self, default):
+        """ 추천하는 배치 크기
+        최근 할당량이 부족해 기다린 적이 있으면 리파짓토리 당 cost가 가장 작은 배치 크기, 아니면 default
+        """
+        if time.monotonic() - self.throttled_at >= self.cooldown:
+            return default
+        # 아직 가장 큰 배치의 cost를 모르면 우선 시도해 봄
+        sizes = {size for name, size in self.costs if name == "batch"} | {MAX_BATCH_SIZE}
+        return min(sizes, key=lambda size: (self.costs.get(("batch", size), 1.) / size, -size))
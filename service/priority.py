@@ -0,0 +1,88 @@
+"""
+Copyright 2020, All rights reserved.
+Author : SangJae Kang
+Mail : craftsangjae@gmail.com
+"""
+import math
+import time
+import datetime
+from dateutil.parser import parse as parse_date
+
+
+def to_timestamp(value):
+    """ document의 시각 필드(ISO 8601 문자열 / datetime)를 unix timestamp로 (없거나 올바르지 않으면 None)
+    """
+    if isinstance(value, str):
+        try:
+            value = parse_date(value)
+        except (ValueError, OverflowError):
+            return None
+    if not isinstance(value, datetime.datetime):
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value.timestamp()
+
+
+class CrawlPriority(object):
+    """
+    저장된 document로 리파짓토리를 다음에 crawl할 시각(score, 작을수록 먼저)을 정하는 클래스
+
+        다음 crawl 시각 = 마지막 crawl 시각 + refresh 주기
+        refresh 주기 = base_interval / 인기도 * (1 + 마지막 crawl 당시 push가 없던 기간 / dormancy)
+        인기도 = 1 + star_weight * log10(1 + stargazers) + fork_weight * log10(1 + forkCount)
+
+    * 인기 있는 리파짓토리일수록, 최근까지 push가 있던 리파짓토리일수록 자주 다시 crawl
+    * 한 번도 crawl하지 않은 리파짓토리는 0 (가장 먼저)
+    * refresh 주기는 min_interval ~ max_interval
+
+    Usages
+
+    >>> priority = CrawlPriority(base_interval=7 * 86400)
+    >>> priority.score({"crawledAt": "2020-05-01T00:00:00Z", "pushedAt": "2020-04-30T00:00:00Z",
+    ...                 "stargazers": 100000, "forkCount": 20000})
+
+    """
+    def __init__(self,
+                 base_interval=7 * 86400.,
+                 min_interval=86400.,
+                 max_interval=180 * 86400.,
+                 dormancy=30 * 86400.,
+                 star_weight=1.,
+                 fork_weight=0.5):
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.dormancy = dormancy
+        self.star_weight = star_weight
+        self.fork_weight = fork_weight
+
+    def popularity(self, document):
+        stars = max(document.get('stargazers') or 0, 0)
+        forks = max(document.get('forkCount') or 0, 0)
+        return 1 + self.star_weight * math.log10(1 + stars) + self.fork_weight * math.log10(1 + forks)
+
+    def interval(self, document, crawled_at):
+        """ 다음 crawl까지의 refresh 주기(초)
+        """
+        pushed_at = to_timestamp(document.get('pushedAt'))
+        dormant = max(crawled_at - pushed_at, 0) if pushed_at is not None else self.dormancy
+        interval = self.base_interval / self.popularity(document) * (1 + dormant / self.dormancy)
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def score(self, document, crawled_at=None):
+        """ 다음에 crawl할 시각 (unix timestamp)
+
+        :param document: 저장된 document (crawledAt, stargazers, forkCount, pushedAt)
+        :param crawled_at: 마지막 crawl 시각 (None이면 document의 crawledAt)
+        """
+        if crawled_at is None:
+            crawled_at = to_timestamp(document.get('crawledAt'))
+        if crawled_at is None:
+            return 0.
+        return crawled_at + self.interval(document, crawled_at)
+
+    def next_score(self, document):
+        """ 방금 crawl한 document의 다음 crawl 시각
+        """
+        return self.score(document, to_timestamp(document.get('crawledAt')) or time.time())
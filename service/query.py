@@ -5,11 +5,13 @@ Mail : craftsangjae@gmail.com
 
 Github GraphQL Query 문들을 저장
 """
+import os
+from functools import lru_cache
 
-# API URL
-GITHUB_URL = "https://api.github.com"
-GITHUB_REPOSITORY_ID_URL = "https://api.github.com/repositories/"
-GITHUB_GQL = "https://api.github.com/graphql"
+# API URL (GITHUB_URL 환경변수로 바꿀 수 있음, 예: benchmark의 mock github server)
+GITHUB_URL = os.environ.get("GITHUB_URL", "https://api.github.com").rstrip("/")
+GITHUB_REPOSITORY_ID_URL = f"{GITHUB_URL}/repositories/"
+GITHUB_GQL = f"{GITHUB_URL}/graphql"
 
 
 # API Rate Limit 을 가져오기 위한 graphQL Query
@@ -24,10 +26,9 @@ query {
 }
 '''
 
-# Github Repostiory의 Metadata을 가져오기 위한 graphQL Query
-GETREPO_QUERY = """
-query GetRepo($owner: String!, $name: String!) { 
-  repository(owner:$owner, name:$name) {
+# Github Repository의 Metadata 필드
+# (단건 조회 / 배치 조회 Query에서 동일한 필드를 가져오도록 공통으로 사용)
+REPOSITORY_FIELDS = """
     id, 
     name,
 	  owner {
@@ -104,7 +105,12 @@ query GetRepo($owner: String!, $name: String!) {
         }
       }
     },    
-  },
+"""
+
+# Github Repostiory의 Metadata을 가져오기 위한 graphQL Query
+GETREPO_QUERY = """
+query GetRepo($owner: String!, $name: String!) { 
+  repository(owner:$owner, name:$name) {%s},
   
   rateLimit {
     limit,
@@ -113,4 +119,60 @@ query GetRepo($owner: String!, $name: String!) {
     resetAt
   }  
 }
+""" % REPOSITORY_FIELDS
+
+# Github Repository id(node id)들로 Metadata을 한번에 가져오기 위한 graphQL Query
+GETNODES_QUERY = """
+query GetNodes($ids: [ID!]!) {
+  nodes(ids: $ids) {
+    ... on Repository {%s}
+  },
+
+  rateLimit {
+    limit,
+    cost,
+    remaining,
+    resetAt
+  }
+}
+""" % REPOSITORY_FIELDS
+
+# nodes(ids: [...])로 한 번에 조회할 수 있는 최대 node 수
+MAX_NODES = 100
+
+# 배치 Query 한 번에 담을 수 있는 최대 리파짓토리 수
+# 리파짓토리 하나 당 languages(100) + repositoryTopics(100) 등 약 210개의 node를 요청하므로
+# node 제한(500,000)에는 여유가 있지만, 깃헙의 쿼리 처리 시간 제한(10초)과 point cost
+# (리파짓토리 하나 당 약 9개의 connection → 100개일 때 약 9 point)를 고려해 100개로 제한
+MAX_BATCH_SIZE = 100
+
+
+@lru_cache(maxsize=MAX_BATCH_SIZE)
+def make_batch_repository_query(size):
+    """ 여러 리파짓토리를 하나의 graphQL Query로 가져오기 위한 aliased Query 생성
+
+    r0: repository(owner:$owner0, name:$name0) { ... },
+    r1: repository(owner:$owner1, name:$name1) { ... },
+    ...
+
+    :param size: 한 Query에 담을 리파짓토리 수
+    :return: graphQL Query
+    """
+    if not 0 < size <= MAX_BATCH_SIZE:
+        raise ValueError(f"batch size should be in (0, {MAX_BATCH_SIZE}], but {size}")
+    params = ", ".join(f"$owner{i}: String!, $name{i}: String!" for i in range(size))
+    repositories = "\n".join(
+        f"  r{i}: repository(owner:$owner{i}, name:$name{i}) {{{REPOSITORY_FIELDS}}},"
+        for i in range(size))
+    return f"""
+query GetRepos({params}) {{
+{repositories}
+
+  rateLimit {{
+    limit,
+    cost,
+    remaining,
+    resetAt
+  }}
+}}
 """
@@ -0,0 +1,129 @@
+"""
+Copyright 2020, All rights reserved.
+Author : SangJae Kang
+Mail : craftsangjae@gmail.com
+"""
+import random
+import asyncio
+from service.document import parse_errors
+
+# 실패 원인 분류
+RETRYABLE = "retryable"  # 일시적인 오류 (timeout, 5xx, 연결 오류, 데이터베이스 오류 등)
+QUOTA = "quota"          # 할당량 / abuse 제한 (403, RATE_LIMITED)
+NOT_FOUND = "not_found"  # 없는 (삭제 / 비공개) 리파짓토리
+FATAL = "fatal"          # 다시 시도해도 실패하는 경우 (잘못된 메시지, 처리할 수 없는 응답 등)
+
+# 실패한 메시지의 처리 방법
+RETRY = "retry"  # 기다린 후 다시 시도
+DEAD = "dead"    # dead-letter로 옮김
+DROP = "drop"    # 버림
+
+# 다시 시도해도 결과가 같은 graphQL error type
+FATAL_ERROR_TYPES = {"FORBIDDEN", "UNPROCESSABLE", "INVALID_QUERY"}
+
+
+def classify_exception(error):
+    """ 요청 / 저장 중 발생한 예외의 실패 원인 분류
+    """
+    if isinstance(error, ConnectionRefusedError):
+        # 403 (secondary rate limit, abuse detection)
+        return QUOTA
+    if isinstance(error, (asyncio.TimeoutError, IOError)):
+        return RETRYABLE
+    return FATAL
+
+
+def classify_errors(errors):
+    """ graphQL errors의 실패 원인 분류
+    """
+    types = {error.get('type') for error in errors if isinstance(error, dict)}
+    if "RATE_LIMITED" in types:
+        return QUOTA
+    if "NOT_FOUND" in types:
+        return NOT_FOUND
+    if types & FATAL_ERROR_TYPES:
+        return FATAL
+    return RETRYABLE
+
+
+def classify_response(query, alias=None, index=None):
+    """ 파싱하지 못한 graphQL 응답의 실패 원인 분류
+
+    :param query: graphQL 응답
+    :param alias: 배치 Query에서 실패한 리파짓토리의 alias (r0, r1, ...)
+    :param index: nodes(ids: [...]) Query에서 실패한 리파짓토리의 순서
+    :return: 실패 원인
+    """
+    if not isinstance(query, dict) or ('data' not in query and 'errors' not in query):
+        # graphQL 응답이 아닌 경우 (Bad credentials 등, 다른 키로 다시 시도)
+        return RETRYABLE
+
+    errors = parse_errors(query)
+    # path가 없는 error는 요청 전체의 error
+    selected = list(errors.get(None, []))
+    if alias is not None:
+        selected.extend(errors.get(alias, []))
+    if index is not None:
+        selected.extend(error for error in errors.get('nodes', [])
+                        if len(error.get('path', [])) > 1 and error['path'][1] == index)
+    if selected:
+        return classify_errors(selected)
+
+    if not isinstance(query.get('data'), dict):
+        return RETRYABLE
+    # error 없이 null인 경우
+    return NOT_FOUND
+
+
+class RetryPolicy(object):
+    """
+    실패한 메시지의 처리 방법을 정하는 클래스
+    * not_found : 버림
+    * fatal : 바로 dead-letter로
+    * retryable / quota : exponential backoff + jitter만큼 기다린 후 다시 시도
+      (quota는 base_delay 대신 quota_delay부터 시작), max_attempts번 실패하면 dead-letter로
+
+    시도 횟수는 메시지의 "_attempts" 필드에 기록
+
+    Arguments
+        max_attempts: dead-letter로 옮기기 전까지의 최대 시도 횟수
+        base_delay: 첫번째 재시도까지 기다리는 시간(초), 실패할 때마다 2배
+        quota_delay: 할당량 제한으로 실패한 경우 첫번째 재시도까지 기다리는 시간(초)
+        max_delay: 재시도까지 기다리는 최대 시간(초)
+    """
+    def __init__(self, max_attempts=5, base_delay=2., quota_delay=60., max_delay=3600.):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.quota_delay = quota_delay
+        self.max_delay = max_delay
+
+    @staticmethod
+    def attempts(message):
+        if isinstance(message, dict):
+            return message.get('_attempts', 0)
+        return 0
+
+    def delay(self, attempts, error_class=RETRYABLE):
+        """ attempts번 실패한 후 기다릴 시간 (절반은 고정, 절반은 jitter)
+        """
+        base = self.quota_delay if error_class == QUOTA else self.base_delay
+        delay = min(base * 2 ** attempts, self.max_delay)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def decide(self, message, error_class):
+        """ 실패한 메시지의 처리 방법 정하기
+
+        :param message: 실패한 메시지 (재시도하는 경우 "_attempts"를 1 늘림)
+        :param error_class: 실패 원인
+        :return: (처리 방법, 기다릴 시간(초))
+        """
+        if error_class == NOT_FOUND:
+            return DROP, None
+        if error_class == FATAL or not isinstance(message, dict):
+            return DEAD, None
+
+        attempts = self.attempts(message)
+        if attempts + 1 >= self.max_attempts:
+            return DEAD, None
+        message['_attempts'] = attempts + 1
+        return RETRY, self.delay(attempts, error_class)
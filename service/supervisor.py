@@ -0,0 +1,138 @@
+"""
+Copyright 2020, All rights reserved.
+Author : SangJae Kang
+Mail : craftsangjae@gmail.com
+"""
+import time
+import queue
+import signal
+import multiprocessing
+from collections import Counter
+
+
+def run_crawler(create_crawler, index, stats_queue, stats_interval):
+    """ 자식 프로세스에서 crawler를 생성해 실행하고, 주기적으로 통계를 부모 프로세스로 전달
+
+    :param create_crawler: index를 받아 RepositoryCrawler를 생성하는 함수
+        (브로커, 데이터베이스 연결은 자식 프로세스 안에서 새로 맺어야 함)
+    :param index: 자식 프로세스 번호
+    :param stats_queue: 통계를 전달할 queue
+    :param stats_interval: 통계를 전달하는 주기(초)
+    """
+    crawler = create_crawler(index)
+    signal.signal(signal.SIGTERM, lambda signum, frame: crawler.stop())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    crawler.start()
+    while crawler.is_alive():
+        crawler.join(stats_interval)
+        stats_queue.put((index, dict(crawler.stats), crawler.gauges()))
+
+    # stop()으로 끝난 경우가 아니라면 비정상 종료로 알림
+    if not crawler.stopped.is_set():
+        raise SystemExit(1)
+
+
+class CrawlerSupervisor(object):
+    """
+    여러개의 crawler 프로세스를 띄우고 관리하는 클래스
+    * 프로세스마다 각자의 이벤트 루프, 브로커 / 데이터베이스 연결을 가짐
+    * 비정상 종료된 프로세스는 restart_delay초 후 다시 띄움
+    * 프로세스들의 통계를 모아 stats_interval초마다 출력
+
+    Arguments
+        create_crawler: index를 받아 RepositoryCrawler를 생성하는 함수 (pickle 가능해야 함)
+        num_process: crawler 프로세스 수
+        stats_interval: 통계를 출력하는 주기(초)
+        restart_delay: 비정상 종료된 프로세스를 다시 띄우기까지 기다리는 시간(초)
+    """
+
+    def __init__(self, create_crawler, num_process, stats_interval=60., restart_delay=5.):
+        self.create_crawler = create_crawler
+        self.num_process = num_process
+        self.stats_interval = stats_interval
+        self.restart_delay = restart_delay
+
+        self.stats_queue = multiprocessing.Queue()
+        self.processes = {}
+        self.restarts = {}
+        # 프로세스 별 최근 통계 / 종료된 프로세스들의 통계 합계
+        self.process_stats = {}
+        # 프로세스 별 최근 상태 (동시 IO 수 등, 누적하지 않고 살아있는 프로세스들의 값을 합산)
+        self.process_gauges = {}
+        self.finished_stats = Counter()
+        self.stopped = False
+
+    def start_process(self, index):
+        process = multiprocessing.Process(
+            target=run_crawler, name=f"crawler-{index}",
+            args=(self.create_crawler, index, self.stats_queue, self.stats_interval))
+        process.start()
+        self.processes[index] = process
+
+    def stop(self, signum=None, frame=None):
+        self.stopped = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        for index in range(self.num_process):
+            self.start_process(index)
+
+        prev_report, prev_total = time.time(), Counter()
+        while not self.stopped:
+            self.collect_stats(timeout=1.)
+            self.restart_processes()
+
+            if time.time() - prev_report >= self.stats_interval:
+                prev_report, prev_total = self.report(prev_report, prev_total)
+
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            process.join()
+        self.collect_stats(timeout=0.)
+        self.report(prev_report, prev_total)
+
+    def collect_stats(self, timeout):
+        try:
+            while True:
+                index, stats, gauges = self.stats_queue.get(timeout=timeout)
+                self.process_stats[index] = Counter(stats)
+                self.process_gauges[index] = Counter(gauges)
+                timeout = 0.
+        except queue.Empty:
+            pass
+
+    def restart_processes(self):
+        now = time.time()
+        for index, process in list(self.processes.items()):
+            if process.is_alive():
+                continue
+            if index not in self.restarts:
+                print(f"{process.name} exited with code {process.exitcode}")
+                self.finished_stats += self.process_stats.pop(index, Counter())
+                self.process_gauges.pop(index, None)
+                self.restarts[index] = now + self.restart_delay
+            elif self.restarts[index] <= now:
+                del self.restarts[index]
+                self.start_process(index)
+
+    def total_stats(self):
+        total = Counter(self.finished_stats)
+        for stats in self.process_stats.values():
+            total += stats
+        return total
+
+    def report(self, prev_report, prev_total):
+        now, total = time.time(), self.total_stats()
+        elapsed = max(now - prev_report, 1e-6)
+        rates = ", ".join(f"{k}: {total[k]} ({(total[k] - prev_total[k]) / elapsed:.1f}/s)"
+                          for k in sorted(total))
+        gauges = sum(self.process_gauges.values(), Counter())
+        if gauges:
+            rates += " | " + ", ".join(f"{k}: {gauges[k]}" for k in sorted(gauges))
+        alive = sum(process.is_alive() for process in self.processes.values())
+        print(f"[{alive}/{self.num_process} crawlers] {rates}")
+        return now, total
@@ -0,0 +1,214 @@
+"""
+Copyright 2020, All rights reserved.
+Author : SangJae Kang
+Mail : craftsangjae@gmail.com
+"""
+import os
+import sys
+import json
+import time
+import random
+import threading
+from collections import Counter
+
+
+class Trace(object):
+    """
+    crawl 작업(메시지 하나, 배치, nodes 묶음) 하나의 단계 별 span 기록
+
+    작업이 끝나고(fetch) 작업에서 넘긴 document가 모두 저장될 때까지(write) 참조 수(refs)를 세고,
+    마지막 참조가 release되면 tracer가 파일에 기록한다.
+    """
+    __slots__ = ('tracer', 'kind', 'keys', 'num_messages', 'started', 'origin', 'spans', 'refs')
+
+    def __init__(self, tracer, kind, messages, origin):
+        self.tracer = tracer
+        self.kind = kind
+        self.num_messages = len(messages)
+        self.keys = [message_key(message) for message in messages[:tracer.max_keys]]
+        self.started = time.time()
+        # span의 offset 기준 시각 (time.monotonic())
+        self.origin = origin
+        self.spans = []
+        self.refs = 1
+
+    def span(self, stage, start, end=None, **attrs):
+        """ start ~ end(time.monotonic(), None이면 지금) 구간을 stage span으로 기록
+        """
+        end = time.monotonic() if end is None else end
+        span = {"stage": stage, "offset": round(start - self.origin, 6), "duration": round(end - start, 6)}
+        span.update(attrs)
+        self.spans.append(span)
+
+    def retain(self):
+        self.refs += 1
+
+    def release(self):
+        self.refs -= 1
+        if self.refs == 0:
+            self.tracer.record(self)
+
+    def to_dict(self):
+        return {"kind": self.kind, "messages": self.num_messages, "keys": self.keys,
+                "start": round(self.started, 6),
+                "duration": round(max((s["offset"] + s["duration"] for s in self.spans), default=0.), 6),
+                "spans": self.spans}
+
+
+def message_key(message):
+    if isinstance(message, dict):
+        if 'owner' in message and 'name' in message:
+            return f"{message['owner']}/{message['name']}"
+        if 'id' in message:
+            return f"id:{message['id']}"
+    return None
+
+
+class Tracer(object):
+    """
+    sample_rate 비율의 crawl 작업을 골라 단계 별 span을 JSON Lines 파일에 기록하는 클래스
+    (crawler에 tracer가 없거나 고르지 않은 작업은 기록하지 않으므로 비용이 거의 없음)
+
+    span 종류
+    * broker_get : 브로커에서 메시지를 가져오는 데 걸린 시간
+    * queue_wait : fetch queue에서 fetcher를 기다린 시간
+    * key_wait : 할당량 / 키 대기
+    * fetch : graphQL 요청
+    * parse : 응답 파싱
+    * write : 데이터베이스 저장 (batch : 함께 저장한 document 수)
+
+    Usages
+
+    >>> crawler = RepositoryCrawler(broker, database, githubkey, tracer=Tracer("./trace.jsonl", sample_rate=0.01))
+
+    # 단계 별 소요 시간 요약
+    >>> summarize("./trace.jsonl")
+
+    """
+    def __init__(self, path, sample_rate=0.01, max_keys=5, buffer_size=100, flush_interval=5.):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.max_keys = max_keys
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+
+        self.buffer = []
+        self.flushed_at = time.monotonic()
+        self.num_traces = 0
+
+    def begin(self, kind, messages, origin=None):
+        """ sample_rate 확률로 작업의 Trace를 시작 (고르지 않으면 None)
+        """
+        if random.random() >= self.sample_rate:
+            return None
+        return Trace(self, kind, messages, time.monotonic() if origin is None else origin)
+
+    def record(self, trace):
+        self.buffer.append(json.dumps(trace.to_dict()))
+        self.num_traces += 1
+        if len(self.buffer) >= self.buffer_size or time.monotonic() - self.flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """ 모아둔 trace를 파일에 기록 (sampling된 작업만 기록하므로 양이 적어 바로 기록)
+        """
+        self.flushed_at = time.monotonic()
+        if not self.buffer:
+            return
+        lines, self.buffer = self.buffer, []
+        try:
+            with open(self.path, 'a') as f:
+                f.write("\n".join(lines) + "\n")
+        except IOError as e:
+            print(e)
+
+    def close(self):
+        self.flush()
+
+
+def summarize(path):
+    """ trace 파일의 단계 별 (span 수, 평균 시간, 최대 시간)
+    """
+    counts, totals, maxima = Counter(), Counter(), Counter()
+    with open(path) as f:
+        for line in f:
+            for span in json.loads(line)["spans"]:
+                stage = span["stage"]
+                counts[stage] += 1
+                totals[stage] += span["duration"]
+                maxima[stage] = max(maxima[stage], span["duration"])
+    return {stage: (counts[stage], totals[stage] / counts[stage], maxima[stage]) for stage in counts}
+
+
+class SamplingProfiler(object):
+    """
+    이벤트 루프 thread의 stack을 interval초마다 sampling해 flamegraph용 collapsed stack 형식으로 저장하는 클래스
+    (별도 thread에서 sys._current_frames()로 읽으므로 이벤트 루프를 멈추지 않음)
+
+    저장 형식은 한 줄에 "모듈:함수;모듈:함수;... 횟수" (flamegraph.pl, speedscope 등에서 열 수 있음)
+
+    Arguments
+        path: 저장할 파일 경로
+        duration: sampling하는 시간(초)
+        interval: sampling 주기(초)
+        delay: 시작 후 sampling을 시작하기까지 기다리는 시간(초, warm-up 제외용)
+
+    Usages
+
+    >>> profiler = SamplingProfiler("./crawler.folded", duration=30)
+    >>> profiler.start(threading.get_ident())   # 이벤트 루프 thread에서 호출
+
+    """
+    def __init__(self, path, duration=30., interval=0.005, delay=0.):
+        self.path = path
+        self.duration = duration
+        self.interval = interval
+        self.delay = delay
+
+        self.stacks = Counter()
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def start(self, thread_id=None):
+        """ thread_id(기본 : 현재 thread)의 sampling을 별도 thread에서 시작
+        """
+        if self.thread is not None:
+            return
+        thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.thread = threading.Thread(target=self.run, args=(thread_id,), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """ sampling을 멈추고 (시작했다면) 저장될 때까지 기다리기
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self, thread_id):
+        if self.stopped.wait(self.delay):
+            return
+        deadline = time.monotonic() + self.duration
+        while time.monotonic() < deadline and not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                break
+            self.stacks[self.collapse(frame)] += 1
+        self.dump()
+
+    @staticmethod
+    def collapse(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(stack))
+
+    def dump(self):
+        try:
+            with open(self.path, 'w') as f:
+                for stack, count in self.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        except IOError as e:
+            print(e)
@@ -3,24 +3,64 @@ Copyright 2020, All rights reserved.
 Author : SangJae Kang
 Mail : craftsangjae@gmail.com
 """
+import time
 import asyncio
 import aiohttp
-from threading import Thread
+import weakref
+import threading
+from collections import Counter
+from threading import Thread, Event
 from service.consumer import BaseConsumer
-from service.query import GETREPO_QUERY, GITHUB_GQL, GITHUB_REPOSITORY_ID_URL
+from service.query import GETREPO_QUERY, GETNODES_QUERY, GITHUB_GQL, GITHUB_REPOSITORY_ID_URL
+from service.query import MAX_BATCH_SIZE, MAX_NODES, make_batch_repository_query
 from service.github import GithubKeyGen
 from service.database import BaseDatabase
-from service.document import parse_repository, parse_rateLimit
+from service.dedup import FreshnessFilter
+from service.limiter import AdaptiveLimiter
+from service.planner import BudgetPlanner
+from service.retry import RetryPolicy, RETRY, DEAD, RETRYABLE, FATAL
+from service.metrics import Histogram, MetricsServer
+from service.tracing import Tracer, SamplingProfiler
+from service.retry import classify_exception, classify_response
+from service.document import parse_repository, parse_repository_nodes, parse_rateLimit, parse_cost
+from service.document import repository_node_id
 
 
 class RepositoryCrawler(Thread):
     """
     리파짓토리 정보를 메시지 브로커로부터 가져와서, GihutAPI로부터 획득 후 데이터 베이스로 전달하는 Crawling Thread
 
+    아래 세 단계의 pipeline으로 동작하며, 단계 사이의 queue는 크기가 정해져 있어 뒷 단계가 밀리면 앞 단계가 기다림
+    1. prefetcher : 브로커에서 메시지를 가져와 작업 단위(메시지 하나, 배치, nodes 묶음)로 나누어 fetch queue에 담음
+    2. fetcher (동시 IO 수만큼) : fetch queue에서 작업을 꺼낸 후에야 키를 예약하고 github API로 조회
+    3. writer : write queue에 쌓인 document들을 모아 한 번에 저장하고, 메시지 처리 완료
+
     Arguments
         broker: messaga를 가져올 브로커 인스턴스
         database: crawling한 repository를 저장할 데이터베이스 인스턴스
-        num_concurrent: 비동기적으로 몇개의 동시 IO를 진행할 것인가 결정
+        num_concurrent: 비동기적으로 몇개의 동시 IO를 진행할 것인가 결정 (fetcher 수)
+        batch_size: 한 번의 graphQL 요청으로 가져올 리파짓토리 수 (1이면 메시지 별로 요청)
+        conn_limit: github API로 동시에 열어둘 수 있는 최대 connection 수
+            (None이면 num_concurrent, limiter가 있으면 limiter.max_limit)
+        keepalive_timeout: 사용하지 않는 connection을 유지하는 시간(초)
+        dns_cache_ttl: api.github.com DNS 조회 결과를 캐싱하는 시간(초)
+        http_timeout: github API 요청 하나에 대한 전체 timeout(초)
+        reap_interval: 처리 기한이 지난 메시지를 브로커에 다시 담는 주기(초)
+        dedup: 최근 crawl한 리파짓토리를 걸러낼 FreshnessFilter (None이면 걸러내지 않음)
+        limiter: 동시 IO 수를 응답 결과에 따라 조절할 AdaptiveLimiter (None이면 num_concurrent로 고정)
+        planner: 할당량을 resetAt까지 나누어 쓰도록 요청 속도 / 배치 크기를 정할 BudgetPlanner
+            (None이면 할당량이 남아있는 한 바로 요청)
+        retry_policy: 실패한 메시지의 재시도 / dead-letter를 정할 RetryPolicy (None이면 기본 RetryPolicy)
+        promote_interval: 재시도를 기다리는 메시지 중 시각이 지난 메시지를 브로커에 다시 담는 주기(초)
+        prefetch: fetch queue에 미리 가져다 둘 최대 작업 수 (None이면 num_concurrent)
+        write_batch_size: writer가 한 번에 저장하는 최대 document 수
+        write_queue_size: 저장을 기다리는 최대 document 수
+        write_timeout: document들을 한 번에 저장하는 데 대한 timeout(초)
+        metrics: 상태를 내보낼 MetricsServer (None이면 내보내지 않음)
+        tracer: 일부 작업의 단계 별 span을 기록할 Tracer (None이면 기록하지 않음)
+        profiler: 이벤트 루프 thread를 sampling할 SamplingProfiler (None이면 사용하지 않음)
+        renew_interval: 가져온 메시지(fetch queue에서 기다리거나 키를 기다리는 작업 포함)의
+            처리 기한을 연장하는 주기(초, 브로커의 visibility_timeout보다 충분히 짧아야 함)
 
     """
 
@@ -29,7 +69,26 @@ class RepositoryCrawler(Thread):
                  database:BaseDatabase,
                  githubkey:GithubKeyGen,
                  num_concurrent=100,
-                 sleep=1.):
+                 sleep=1.,
+                 batch_size=1,
+                 conn_limit=None,
+                 keepalive_timeout=30.,
+                 dns_cache_ttl=300,
+                 http_timeout=10.,
+                 reap_interval=60.,
+                 dedup:FreshnessFilter=None,
+                 limiter:AdaptiveLimiter=None,
+                 planner:BudgetPlanner=None,
+                 retry_policy:RetryPolicy=None,
+                 promote_interval=1.,
+                 prefetch=None,
+                 write_batch_size=100,
+                 write_queue_size=1000,
+                 write_timeout=10.,
+                 metrics:MetricsServer=None,
+                 tracer:Tracer=None,
+                 profiler:SamplingProfiler=None,
+                 renew_interval=60.):
         Thread.__init__(self)
         self.daemon = True
         self.broker = broker
@@ -37,6 +96,45 @@ class RepositoryCrawler(Thread):
         self.githubkey = githubkey
         self.num_concurrent = num_concurrent
         self.sleep = sleep
+        self.batch_size = min(max(batch_size, 1), MAX_BATCH_SIZE)
+        self.conn_limit = conn_limit or (limiter.max_limit if limiter is not None else num_concurrent)
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.http_timeout = http_timeout
+        self.reap_interval = reap_interval
+        self.dedup = dedup
+        self.limiter = limiter
+        self.planner = planner
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.promote_interval = promote_interval
+        self.prefetch = prefetch or num_concurrent
+        self.write_batch_size = write_batch_size
+        self.write_queue_size = write_queue_size
+        self.write_timeout = write_timeout
+        self.renew_interval = renew_interval
+
+        # pipeline 단계 사이의 queue (crawl_concurrent 안에서 생성) 및 fetcher 수
+        self.fetch_queue = None
+        self.write_queue = None
+        self.num_fetchers = 0
+        self.metrics = metrics
+        self.tracer = tracer
+        self.profiler = profiler
+        # 저장을 기다리는 document의 trace (id(document) -> Trace, tracer가 있을 때만 사용)
+        self.pending_traces = {}
+        # 브로커에서 가져온 후 아직 처리 완료 / 실패 처리하지 않은 메시지 (id(메시지))
+        self.unsettled = set()
+
+        # 이벤트 루프 별로 하나의 aiohttp session을 재사용 (TCP+TLS handshake 비용 절감)
+        self.sessions = weakref.WeakKeyDictionary()
+        self.stopped = Event()
+        # 처리 결과 통계 (success : 저장 완료, retry : 기다린 후 다시 시도, dead : dead-letter로,
+        # dropped : 버림, error:{실패 원인} : 실패 원인 별 횟수)
+        self.stats = Counter()
+        # 단계 별 latency (key_wait : 할당량 / 키 대기, fetch : graphQL 요청, parse : 응답 파싱,
+        # write : 데이터베이스 저장) 및 github API로 조회 중인 작업 수
+        self.latencies = {stage: Histogram() for stage in ("key_wait", "fetch", "parse", "write")}
+        self.num_inflight = 0
 
     def run(self):
         """ Create and run `Crawling` Event Loop
@@ -44,97 +142,513 @@ class RepositoryCrawler(Thread):
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
 
-        loop.run_until_complete(self.crawl_concurrent())
-        loop.close()
+        try:
+            loop.run_until_complete(self.crawl_concurrent())
+        finally:
+            loop.run_until_complete(self.close())
+            loop.close()
+
+    def stop(self):
+        """ Crawling을 멈추기 (진행 중인 작업은 마무리 후 종료)
+        """
+        self.stopped.set()
+
+    def get_session(self):
+        """ 현재 이벤트 루프에서 사용하는 aiohttp session 가져오기
+        """
+        loop = asyncio.get_event_loop()
+        sess = self.sessions.get(loop)
+        if sess is None or sess.closed:
+            connector = aiohttp.TCPConnector(limit=self.conn_limit,
+                                             keepalive_timeout=self.keepalive_timeout,
+                                             ttl_dns_cache=self.dns_cache_ttl)
+            timeout = aiohttp.ClientTimeout(total=self.http_timeout)
+            sess = aiohttp.ClientSession(connector=connector, timeout=timeout)
+            self.sessions[loop] = sess
+        return sess
+
+    async def close(self):
+        """ 현재 이벤트 루프의 aiohttp session 닫기 & 데이터베이스에 남은 document 저장
+        """
+        sess = self.sessions.pop(asyncio.get_event_loop(), None)
+        if sess is not None and not sess.closed:
+            await sess.close()
+        if self.metrics is not None:
+            await self.metrics.close()
+        if self.profiler is not None:
+            self.profiler.stop()
+        if self.tracer is not None:
+            self.tracer.close()
+        await self.database.close()
+        await self.broker.close()
+        await self.githubkey.close()
+        if self.dedup is not None:
+            await self.dedup.close()
 
     async def crawl_concurrent(self):
-        """ 동시에 github API로 crawl
+        """ prefetcher / fetcher / writer pipeline으로 github API를 통해 crawl
+        (현재 코루틴이 prefetcher 역할을 하며, stop() 이후에는 진행 중인 작업을 마무리하고 종료)
         """
-        concurrent_tasks = set()
         loop = asyncio.get_event_loop()
+        await self.githubkey.setup()
+        try:
+            await self.database.setup()
+        except IOError as e:
+            # 인덱스를 만들지 못하더라도 crawl은 진행
+            print(e)
+        if self.metrics is not None:
+            await self.metrics.start(self)
+        if self.profiler is not None:
+            self.profiler.start(threading.get_ident())
+
+        self.fetch_queue = asyncio.Queue(self.prefetch)
+        self.write_queue = asyncio.Queue(self.write_queue_size)
+        fetchers = set()
+        background = [loop.create_task(self.reap_periodically()),
+                      loop.create_task(self.promote_periodically()),
+                      loop.create_task(self.renew_periodically()),
+                      loop.create_task(self.write_forever())]
+
+        while not self.stopped.is_set():
+            # 동시 IO 수가 늘어난 만큼 fetcher 추가 (줄어든 경우, fetcher가 작업을 마친 후 스스로 종료)
+            while self.num_fetchers < self.concurrency():
+                self.num_fetchers += 1
+                fetcher = loop.create_task(self.fetch_forever())
+                fetcher.add_done_callback(fetchers.discard)
+                fetchers.add(fetcher)
+
+            # 브로커가 비어있으면 최대 sleep초 동안 blocking으로 대기 (polling 하지 않음)
+            get_started = time.monotonic()
+            if self.batch_size > 1:
+                messages = await self.broker.get_many_async(self.get_batch_size(), timeout=self.sleep)
+            else:
+                messages = await self.broker.get_many_async(
+                    max(self.prefetch - self.fetch_queue.qsize(), 1), timeout=self.sleep)
+            if self.dedup is not None and messages:
+                messages = await self.skip_fresh(messages)
+            get_finished = time.monotonic()
+            self.unsettled.update(id(message) for message in messages)
+            for crawl, arg in self.dispatch(messages):
+                trace = None
+                if self.tracer is not None:
+                    trace = self.tracer.begin(crawl.__name__, arg if isinstance(arg, list) else [arg], get_started)
+                    if trace is not None:
+                        trace.span("broker_get", get_started, get_finished)
+                # fetch queue가 가득 차면 fetcher가 작업을 꺼낼 때까지 기다림
+                await self.fetch_queue.put((crawl, arg, trace, time.monotonic()))
+
+        # 가져온 작업을 모두 조회하고, 조회한 document를 모두 저장한 후 종료
+        await self.fetch_queue.join()
+        await self.write_queue.join()
+        for task in list(fetchers) + background:
+            task.cancel()
+        self.fetch_queue = self.write_queue = None
+        self.num_fetchers = 0
+
+    async def fetch_forever(self):
+        """ fetcher : fetch queue에서 작업을 꺼내 github API로 조회
+        """
         while True:
-            if self.broker.isEmpty():
-                await asyncio.sleep(self.sleep)
+            if self.num_fetchers > self.concurrency():
+                self.num_fetchers -= 1
+                return
+            crawl, arg, trace, enqueued = await self.fetch_queue.get()
+            if trace is not None:
+                trace.span("queue_wait", enqueued)
+            self.num_inflight += 1
+            try:
+                await crawl(arg, trace=trace)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 예상하지 못한 예외(키 대기 timeout 등)로 fetcher가 멈추지 않도록 하고,
+                # 작업의 메시지 중 아직 처리하지 않은 메시지는 실패 처리
+                print(e)
+                await self.fail_unsettled(arg if isinstance(arg, list) else [arg], e)
+            finally:
+                self.num_inflight -= 1
+                self.fetch_queue.task_done()
+                if trace is not None:
+                    trace.release()
+
+    async def write_forever(self):
+        """ writer : write queue에 쌓인 (메시지, document)들을 최대 write_batch_size개씩 모아 저장
+        (기다리지 않고 그 순간 쌓여있는 만큼만 모으므로, 부하가 클수록 한 번에 많이 저장)
+        """
+        while True:
+            items = [await self.write_queue.get()]
+            while len(items) < self.write_batch_size and not self.write_queue.empty():
+                items.append(self.write_queue.get_nowait())
+            try:
+                await self.store(items)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(e)
+                await self.fail_unsettled([message for message, _ in items], e)
+            finally:
+                for _ in items:
+                    self.write_queue.task_done()
+
+    async def fail_unsettled(self, messages, error):
+        """ 메시지들 중 아직 처리 완료 / 실패 처리하지 않은 메시지를 실패 원인(error)에 따라 실패 처리
+        """
+        for message in messages:
+            if id(message) not in self.unsettled:
                 continue
-            if len(concurrent_tasks) >= self.num_concurrent:
-                # Wait for some tasks to finish before adding a new one
-                # ref : https://stackoverflow.com/questions/48483348/how-to-limit-concurrency-with-python-asyncio
-                _done, concurrent_tasks = await asyncio.wait(
-                    concurrent_tasks, return_when=asyncio.FIRST_COMPLETED)
-            concurrent_tasks.add(loop.create_task(self.crawl()))
-
-    async def crawl(self):
+            try:
+                await self.fail(message, classify_exception(error), repr(error))
+            except Exception as e:
+                print(e)
+
+    def concurrency(self):
+        """ 현재 동시에 진행할 최대 작업 수
+        """
+        if self.limiter is not None:
+            return self.limiter.limit
+        return self.num_concurrent
+
+    def get_batch_size(self):
+        """ 한 번의 graphQL 요청으로 가져올 리파짓토리 수 (planner가 있으면 planner가 추천하는 크기)
+        """
+        if self.planner is not None:
+            return self.planner.batch_size(self.batch_size)
+        return self.batch_size
+
+    def gauges(self):
+        """ 현재 상태 (모니터링용, 통계와 달리 누적되지 않는 값)
+        """
+        gauges = {}
+        if self.limiter is not None:
+            gauges.update(self.limiter.gauges())
+        if self.fetch_queue is not None:
+            gauges['prefetched'] = self.fetch_queue.qsize()
+            gauges['pending_writes'] = self.write_queue.qsize()
+        return gauges
+
+    async def reap_periodically(self):
+        """ 처리 기한이 지난 메시지(죽은 worker가 처리 중이던 메시지 등)를 주기적으로 브로커에 다시 담기
+        """
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            try:
+                await self.broker.reap_async()
+            except Exception as e:
+                print(e)
+
+    async def renew_periodically(self):
+        """ 가져온 후 아직 처리하지 않은 메시지들의 처리 기한을 주기적으로 연장
+        (키를 기다리는 동안 처리 기한이 지나 다른 worker가 다시 가져가지 않도록 함)
+        """
+        while True:
+            await asyncio.sleep(self.renew_interval)
+            try:
+                await self.broker.renew_async()
+            except Exception as e:
+                print(e)
+
+    async def promote_periodically(self):
+        """ 재시도를 기다리는 메시지 중 다시 시도할 시각이 지난 메시지를 주기적으로 브로커에 다시 담기
+        """
+        while True:
+            await asyncio.sleep(self.promote_interval)
+            try:
+                await self.broker.promote_async()
+            except Exception as e:
+                print(e)
+
+    async def skip_fresh(self, messages):
+        """ 최근 crawl한 (혹은 crawl 중인) 리파짓토리의 메시지는 건너뛰기
+        """
+        messages, skipped = await self.dedup.filter_async(messages)
+        self.stats['skipped'] += len(skipped)
+        for message in skipped:
+            # 우선순위 브로커는 지우지 않고 freshness가 지난 후로 미룸
+            await self.broker.skip_async(message, self.dedup.freshness)
+        return messages
+
+    def dispatch(self, messages):
+        """ 메시지 종류에 따라 crawl 작업((조회 함수, 인자))으로 나누기
+        * {'id': ...} : 최대 MAX_NODES개씩 묶어서 nodes(ids: [...])로 조회
+        * {'owner': ..., 'name': ...} : batch_size개씩 묶어서 (1이면 메시지 별로) 조회
+        """
+        id_messages, name_messages = [], []
+        for message in messages:
+            if isinstance(message, dict) and 'id' in message and 'name' not in message:
+                id_messages.append(message)
+            else:
+                name_messages.append(message)
+
+        jobs = [(self.crawl_nodes, id_messages[i:i + MAX_NODES])
+                for i in range(0, len(id_messages), MAX_NODES)]
+        if self.batch_size > 1 and name_messages:
+            jobs.append((self.crawl_batch, name_messages))
+        else:
+            jobs.extend((self.crawl, message) for message in name_messages)
+        return jobs
+
+    async def crawl(self, message, trace=None):
         """ 비동기 방식으로 아래 작업을 진행
-        1. Github keys 중 할당량이 남아있는 키 획득
-        2. Crawling할 github repository name & owner 가져오기
+        1. 브로커에서 가져온 메시지(github repository name & owner)를 전달 받음
+        2. Github keys 중 할당량이 남아있는 키 획득
         3. Github api를 통해 해당 리파짓토리 정보 획득
-        4. 성공한 경우, database에 put, 실패한 경우, error-cases.log에 저장
+        4. 성공한 경우, database에 put, 실패한 경우, 실패 원인에 따라 재시도 / dead-letter로
+        """
+        if isinstance(message, dict) and 'owner' in message and 'name' in message:
+            repo_name, repo_owner = message['name'], message['owner']
+        else:
+            await self.fail(message, FATAL, "invalid message")
+            return
+
+        shape = ("repository", 1)
+        api_key, cost = await self.reserve_key(shape, trace)
+        try:
+            github_repository_info = await self.get_repository_info_by_name_and_owner(
+                repo_name, repo_owner, api_key, trace=trace)
+        except Exception as e:
+            # 응답을 받지 못한 경우, 예약한 할당량을 돌려주고 실패 원인에 따라 재시도 / dead-letter
+            await self.return_key(api_key, cost, e)
+            await self.fail(message, classify_exception(e), repr(e))
+            return
+        await self.update_rateLimit(api_key, github_repository_info, cost, shape)
+
+        start = time.monotonic()
+        try:
+            document = parse_repository(github_repository_info)
+        except ValueError as e:
+            await self.fail(message, classify_response(github_repository_info, alias='repository'), str(e))
+            return
+        finally:
+            self.observe("parse", start, trace)
+
+        await self.emit(message, document, trace)
+
+    async def emit(self, message, document, trace=None):
+        """ 조회한 document를 writer에게 넘기기
+        (write queue가 가득 차면 기다리며, pipeline 밖에서 호출한 경우 바로 저장)
         """
+        if trace is not None:
+            # 저장이 끝날 때까지 trace를 기록하지 않음
+            trace.retain()
+            self.pending_traces[id(document)] = trace
+        if self.write_queue is not None:
+            await self.write_queue.put((message, document))
+        else:
+            await self.store([(message, document)])
 
-        api_key = await asyncio.wait_for(self.githubkey.get_async(), timeout=3600)
-        message = self.broker.get()
+    async def store(self, items):
+        """ crawl 시각(crawledAt, UTC)을 기록해 document들을 한 번에 저장하고, 메시지 별로 처리 완료 / 실패 처리
+
+        :param items: [(메시지, document), ...]
+        """
+        crawled_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        for _, document in items:
+            document['crawledAt'] = crawled_at
+        start = time.monotonic()
+        try:
+            results = await asyncio.wait_for(
+                self.database.put_many([document for _, document in items]), timeout=self.write_timeout)
+        except (asyncio.TimeoutError, IOError) as e:
+            results = [e] * len(items)
+        self.observe("write", start)
+        if self.pending_traces:
+            traces = [self.pending_traces.pop(id(document), None) for _, document in items]
+            # 같은 작업의 document들을 함께 저장한 경우 span은 한 번만 기록
+            for trace in {id(trace): trace for trace in traces if trace is not None}.values():
+                trace.span("write", start, batch=len(items))
+            for trace in traces:
+                if trace is not None:
+                    trace.release()
+
+        for (message, document), result in zip(items, results):
+            if isinstance(result, Exception):
+                # IOError : 데이터베이스 저장 실패
+                await self.fail(message, RETRYABLE, repr(result))
+            else:
+                await self.ack(message, document)
+
+    async def ack(self, message, document=None):
+        """ 메시지 처리 완료
+        """
+        self.unsettled.discard(id(message))
+        self.stats['success'] += 1
+        if self.dedup is not None:
+            await self.dedup.mark_async(message, document)
+        # 우선순위 브로커는 document로 다음 crawl 시각을 정해 다시 담음
+        await self.broker.ack_async(message, document)
+
+    async def fail(self, message, error_class, reason=None):
+        """ 메시지 처리 실패 : 실패 원인(error_class)에 따라
+        기다린 후 다시 시도하거나, dead-letter로 옮기거나, (없는 리파짓토리는) 버림
+        """
+        self.unsettled.discard(id(message))
+        self.stats[f"error:{error_class}"] += 1
+        if self.dedup is not None:
+            self.dedup.release(message)
+
+        action, delay = self.retry_policy.decide(message, error_class)
+        if action == RETRY:
+            self.stats['retry'] += 1
+            await self.broker.retry_async(message, delay)
+        elif action == DEAD:
+            self.stats['dead'] += 1
+            await self.broker.bury_async(message, f"{error_class}: {str(reason)[:500]}")
+        else:
+            self.stats['dropped'] += 1
+            await self.broker.ack_async(message)
+
+    async def reserve_key(self, shape, trace=None):
+        """ 계획된 할당량이 쌓일 때까지 기다린 후, 예상 cost만큼 할당량이 남아있는 키 예약
+
+        :return: (키, 예약한 cost)
+        """
+        start = time.monotonic()
+        cost = await self.plan(shape)
+        api_key = await asyncio.wait_for(self.githubkey.get_async(cost), timeout=3600)
+        self.observe("key_wait", start, trace)
+        return api_key, cost
+
+    def observe(self, stage, start, trace=None):
+        """ start(time.monotonic())부터 지금까지 걸린 시간을 단계 별 latency에 기록 (trace가 있으면 span도 기록)
+        """
+        end = time.monotonic()
+        self.latencies[stage].observe(end - start)
+        if trace is not None:
+            trace.span(stage, start, end)
+
+    async def plan(self, shape):
+        """ planner가 있으면 계획된 할당량이 쌓일 때까지 기다린 후 예상 cost를 반환 (없으면 1)
+        """
+        if self.planner is None:
+            return 1
+        return await self.planner.pace(shape)
+
+    async def return_key(self, api_key, cost, error):
+        """ 응답을 받지 못한 요청의 키 돌려주기 (키가 폐기된 경우(401)에는 pool에서 제외)
+        """
+        if isinstance(error, PermissionError):
+            await self.githubkey.revoke_async(api_key)
+        else:
+            await self.githubkey.release_async(api_key, cost)
+
+    async def update_rateLimit(self, api_key, github_info, cost=1, shape=None):
+        """ 깃헙의 할당량 정보 갱신 (응답에 rateLimit이 없으면 예약한 할당량을 돌려줌)
+        planner가 있으면 query 모양(shape) 별 실제 cost를 학습
+        """
         try:
+            remain, resetAt = parse_rateLimit(github_info)
+        except (ValueError, TypeError, KeyError):
+            await self.githubkey.release_async(api_key, cost)
+            return
+        await self.githubkey.set_async(api_key, remain, resetAt, cost)
+        if self.planner is not None and shape is not None:
+            self.planner.observe(shape, parse_cost(github_info))
+
+    async def crawl_batch(self, messages, trace=None):
+        """ 비동기 방식으로 아래 작업을 진행
+        1. 브로커에서 가져온 최대 batch_size개의 메시지(github repository name & owner)를 전달 받음
+        2. Github keys 중 할당량이 남아있는 키 획득
+        3. 하나의 aliased graphQL 요청으로 리파짓토리 정보들을 획득
+        4. alias 별로 파싱 후 database에 put, 실패한 alias는 해당 메시지만 실패 처리
+        """
+        valid_messages = []
+        for message in messages:
             if isinstance(message, dict) and 'owner' in message and 'name' in message:
-                repo_name, repo_owner = message['name'], message['owner']
-
-            # TODO : 'id'를 바탕으로 Crawling하는 코드 구성하기
-            # RestAPI을 통해 먼저 이름과 소유주를 받고, 없는 녀석을 채워야 함
-            # elif isinstance(message, dict) and 'id' in message:
-            #     try:
-            #         repo_name, repo_owner = await self.get_name_and_owner_by_repository_id(message['id'], api_key)
-            #     except ConnectionAbortedError:
-            #         await self.githubkey.set_async(api_key, 0)
-            #         self.broker.put(message)
-            #         return
-            #     except ValueError:
-            #
-            #         return
-            #     self.broker.put({"name": repo_name, "owner": repo_owner})
-            #     return
+                valid_messages.append(message)
             else:
-                return
+                await self.fail(message, FATAL, "invalid message")
+        messages = valid_messages
+        if not messages:
+            return
+
+        shape = ("batch", len(messages))
+        api_key, cost = await self.reserve_key(shape, trace)
+        try:
+            github_repository_infos = await self.get_repository_infos_by_name_and_owner(
+                [(message['name'], message['owner']) for message in messages], api_key, trace=trace)
+        except Exception as e:
+            await self.return_key(api_key, cost, e)
+            await asyncio.gather(*[self.fail(message, classify_exception(e), repr(e)) for message in messages])
+            return
+        await self.update_rateLimit(api_key, github_repository_infos, cost, shape)
 
-            github_repository_info = await self.get_repository_info_by_name_and_owner(repo_name, repo_owner, api_key)
+        if not isinstance(github_repository_infos.get('data'), dict):
+            # 요청 전체가 실패한 경우 (alias 별 에러가 아님) : 모두 실패 처리
+            error_class = classify_response(github_repository_infos)
+            reason = str(github_repository_infos)
+            await asyncio.gather(*[self.fail(message, error_class, reason) for message in messages])
+            return
 
+        async def put(message, alias):
+            start = time.monotonic()
             try:
-                document = parse_repository(github_repository_info)
-            except ValueError:
+                document = parse_repository(github_repository_infos, alias=alias)
+            except ValueError as e:
+                await self.fail(message, classify_response(github_repository_infos, alias=alias), str(e))
                 return
+            finally:
+                self.observe("parse", start, trace)
+            await self.emit(message, document, trace)
 
-            await asyncio.wait_for(self.database.put(document), timeout=10)
+        await asyncio.gather(*[put(message, f"r{i}") for i, message in enumerate(messages)])
 
-            # 깃헙의 할당량 정보 갱신
-            try:
-                remain, resetAt = parse_rateLimit(github_repository_info)
-            except ValueError:
+    async def crawl_nodes(self, messages, trace=None):
+        """ 비동기 방식으로 아래 작업을 진행
+        1. 브로커에서 가져온 최대 MAX_NODES개의 메시지(github repository id)를 전달 받음
+        2. Github keys 중 할당량이 남아있는 키 획득
+        3. id를 graphQL node id로 바꾸어 nodes(ids: [...]) 요청 한 번으로 리파짓토리 정보들을 획득
+        4. node 별로 파싱 후 database에 put, 조회하지 못한 id는 해당 메시지만 실패 처리
+        """
+        shape = ("nodes", len(messages))
+        api_key, cost = await self.reserve_key(shape, trace)
+        try:
+            github_repository_infos = await self.get_repository_infos_by_ids(
+                [message['id'] for message in messages], api_key, trace=trace)
+        except Exception as e:
+            await self.return_key(api_key, cost, e)
+            await asyncio.gather(*[self.fail(message, classify_exception(e), repr(e)) for message in messages])
+            return
+        await self.update_rateLimit(api_key, github_repository_infos, cost, shape)
+
+        start = time.monotonic()
+        try:
+            documents = parse_repository_nodes(github_repository_infos)
+        except ValueError as e:
+            # 요청 전체가 실패한 경우 : 모두 실패 처리
+            error_class = classify_response(github_repository_infos)
+            await asyncio.gather(*[self.fail(message, error_class, str(e)) for message in messages])
+            return
+        finally:
+            self.observe("parse", start, trace)
+
+        async def put(index, message, document):
+            if isinstance(document, ValueError):
+                await self.fail(message, classify_response(github_repository_infos, index=index), str(document))
                 return
-            await asyncio.wait_for(self.githubkey.set_async(api_key, remain, resetAt), timeout=10)
-        except asyncio.TimeoutError:
-            self.broker.put(message)
-
-    @staticmethod
-    async def get_name_and_owner_by_repository_id(repo_id, api_key):
-        async with aiohttp.ClientSession() as sess:
-            auth = {"Authorization": "bearer " + api_key}
-            async with sess.get(GITHUB_REPOSITORY_ID_URL + str(repo_id), headers=auth) as res:
-                content = await asyncio.wait_for(res.json(), timeout=10)
-                status_code = res.status
-
-                if status_code == 403 and "api rate limit" in content.get("message", "").lower():
-                    raise ConnectionAbortedError(str(content))
-
-                if ('owner' in content
-                        and isinstance(content['owner'], dict)
-                        and 'login' in content['owner']):
-                    repo_owner = content['owner']['login']
-                else:
-                    raise ValueError(f"{repo_id} - content: {content}")
-                repo_name = content.get("name", "")
-        return repo_name, repo_owner
+            await self.emit(message, document, trace)
+
+        await asyncio.gather(*[put(i, message, document)
+                               for i, (message, document) in enumerate(zip(messages, documents))])
 
-    @staticmethod
-    async def get_repository_info_by_name_and_owner(name, owner, api_key):
+    async def get_name_and_owner_by_repository_id(self, repo_id, api_key):
         auth = {"Authorization": "bearer " + api_key}
+        async with self.get_session().get(GITHUB_REPOSITORY_ID_URL + str(repo_id), headers=auth) as res:
+            content = await res.json()
+            status_code = res.status
+
+            if status_code == 403 and "api rate limit" in content.get("message", "").lower():
+                raise ConnectionAbortedError(str(content))
+
+            if ('owner' in content
+                    and isinstance(content['owner'], dict)
+                    and 'login' in content['owner']):
+                repo_owner = content['owner']['login']
+            else:
+                raise ValueError(f"{repo_id} - content: {content}")
+            repo_name = content.get("name", "")
+        return repo_name, repo_owner
+
+    async def get_repository_info_by_name_and_owner(self, name, owner, api_key, trace=None):
         query = {
             "query": GETREPO_QUERY,
             "variables": {
@@ -142,6 +656,79 @@ class RepositoryCrawler(Thread):
                 "name": name
             }
         }
-        async with aiohttp.ClientSession() as sess:
-            async with sess.post(GITHUB_GQL, headers=auth, json=query) as res:
-                return await asyncio.wait_for(res.json(), timeout=10)
+        return await self.post_graphql(query, api_key, trace)
+
+    async def get_repository_infos_by_name_and_owner(self, names_and_owners, api_key, trace=None):
+        """ 여러 리파짓토리 정보를 하나의 aliased graphQL 요청으로 가져오기
+
+        :param names_and_owners: [(name, owner), ...]
+        :param api_key: githubAPI Key
+        :return: graphQL 응답 (i번째 리파짓토리는 data.r{i})
+        """
+        variables = {}
+        for i, (name, owner) in enumerate(names_and_owners):
+            variables[f"owner{i}"] = owner
+            variables[f"name{i}"] = name
+        query = {
+            "query": make_batch_repository_query(len(names_and_owners)),
+            "variables": variables
+        }
+        return await self.post_graphql(query, api_key, trace)
+
+    async def get_repository_infos_by_ids(self, repo_ids, api_key, trace=None):
+        """ 여러 리파짓토리 정보를 id로 한 번에 가져오기
+
+        :param repo_ids: 리파짓토리의 숫자 id (혹은 graphQL node id) 목록
+        :param api_key: githubAPI Key
+        :return: graphQL 응답 (i번째 리파짓토리는 data.nodes[i])
+        """
+        query = {
+            "query": GETNODES_QUERY,
+            "variables": {
+                "ids": [repository_node_id(repo_id) if str(repo_id).isdigit() else repo_id
+                        for repo_id in repo_ids]
+            }
+        }
+        return await self.post_graphql(query, api_key, trace)
+
+    async def post_graphql(self, query, api_key, trace=None):
+        """ graphQL 요청을 보내고 응답을 받기 (응답 결과는 limiter에 전달)
+
+        :param query: {"query": ..., "variables": ...}
+        :param api_key: githubAPI Key
+        :param trace: 요청 시간을 fetch span으로 기록할 Trace
+        :return: graphQL 응답
+        :raise PermissionError: 키가 폐기된 경우 (401)
+        :raise ConnectionRefusedError: github이 abuse / secondary rate limit으로 거절한 경우 (403)
+        :raise ConnectionAbortedError: github이 과부하로 응답하지 못한 경우 (5xx)
+        :raise IOError: 연결 오류, 응답을 파싱하지 못한 경우
+        :raise asyncio.TimeoutError: http_timeout 안에 응답을 받지 못한 경우
+        """
+        auth = {"Authorization": "bearer " + api_key}
+        start = time.monotonic()
+        try:
+            async with self.get_session().post(GITHUB_GQL, headers=auth, json=query) as res:
+                if res.status == 401:
+                    raise PermissionError(f"{res.status} - {api_key[:4]}... is bad credentials")
+                if res.status == 403:
+                    raise ConnectionRefusedError(f"{res.status} - {(await res.text())[:200]}")
+                if res.status >= 500:
+                    raise ConnectionAbortedError(f"{res.status} - {(await res.text())[:200]}")
+                content = await res.json()
+        except (asyncio.TimeoutError, ConnectionRefusedError, ConnectionAbortedError):
+            self.on_overload()
+            raise
+        except aiohttp.ClientError as e:
+            self.on_overload()
+            raise IOError(str(e)) from e
+        finally:
+            self.observe("fetch", start, trace)
+
+        if self.limiter is not None:
+            self.limiter.on_success(time.monotonic() - start)
+        return content
+
+    def on_overload(self):
+        self.stats['overloaded'] += 1
+        if self.limiter is not None:
+            self.limiter.on_overload()
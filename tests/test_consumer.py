@@ -3,8 +3,11 @@ Copyright 2020, All rights reserved.
 Author : SangJae Kang
 Mail : craftsangjae@gmail.com
 """
+import json
+import time
+import asyncio
 import unittest
-from service.consumer import RedisQueue
+from service.consumer import RedisQueue, RedisStreamQueue, RedisPriorityQueue
 
 
 class TestConsumerMethods(unittest.TestCase):
@@ -43,7 +46,213 @@ class TestConsumerMethods(unittest.TestCase):
         self.assertDictEqual(self.queue.get(), msg3)
         self.assertIsNone(self.queue.get())
 
+    def test_putManyAndGetMany(self):
+        self.queue.deleteAll()
+        msgs = [{"owner": f"tensorflow{i}", "name": f"tensorflow{i}"} for i in range(5)]
+        self.queue.put_many(msgs)
+        self.assertEqual(len(self.queue), 5)
+
+        self.assertListEqual(self.queue.get_many(2), msgs[:2])
+
+        loop = asyncio.get_event_loop()
+        self.assertListEqual(loop.run_until_complete(self.queue.get_many_async(10)), msgs[2:])
+        self.assertListEqual(loop.run_until_complete(self.queue.get_many_async(10, timeout=1)), [])
+
+    def test_reliable_ackAndNack(self):
+        queue = RedisQueue("reliable", reliable=True, consumer="test", max_deliveries=2,
+                           host="localhost", port="6379", db="0")
+        queue.deleteAll()
+        queue.rq.delete(queue.processing_key, queue.leases_key, queue.deliveries_key, queue.dead_key)
+
+        msg1 = {"owner": "tensorflow1", "name": "tensorflow1"}
+        msg2 = {"owner": "tensorflow2", "name": "tensorflow2"}
+        queue.put_many([msg1, msg2])
+
+        message = queue.get()
+        self.assertDictEqual(message, msg1)
+        self.assertEqual(queue.rq.llen(queue.processing_key), 1)
+        queue.ack(message)
+        self.assertEqual(queue.rq.llen(queue.processing_key), 0)
+
+        # 두 번 실패하면 dead-letter로
+        queue.nack(queue.get())
+        self.assertEqual(len(queue), 1)
+        queue.nack(queue.get())
+        self.assertTrue(queue.isEmpty())
+        self.assertEqual(queue.rq.llen(queue.dead_key), 1)
+
+    def test_reliable_retryAndBury(self):
+        queue = RedisQueue("delayed", reliable=True, consumer="test",
+                           host="localhost", port="6379", db="0")
+        queue.deleteAll()
+        queue.rq.delete(queue.processing_key, queue.delayed_key, queue.dead_key)
+
+        queue.put_many([{"owner": "tensorflow1", "name": "tensorflow1"},
+                        {"owner": "tensorflow2", "name": "tensorflow2"}])
+
+        # 시각이 지나기 전에는 다시 담지 않음
+        message = queue.get()
+        message['_attempts'] = 1
+        queue.retry(message, 0.5)
+        self.assertEqual(queue.rq.llen(queue.processing_key), 0)
+        self.assertEqual(queue.promote(), 0)
+        time.sleep(0.6)
+        self.assertEqual(queue.promote(), 1)
+
+        # 다시 담은 메시지는 바로 처리됨
+        message = queue.get()
+        self.assertDictEqual(message, {"owner": "tensorflow1", "name": "tensorflow1", "_attempts": 1})
+        queue.ack(message)
+
+        queue.bury(queue.get(), "fatal: test")
+        self.assertTrue(queue.isEmpty())
+        self.assertEqual(queue.rq.llen(queue.processing_key), 0)
+        self.assertDictEqual(json.loads(queue.rq.lindex(queue.dead_key, 0)),
+                             {"owner": "tensorflow2", "name": "tensorflow2", "_error": "fatal: test"})
+
+
+class TestStreamQueueMethods(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = RedisStreamQueue("stream", consumer="test", visibility_timeout=0.1, max_deliveries=2,
+                                      host="localhost", port="6379", db="0")
+        self.queue.deleteAll()
+        self.queue.rq.delete(self.queue.delayed_key, self.queue.dead_key)
+
+    def test_putManyAndGetMany(self):
+        msgs = [{"owner": f"tensorflow{i}", "name": f"tensorflow{i}"} for i in range(5)]
+        self.queue.put_many(msgs)
+        self.assertEqual(len(self.queue), 5)
+
+        messages = self.queue.get_many(2)
+        self.assertListEqual(messages, msgs[:2])
+        self.assertEqual(len(self.queue), 3)
+
+        # ack한 메시지는 stream에서 지움
+        for message in messages:
+            self.queue.ack(message)
+        self.assertEqual(self.queue.rq.xlen(self.queue.stream_key), 3)
+
+        loop = asyncio.get_event_loop()
+        self.assertListEqual(loop.run_until_complete(self.queue.get_many_async(10)), msgs[2:])
+        self.assertListEqual(loop.run_until_complete(self.queue.get_many_async(10, timeout=0.1)), [])
+
+    def test_nackAndReap(self):
+        msg = {"owner": "tensorflow1", "name": "tensorflow1"}
+        self.queue.put(msg)
+
+        # 한 번 실패한 메시지는 다시 담김
+        self.queue.nack(self.queue.get())
+        self.assertDictEqual(self.queue.get(), msg)
+
+        # 두 번 전달한 메시지의 처리 기한이 지나면 다른 consumer의 reap에서 원인과 함께 dead-letter로
+        time.sleep(0.2)
+        other = RedisStreamQueue("stream", consumer="other", visibility_timeout=0.1, max_deliveries=2,
+                                 host="localhost", port="6379", db="0")
+        self.assertEqual(other.reap(), 1)
+        self.assertTrue(self.queue.isEmpty())
+        self.assertEqual(self.queue.rq.xpending(self.queue.stream_key, self.queue.group)['pending'], 0)
+        self.assertDictEqual(json.loads(self.queue.rq.lindex(self.queue.dead_key, 0)),
+                             dict(msg, _error="delivered 2 times"))
+
+    def test_reclaimExpired(self):
+        msg = {"owner": "tensorflow1", "name": "tensorflow1"}
+        self.queue.put(msg)
+        self.queue.get()
+
+        # 처리 기한이 지난 메시지는 다른 consumer가 같은 entry로 가져가며, 전달 횟수는 consumer group의 횟수
+        time.sleep(0.2)
+        other = RedisStreamQueue("stream", consumer="other", visibility_timeout=0.1, max_deliveries=2,
+                                 host="localhost", port="6379", db="0")
+        self.assertEqual(other.reap(), 1)
+        message = other.get()
+        self.assertDictEqual(message, msg)
+        self.assertEqual(other.inflight[id(message)][2], 2)
+
+        # 마지막 전달에서 실패하면 바로 dead-letter로
+        other.nack(message)
+        self.assertEqual(self.queue.rq.xlen(self.queue.stream_key), 0)
+        self.assertDictEqual(json.loads(self.queue.rq.lindex(self.queue.dead_key, 0)),
+                             dict(msg, _error="delivered 2 times"))
+
+    def test_renew(self):
+        self.queue.put({"owner": "tensorflow1", "name": "tensorflow1"})
+        message = self.queue.get()
+
+        # 처리 기한을 연장한 메시지는 다른 consumer가 가져가지 않음
+        time.sleep(0.15)
+        self.assertEqual(self.queue.renew(), 1)
+        other = RedisStreamQueue("stream", consumer="other", visibility_timeout=0.1, max_deliveries=2,
+                                 host="localhost", port="6379", db="0")
+        self.assertEqual(other.reap(), 0)
+        self.queue.ack(message)
+        self.assertEqual(self.queue.renew(), 0)
+
+    def test_retryAndPromote(self):
+        self.queue.put({"owner": "tensorflow1", "name": "tensorflow1"})
+        message = self.queue.get()
+        message['_attempts'] = 1
+        self.queue.retry(message, 0.2)
+        self.assertEqual(self.queue.promote(), 0)
+        time.sleep(0.3)
+        self.assertEqual(self.queue.promote(), 1)
+        self.assertDictEqual(self.queue.get(), {"owner": "tensorflow1", "name": "tensorflow1", "_attempts": 1})
+
+
+class TestPriorityQueueMethods(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = RedisPriorityQueue("frontier", visibility_timeout=0.2,
+                                        host="localhost", port="6379", db="0")
+        self.queue.deleteAll()
+
+    def test_scheduleAndLease(self):
+        msgs = [{"id": i} for i in range(3)]
+        self.queue.put_many(msgs)
+        self.assertEqual(len(self.queue), 3)
+
+        # crawl이 끝난 메시지는 다음 crawl 시각까지 꺼내지 않음
+        loop = asyncio.get_event_loop()
+        messages = loop.run_until_complete(self.queue.get_many_async(2))
+        self.assertListEqual(messages, msgs[:2])
+        crawled_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        loop.run_until_complete(self.queue.ack_async(messages[0], {"crawledAt": crawled_at}))
+        self.assertGreater(self.queue.rq.zscore(self.queue.frontier_key, '{"id": 0}'), time.time())
+        self.assertListEqual(self.queue.get_many(10), [msgs[2]])
+
+        # 처리 기한이 지나도록 ack 받지 못한 메시지는 다시 꺼냄
+        time.sleep(0.3)
+        self.assertListEqual(self.queue.get_many(10), [{"id": 1}, {"id": 2}])
+
+    def test_skipAndDrop(self):
+        self.queue.put_many([{"id": 0}, {"id": 1}])
+        loop = asyncio.get_event_loop()
+        skipped, dropped = self.queue.get_many(2)
 
+        # 건너뛴 메시지는 지우지 않고 미룸, document 없이 처리 완료한 메시지는 지움
+        loop.run_until_complete(self.queue.skip_async(skipped, 3600))
+        loop.run_until_complete(self.queue.ack_async(dropped))
+        self.assertEqual(self.queue.rq.zcard(self.queue.frontier_key), 1)
+        self.assertGreater(self.queue.rq.zscore(self.queue.frontier_key, '{"id": 0}'), time.time())
 
+    def test_putWithDatabase(self):
+        # database가 있으면 score를 정하지 않고 담을 수 없음
+        queue = RedisPriorityQueue("frontier", database=object(), host="localhost", port="6379", db="0")
+        with self.assertRaises(ValueError):
+            queue.put_many([{"id": 0}])
+        self.assertEqual(self.queue.rq.zcard(self.queue.frontier_key), 0)
 
+    def test_renew(self):
+        self.queue.put_many([{"id": 0}, {"id": 1}])
+        leased, acked = self.queue.get_many(2)
+        loop = asyncio.get_event_loop()
+        crawled_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        loop.run_until_complete(self.queue.ack_async(acked, {"crawledAt": crawled_at}))
+        scheduled = self.queue.rq.zscore(self.queue.frontier_key, '{"id": 1}')
 
+        # 처리 기한을 연장한 메시지는 다시 꺼내지 않고, 다음 crawl 시각은 바꾸지 않음
+        time.sleep(0.15)
+        loop.run_until_complete(self.queue.renew_async())
+        time.sleep(0.1)
+        self.assertListEqual(self.queue.get_many(10), [])
+        self.assertEqual(self.queue.rq.zscore(self.queue.frontier_key, '{"id": 1}'), scheduled)
@@ -3,10 +3,17 @@ Copyright 2020, All rights reserved.
 Author : SangJae Kang
 Mail : craftsangjae@gmail.com
 """
+import os
+import gzip
 import asyncio
 import unittest
 import json
-from service.database import MongoDatabase
+import tempfile
+from service.database import MongoDatabase, FileSystemDatabase, ParquetDatabase
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
 
 class TestConsumerMethods(unittest.TestCase):
@@ -43,6 +50,134 @@ class TestConsumerMethods(unittest.TestCase):
         res = loop.run_until_complete(self.db.get("abc"))
         self.assertIsNone(res)
 
+    def test_skip_unchanged(self):
+        loop = asyncio.get_event_loop()
+        db = MongoDatabase("repository", skip_unchanged=True)
+        loop.run_until_complete(db.deleteAll())
+
+        document = dict(self.documents[0])
+        loop.run_until_complete(db.put(dict(document)))
+        loop.run_until_complete(db.put(dict(document)))
+        self.assertEqual(db.unchanged, 1)
+
+        # 바뀐 필드만 저장
+        document['stargazers'] += 1
+        loop.run_until_complete(db.put(dict(document)))
+        self.assertEqual(db.unchanged, 1)
+        res = loop.run_until_complete(db.get(document['id']))
+        self.assertDictEqual(res, document)
+
+        # 다른 인스턴스는 저장된 document와 비교
+        other = MongoDatabase("repository", skip_unchanged=True)
+        loop.run_until_complete(other.put(dict(document)))
+        self.assertEqual(other.unchanged, 1)
+
+        # 바뀌지 않은 document도 crawl 시각은 갱신
+        loop.run_until_complete(other.put(dict(document, crawledAt="2020-09-13T00:00:00Z")))
+        res = loop.run_until_complete(db.get(document['id']))
+        self.assertEqual(res['crawledAt'], "2020-09-13T00:00:00Z")
+
+        # 다른 인스턴스가 먼저 저장한 경우, 캐시가 오래된 인스턴스는 전체를 다시 저장
+        loop.run_until_complete(other.put(dict(document, stargazers=0, description="changed")))
+        document['stargazers'] += 1
+        loop.run_until_complete(db.put(dict(document)))
+        res = loop.run_until_complete(db.get(document['id']))
+        self.assertDictEqual(res, document)
+
+    def test_ensure_indexes_and_get_many(self):
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(self.db.deleteAll())
+        loop.run_until_complete(self.db.setup())
+        for document in self.documents:
+            loop.run_until_complete(self.db.put(document))
+
+        indexes = loop.run_until_complete(self.db.get_collection().index_information())
+        self.assertTrue(indexes['id_unique']['unique'])
+
+        ids = [document['id'] for document in self.documents[:2]] + ["abc"]
+        res = loop.run_until_complete(self.db.get_many(ids, projection=['stargazers']))
+        self.assertSetEqual(set(res), set(ids[:2]))
+        self.assertDictEqual(res[ids[0]], {"id": ids[0], "stargazers": self.documents[0]['stargazers']})
+
+
+class TestFileSystemDatabase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.documents = json.load(open("./mock_document.json"))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_put_and_close(self):
+        loop = asyncio.get_event_loop()
+        fpath = os.path.join(self.tmpdir.name, "repository.jsonl")
+        db = FileSystemDatabase(fpath)
+        loop.run_until_complete(asyncio.gather(*[db.put(document) for document in self.documents]))
+        loop.run_until_complete(db.close())
+
+        with open(fpath) as f:
+            res = [json.loads(line) for line in f]
+        self.assertCountEqual(res, self.documents)
+
+    def test_rotate_with_gzip(self):
+        loop = asyncio.get_event_loop()
+        fpath = os.path.join(self.tmpdir.name, "repository.jsonl")
+        db = FileSystemDatabase(fpath, compression="gzip", max_bytes=1, chunk_size=1)
+        for document in self.documents:
+            loop.run_until_complete(db.put(document))
+        loop.run_until_complete(db.close())
+
+        # 파일 하나에 document 하나씩 기록됨
+        fnames = sorted(os.listdir(self.tmpdir.name))
+        self.assertEqual(len(fnames), len(self.documents))
+        res = []
+        for fname in fnames:
+            self.assertTrue(fname.endswith(".jsonl.gz"))
+            with gzip.open(os.path.join(self.tmpdir.name, fname), 'rt') as f:
+                res.extend(json.loads(line) for line in f)
+        self.assertListEqual(res, self.documents)
+
+
+@unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+class TestParquetDatabase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.documents = json.load(open("./mock_document.json"))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_put_and_close(self):
+        loop = asyncio.get_event_loop()
+        db = ParquetDatabase(self.tmpdir.name, row_group_size=2)
+        for document in self.documents:
+            loop.run_until_complete(db.put(dict(document, crawledAt="2020-09-12T00:00:00Z")))
+        loop.run_until_complete(db.close())
+
+        self.assertListEqual(sorted(os.listdir(self.tmpdir.name)), ["_wal", "dt=2020-09-12"])
+        self.assertListEqual(os.listdir(os.path.join(self.tmpdir.name, "_wal")), [])
+        table = pyarrow.parquet.read_table(os.path.join(self.tmpdir.name, "dt=2020-09-12"))
+        self.assertEqual(table.num_rows, len(self.documents))
+        rows = {row['id']: row for row in table.to_pylist()}
+        for document in self.documents:
+            self.assertEqual(rows[document['id']]['stargazers'], document['stargazers'])
+            self.assertListEqual(rows[document['id']]['languages'], document['languages'])
+
+    def test_recover_and_invalid_document(self):
+        loop = asyncio.get_event_loop()
+        documents = [dict(document, crawledAt="2020-09-12T00:00:00Z") for document in self.documents]
 
+        # 파일로 옮기기 전에 죽은 경우 (log만 남음)
+        db = ParquetDatabase(self.tmpdir.name)
+        self.assertListEqual(loop.run_until_complete(db.put_many(documents)), [None] * len(documents))
+        db.wal.close()
 
+        # schema로 변환할 수 없는 document만 실패
+        db = ParquetDatabase(self.tmpdir.name)
+        loop.run_until_complete(db.setup())
+        results = loop.run_until_complete(db.put_many([{"id": "bad", "stargazers": "many"}]))
+        self.assertIsInstance(results[0], ValueError)
+        loop.run_until_complete(db.close())
 
+        table = pyarrow.parquet.read_table(os.path.join(self.tmpdir.name, "dt=2020-09-12"))
+        self.assertEqual(table.num_rows, len(documents))
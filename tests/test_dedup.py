@@ -0,0 +1,42 @@
+"""
+Copyright 2020, All rights reserved.
+Author : SangJae Kang
+Mail : craftsangjae@gmail.com
+"""
+import asyncio
+import unittest
+from service.dedup import FreshnessFilter
+
+
+class TestFreshnessFilter(unittest.TestCase):
+    def setUp(self):
+        # redis 없이 in-process LRU만 사용
+        self.dedup = FreshnessFilter(freshness=3600, maxsize=2)
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_skip_inflight_and_fresh(self):
+        msg1 = {"owner": "tensorflow", "name": "tensorflow"}
+        msg2 = {"owner": "TensorFlow", "name": "TensorFlow"}
+        msg3 = {"id": 45717250}
+
+        messages, skipped = self.loop.run_until_complete(self.dedup.filter_async([msg1, msg2, msg3]))
+        self.assertListEqual(messages, [msg1, msg3])
+        self.assertListEqual(skipped, [msg2])
+
+        # crawl이 끝나면 id로 들어온 메시지도 건너뜀
+        document = {"owner": "tensorflow", "name": "tensorflow", "repo_id": 45717250}
+        self.loop.run_until_complete(self.dedup.mark_async(msg1, document))
+        self.dedup.release(msg3)
+        messages, skipped = self.loop.run_until_complete(self.dedup.filter_async([msg2, msg3]))
+        self.assertListEqual(messages, [])
+        self.assertEqual(self.dedup.skipped, 3)
+
+    def test_release_failed(self):
+        msg = {"owner": "benfred", "name": "implicit"}
+        self.loop.run_until_complete(self.dedup.filter_async([msg]))
+        self.dedup.release(msg)
+        messages, _ = self.loop.run_until_complete(self.dedup.filter_async([msg]))
+        self.assertListEqual(messages, [msg])
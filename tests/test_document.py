@@ -0,0 +1,78 @@
+"""
+Copyright 2020, All rights reserved.
+Author : SangJae Kang
+Mail : craftsangjae@gmail.com
+"""
+import json
+import unittest
+from service.document import parse_repository, parse_errors, parse_repository_nodes, repository_node_id
+from service.document import document_digest
+from service.query import make_batch_repository_query, MAX_BATCH_SIZE
+
+
+class TestDocumentMethods(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.documents = json.load(open("./mock_document.json"))
+
+    @staticmethod
+    def to_graphql(document):
+        repository = dict(document)
+        repository.pop('repo_id')
+        repository['owner'] = {"login": document['owner']}
+        for k in ["watchers", "stargazers", "commitComments",
+                  "pullRequests", "releases", "deployments", "labels"]:
+            repository[k] = {"totalCount": document[k]}
+        repository['primaryLanguage'] = {"name": document['primaryLanguage']}
+        repository['licenseInfo'] = {"name": document['licenseInfo']}
+        repository['languages'] = {"nodes": [{"name": name} for name in document['languages']]}
+        repository['repositoryTopics'] = {
+            "nodes": [{"topic": {"name": name}} for name in document['repositoryTopics']]}
+        return repository
+
+    def test_parse_repository(self):
+        document = self.documents[0]
+        query = {"data": {"repository": self.to_graphql(document)}}
+        self.assertEqual(parse_repository(query), document)
+
+    def test_parse_batch_repository(self):
+        data = {f"r{i}": self.to_graphql(document) for i, document in enumerate(self.documents)}
+        data['r1'] = None
+        query = {
+            "data": data,
+            "errors": [{"type": "NOT_FOUND", "path": ["r1"], "message": "Could not resolve"}]
+        }
+        self.assertEqual(parse_repository(query, alias='r0'), self.documents[0])
+        self.assertEqual(parse_repository(query, alias='r2'), self.documents[2])
+        with self.assertRaises(ValueError):
+            parse_repository(query, alias='r1')
+        self.assertEqual(list(parse_errors(query)), ['r1'])
+
+    def test_make_batch_repository_query(self):
+        query = make_batch_repository_query(3)
+        self.assertIn("r2: repository(owner:$owner2, name:$name2)", query)
+        self.assertNotIn("r3:", query)
+        with self.assertRaises(ValueError):
+            make_batch_repository_query(MAX_BATCH_SIZE + 1)
+
+    def test_repository_node_id(self):
+        for document in self.documents:
+            self.assertEqual(repository_node_id(document['repo_id']), document['id'])
+
+    def test_parse_repository_nodes(self):
+        query = {
+            "data": {"nodes": [self.to_graphql(self.documents[0]), None]},
+            "errors": [{"type": "NOT_FOUND", "path": ["nodes", 1], "message": "Could not resolve"}]
+        }
+        documents = parse_repository_nodes(query)
+        self.assertEqual(documents[0], self.documents[0])
+        self.assertIsInstance(documents[1], ValueError)
+
+    def test_document_digest(self):
+        document = self.documents[0]
+        reordered = dict(reversed(list(document.items())))
+        self.assertEqual(document_digest(document), document_digest(reordered))
+        self.assertEqual(document_digest(document), document_digest(dict(document, _digest="abc")))
+
+        changed = dict(document, stargazers=document['stargazers'] + 1)
+        self.assertNotEqual(document_digest(document), document_digest(changed))
@@ -3,9 +3,15 @@ Copyright 2020, All rights reserved.
 Author : SangJae Kang
 Mail : craftsangjae@gmail.com
 """
+import os
 import asyncio
+import tempfile
 import unittest
-from service.github import GithubKeyGen
+import redis
+from unittest.mock import patch
+from datetime import datetime, timedelta
+from dateutil.tz import tzutc
+from service.github import GithubKeyGen, RedisGithubKeyGen
 
 
 class TestGithub(unittest.TestCase):
@@ -33,4 +39,107 @@ class TestGithub(unittest.TestCase):
 
         self.github.update_resource_limit()
         print("Length : ", len(self.github))
-        loop.close()
\ No newline at end of file
+        loop.close()
+
+
+class TestGithubKeyScheduler(unittest.TestCase):
+    """ github API를 호출하지 않고 키 할당 순서와 할당량 예약을 확인 """
+
+    def setUp(self):
+        now = datetime.now(tz=tzutc())
+        self.limits = {"key1": (2, now + timedelta(hours=1)),
+                       "key2": (5, now + timedelta(minutes=30)),
+                       "key3": (0, now + timedelta(minutes=10))}
+        with tempfile.NamedTemporaryFile('w', suffix=".txt", delete=False) as f:
+            f.write("\n".join(self.limits))
+
+        async def get_resource_limit_async(sess, key):
+            return self.limits[key]
+
+        with patch.object(GithubKeyGen, "get_resource_limit_async", staticmethod(get_resource_limit_async)):
+            self.github = GithubKeyGen(f.name)
+        os.remove(f.name)
+
+    def test_reserve_and_release(self):
+        loop = asyncio.new_event_loop()
+        keys = [loop.run_until_complete(self.github.get_async()) for _ in range(7)]
+        self.assertEqual(keys.count("key2"), 5)
+        self.assertEqual(keys.count("key1"), 2)
+        self.assertEqual(len(self.github), 0)
+        self.assertIsNone(self.github.reserve())
+
+        self.github.release("key1")
+        self.assertEqual(self.github.reserve(), "key1")
+
+        # 응답으로 받은 rateLimit으로 갱신 (응답을 기다리는 예약량은 제외)
+        loop.run_until_complete(self.github.set_async("key2", 3, self.limits["key2"][1]))
+        self.assertEqual(self.github.key_cache["key2"][0], 3 - 4)
+        loop.close()
+
+    def test_revoke(self):
+        self.github.revoke("key2")
+        self.assertEqual(self.github.reserve(), "key1")
+        self.assertNotIn("key2", self.github.key_cache)
+
+    def test_setup_inside_event_loop(self):
+        async def get_resource_limit_async(sess, key):
+            return self.limits[key]
+
+        async def create():
+            # 실행 중인 이벤트 루프 안에서는 동기로 불러올 수 없고, load=False로 만든 후 setup
+            with self.assertRaises(RuntimeError):
+                self.github.update_resource_limit()
+            with self.assertRaises(RuntimeError):
+                GithubKeyGen(f.name)
+            github = GithubKeyGen(f.name, load=False)
+            await github.setup()
+            return github
+
+        with tempfile.NamedTemporaryFile('w', suffix=".txt", delete=False) as f:
+            f.write("\n".join(self.limits))
+        loop = asyncio.new_event_loop()
+        try:
+            with patch.object(GithubKeyGen, "get_resource_limit_async", staticmethod(get_resource_limit_async)):
+                github = loop.run_until_complete(create())
+        finally:
+            loop.close()
+            os.remove(f.name)
+        self.assertListEqual(list(github.key_cache), ["key1", "key2", "key3"])
+
+
+class TestRedisGithubKeyGen(unittest.TestCase):
+    """ 두 RedisGithubKeyGen이 redis에 저장된 할당량을 나눠 쓰는지 확인 (docker-compose의 redis 사용) """
+
+    def test_shared_quota(self):
+        resetAt = datetime.now(tz=tzutc()).replace(microsecond=0) + timedelta(hours=1)
+        limits = {"key1": (2, resetAt), "key2": (1, resetAt)}
+
+        async def get_resource_limit_async(sess, key):
+            return limits[key]
+
+        with tempfile.NamedTemporaryFile('w', suffix=".txt", delete=False) as f:
+            f.write("\n".join(limits))
+        with patch.object(GithubKeyGen, "get_resource_limit_async", staticmethod(get_resource_limit_async)):
+            redis.Redis(host="localhost").delete(
+                "test-githubkey:remain", "test-githubkey:reset", "test-githubkey:limit", "test-githubkey:observed")
+            github1 = RedisGithubKeyGen(f.name, namespace="test-githubkey", host="localhost")
+            github2 = RedisGithubKeyGen(f.name, namespace="test-githubkey", host="localhost")
+        os.remove(f.name)
+
+        loop = asyncio.new_event_loop()
+        keys = [loop.run_until_complete(github.get_async()) for github in (github1, github2, github1)]
+        self.assertListEqual(sorted(keys), ["key1", "key1", "key2"])
+        self.assertEqual(len(github2), 0)
+
+        loop.run_until_complete(github2.release_async("key1"))
+        self.assertEqual(len(github1), 1)
+
+        # 폐기된 키는 모든 프로세스에서 할당하지 않고, 늦게 도착한 응답으로도 다시 반영하지 않음
+        loop.run_until_complete(github1.revoke_async("key1"))
+        loop.run_until_complete(github2.set_async("key1", 100, resetAt))
+        loop.run_until_complete(github2.release_async("key1"))
+        self.assertEqual(len(github2), 0)
+        self.assertEqual(github2.rq.zscore("test-githubkey:remain", github2.key_id("key1")), None)
+        loop.run_until_complete(github1.close())
+        loop.run_until_complete(github2.close())
+        loop.close()
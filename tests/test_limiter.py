@@ -0,0 +1,40 @@
+"""
+Copyright 2020, All rights reserved.
+Author : SangJae Kang
+Mail : craftsangjae@gmail.com
+"""
+import unittest
+from service.limiter import AdaptiveLimiter
+
+
+class TestAdaptiveLimiter(unittest.TestCase):
+    def test_increase_while_healthy(self):
+        limiter = AdaptiveLimiter(initial_limit=10, max_limit=20)
+        for _ in range(1000):
+            limiter.on_success(0.1)
+        self.assertEqual(limiter.limit, 20)
+
+    def test_decrease_on_high_latency(self):
+        limiter = AdaptiveLimiter(initial_limit=10)
+        for _ in range(10):
+            limiter.on_success(0.1)
+        prev = limiter.limit
+        for _ in range(50):
+            limiter.on_success(1.)
+        self.assertLess(limiter.limit, prev)
+
+    def test_backoff_on_overload(self):
+        limiter = AdaptiveLimiter(initial_limit=40, min_limit=5, cooldown=60.)
+        limiter.on_overload()
+        self.assertEqual(limiter.limit, 20)
+
+        # cooldown 안의 실패는 한 번만 반영
+        limiter.on_overload()
+        self.assertEqual(limiter.limit, 20)
+        self.assertEqual(limiter.num_overloaded, 2)
+
+        limiter.last_backoff = float('-inf')
+        limiter.on_overload()
+        limiter.last_backoff = float('-inf')
+        limiter.on_overload()
+        self.assertEqual(limiter.limit, 5)
@@ -0,0 +1,124 @@
+"""
+Copyright 2020, All rights reserved.
+Author : SangJae Kang
+Mail : craftsangjae@gmail.com
+"""
+import os
+import gzip
+import json
+import asyncio
+import tempfile
+import unittest
+from service.consumer import BaseConsumer
+from service.loader import SeedLoader, BloomFilter, parse_seed
+
+
+class ListBroker(BaseConsumer):
+    def __init__(self):
+        self.messages = []
+
+    def put(self, element):
+        self.messages.append(element)
+
+    def get(self):
+        return None
+
+    def __len__(self):
+        return len(self.messages)
+
+    def isEmpty(self):
+        return not self.messages
+
+    def deleteAll(self):
+        self.messages.clear()
+
+
+class TestSeedLoader(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, "seeds.jsonl.gz")
+        with gzip.open(self.path, 'wt') as f:
+            for i in range(100):
+                f.write(json.dumps({"owner": "benfred", "name": f"repo{i}"}) + "\n")
+            f.write(json.dumps({"owner": "benfred", "name": "repo0"}) + "\n")
+            f.write("not json\n")
+            f.write(json.dumps({"id": "56417681"}) + "\n")
+
+    def test_parse_seed(self):
+        self.assertEqual(parse_seed('{"owner": "benfred", "name": "implicit", "x": 1}'),
+                         {"owner": "benfred", "name": "implicit"})
+        self.assertEqual(parse_seed('{"id": "56417681"}'), {"id": 56417681})
+        self.assertIsNone(parse_seed('{"owner": "bad owner", "name": "implicit"}'))
+        self.assertIsNone(parse_seed('{"id": -1}'))
+        self.assertIsNone(parse_seed('[1, 2]'))
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        self.assertFalse(bloom.add("benfred/implicit"))
+        self.assertTrue(bloom.add("benfred/implicit"))
+        self.assertEqual(bloom.count, 1)
+
+    def test_load_and_resume(self):
+        checkpoint = os.path.join(self.root, "seeds.offset")
+        loop = asyncio.new_event_loop()
+        try:
+            broker = ListBroker()
+            loader = SeedLoader(broker, batch_size=30, checkpoint=checkpoint)
+            stats = loop.run_until_complete(loader.load(self.path))
+            self.assertEqual(len(broker.messages), 101)
+            self.assertEqual((stats['duplicate'], stats['invalid']), (1, 1))
+            self.assertEqual(broker.messages[-1], {"id": 56417681})
+
+            # 중간 위치부터 다시 load하면 그 이후의 메시지만 담음
+            with open(checkpoint, 'w') as f:
+                f.write(str(sum(len(json.dumps({"owner": "benfred", "name": f"repo{i}"})) + 1 for i in range(90))))
+            broker = ListBroker()
+            loader = SeedLoader(broker, batch_size=30, checkpoint=checkpoint)
+            loop.run_until_complete(loader.load(self.path, offset=loader.resume_offset()))
+            self.assertEqual(broker.messages[0], {"owner": "benfred", "name": "repo90"})
+            self.assertEqual(len(broker.messages), 12)
+        finally:
+            loop.close()
+
+    def test_confirm_false_positive(self):
+        loop = asyncio.new_event_loop()
+        try:
+            broker = ListBroker()
+            loader = SeedLoader(broker, batch_size=30, topic="seeds", host="localhost", port="6379", db="0")
+            arq = loader.get_async_client()
+            loop.run_until_complete(arq.delete("seeds"))
+            loop.run_until_complete(arq.sadd("seeds", "benfred/repo0"))
+
+            # bloom filter가 모두 있다고 답해도, 담은 적 없는 리파짓토리는 담음
+            messages, _ = loop.run_until_complete(loader.confirm(
+                [({"owner": "benfred", "name": "repo0"}, "benfred/repo0", True),
+                 ({"owner": "benfred", "name": "new"}, "benfred/new", True)]))
+            self.assertListEqual(messages, [{"owner": "benfred", "name": "new"}])
+            self.assertEqual((loader.stats['duplicate'], loader.stats['false_positive']), (1, 1))
+            loop.run_until_complete(loader.close())
+        finally:
+            loop.close()
+
+    def test_resume_with_seed_set(self):
+        loop = asyncio.new_event_loop()
+        try:
+            # checkpoint를 기록하기 전에 중단되어, checkpoint 이후의 repo90 ~ repo94는 이미 담은 상태
+            broker = ListBroker()
+            loader = SeedLoader(broker, batch_size=30, topic="seeds", host="localhost", port="6379", db="0")
+            arq = loader.get_async_client()
+            loop.run_until_complete(arq.delete("seeds"))
+            loop.run_until_complete(arq.sadd("seeds", *[f"benfred/repo{i}" for i in range(95)]))
+
+            offset = sum(len(json.dumps({"owner": "benfred", "name": f"repo{i}"})) + 1 for i in range(90))
+            stats = loop.run_until_complete(loader.load(self.path, offset=offset))
+            self.assertEqual(broker.messages[0], {"owner": "benfred", "name": "repo95"})
+            self.assertEqual((len(broker.messages), stats['duplicate']), (6, 6))
+
+            # 끝까지 담으면 담은 기록을 지움
+            self.assertEqual(loop.run_until_complete(arq.exists("seeds")), 0)
+            loop.run_until_complete(loader.close())
+        finally:
+            loop.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+"""
+Copyright 2020, All rights reserved.
+Author : SangJae Kang
+Mail : craftsangjae@gmail.com
+"""
+import unittest
+from service.metrics import Histogram, sample
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram(buckets=(0.1, 1.))
+        for value in (0.05, 0.1, 0.5, 3.):
+            histogram.observe(value)
+
+        lines = histogram.render("latency", {"stage": "fetch"})
+        self.assertEqual(lines, [
+            'latency_bucket{stage="fetch",le="0.1"} 2.0',
+            'latency_bucket{stage="fetch",le="1.0"} 3.0',
+            'latency_bucket{stage="fetch",le="+Inf"} 4.0',
+            'latency_sum{stage="fetch"} 3.65',
+            'latency_count{stage="fetch"} 4.0',
+        ])
+
+    def test_sample_escapes_label_values(self):
+        self.assertEqual(sample("events", {"event": 'a"b\\c'}, 3), 'events{event="a\\"b\\\\c"} 3.0')
+        self.assertEqual(sample("lag", None, 0.5), 'lag 0.5')
+
+
+if __name__ == '__main__':
+    unittest.main()
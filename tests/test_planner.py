@@ -0,0 +1,67 @@
+"""
+Copyright 2020, All rights reserved.
+Author : SangJae Kang
+Mail : craftsangjae@gmail.com
+"""
+import asyncio
+import unittest
+from datetime import datetime, timedelta
+from dateutil.tz import tzutc
+from service.planner import BudgetPlanner
+from service.query import MAX_BATCH_SIZE
+
+
+class FakeKeyPool:
+    def __init__(self, budget):
+        self.budget = budget
+
+    async def budget_async(self):
+        return self.budget
+
+
+class TestBudgetPlanner(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.now = datetime.now(tz=tzutc())
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_surplus(self):
+        keys = FakeKeyPool([
+            # window의 절반이 지났지만 할당량을 거의 쓰지 않은 키 : 절반만큼 쓸 수 있음
+            (4900, 5000, self.now + timedelta(minutes=30)),
+            # 이미 계획보다 많이 쓴 키
+            (1000, 5000, self.now + timedelta(minutes=30)),
+        ])
+        planner = BudgetPlanner(keys, burst=0.)
+        self.loop.run_until_complete(planner.refresh())
+        self.assertAlmostEqual(planner.surplus, 2400, delta=5)
+        self.assertAlmostEqual(planner.rate, 10000 / 3600)
+
+    def test_pace_and_observe(self):
+        keys = FakeKeyPool([(5000, 5000, self.now + timedelta(hours=1))])
+        planner = BudgetPlanner(keys, burst=0.001, refresh_interval=0.05)
+        shape = ("batch", 50)
+
+        # 처음에는 최소 cost로 예약
+        self.assertEqual(self.loop.run_until_complete(planner.pace(shape)), 1)
+        planner.observe(shape, 3)
+        self.assertEqual(planner.expected_cost(shape), 3)
+
+        # surplus(5)를 넘게 쓰면 기다림
+        self.assertEqual(self.loop.run_until_complete(planner.pace(shape)), 3)
+        self.assertEqual(planner.num_throttled, 0)
+        self.loop.run_until_complete(asyncio.wait_for(planner.pace(shape), 5))
+        self.assertGreater(planner.num_throttled, 0)
+
+    def test_batch_size(self):
+        planner = BudgetPlanner(FakeKeyPool([]))
+        self.assertEqual(planner.batch_size(10), 10)
+
+        # 할당량이 부족하면 리파짓토리 당 cost가 가장 작은 배치 크기
+        planner.throttled_at = float('inf')
+        self.assertEqual(planner.batch_size(10), MAX_BATCH_SIZE)
+        planner.observe(("batch", 10), 1)
+        planner.observe(("batch", MAX_BATCH_SIZE), 20)
+        self.assertEqual(planner.batch_size(10), 10)
@@ -0,0 +1,34 @@
+"""
+Copyright 2020, All rights reserved.
+Author : SangJae Kang
+Mail : craftsangjae@gmail.com
+"""
+import unittest
+from service.priority import CrawlPriority, to_timestamp
+
+
+class TestCrawlPriority(unittest.TestCase):
+    def setUp(self):
+        self.priority = CrawlPriority()
+        self.crawled_at = to_timestamp("2020-05-01T00:00:00Z")
+
+    def document(self, stars, forks, pushed_at):
+        return {"crawledAt": "2020-05-01T00:00:00Z", "pushedAt": pushed_at,
+                "stargazers": stars, "forkCount": forks}
+
+    def test_never_crawled_first(self):
+        self.assertEqual(self.priority.score({}), 0.)
+        self.assertEqual(self.priority.score({"stargazers": 100000}), 0.)
+
+    def test_popular_and_active_first(self):
+        popular = self.priority.score(self.document(100000, 20000, "2020-04-30T00:00:00Z"))
+        active = self.priority.score(self.document(50, 3, "2020-04-30T00:00:00Z"))
+        dormant = self.priority.score(self.document(50, 3, "2017-04-30T00:00:00Z"))
+        abandoned = self.priority.score(self.document(0, 0, "2017-04-30T00:00:00Z"))
+        self.assertLess(popular, active)
+        self.assertLess(active, dormant)
+        self.assertLess(dormant, abandoned)
+
+        # refresh 주기는 min_interval ~ max_interval
+        self.assertGreaterEqual(popular - self.crawled_at, self.priority.min_interval)
+        self.assertEqual(abandoned - self.crawled_at, self.priority.max_interval)
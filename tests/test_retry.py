@@ -0,0 +1,55 @@
+"""
+Copyright 2020, All rights reserved.
+Author : SangJae Kang
+Mail : craftsangjae@gmail.com
+"""
+import asyncio
+import unittest
+from service.retry import RetryPolicy, classify_exception, classify_response
+from service.retry import RETRYABLE, QUOTA, NOT_FOUND, FATAL, RETRY, DEAD, DROP
+
+
+class TestRetry(unittest.TestCase):
+    def test_classify_exception(self):
+        self.assertEqual(classify_exception(asyncio.TimeoutError()), RETRYABLE)
+        self.assertEqual(classify_exception(ConnectionAbortedError("502")), RETRYABLE)
+        self.assertEqual(classify_exception(ConnectionRefusedError("403")), QUOTA)
+        self.assertEqual(classify_exception(KeyError("id")), FATAL)
+
+    def test_classify_response(self):
+        query = {
+            "data": {"r0": None, "r1": None, "r2": None},
+            "errors": [
+                {"type": "NOT_FOUND", "path": ["r0"], "message": "Could not resolve to a Repository"},
+                {"type": "INTERNAL", "path": ["r1"], "message": "Something went wrong"},
+            ]
+        }
+        self.assertEqual(classify_response(query, alias="r0"), NOT_FOUND)
+        self.assertEqual(classify_response(query, alias="r1"), RETRYABLE)
+        self.assertEqual(classify_response(query, alias="r2"), NOT_FOUND)
+
+        nodes = {"data": {"nodes": [None]},
+                 "errors": [{"type": "FORBIDDEN", "path": ["nodes", 0], "message": "forbidden"}]}
+        self.assertEqual(classify_response(nodes, index=0), FATAL)
+
+        self.assertEqual(classify_response({"errors": [{"type": "RATE_LIMITED", "message": "limit"}]}), QUOTA)
+        self.assertEqual(classify_response({"message": "Bad credentials"}), RETRYABLE)
+
+    def test_retry_policy(self):
+        policy = RetryPolicy(max_attempts=3, base_delay=10., quota_delay=100., max_delay=150.)
+        message = {"owner": "tensorflow", "name": "tensorflow"}
+
+        self.assertEqual(policy.decide(dict(message), NOT_FOUND), (DROP, None))
+        self.assertEqual(policy.decide(dict(message), FATAL), (DEAD, None))
+
+        action, delay = policy.decide(message, RETRYABLE)
+        self.assertEqual(action, RETRY)
+        self.assertTrue(5. <= delay <= 10.)
+        self.assertEqual(message['_attempts'], 1)
+
+        action, delay = policy.decide(message, QUOTA)
+        self.assertEqual(action, RETRY)
+        self.assertTrue(75. <= delay <= 150.)
+
+        # max_attempts번 실패하면 dead-letter로
+        self.assertEqual(policy.decide(message, RETRYABLE), (DEAD, None))
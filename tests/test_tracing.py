@@ -0,0 +1,70 @@
+"""
+Copyright 2020, All rights reserved.
+Author : SangJae Kang
+Mail : craftsangjae@gmail.com
+"""
+import os
+import time
+import json
+import tempfile
+import threading
+import unittest
+from service.tracing import Tracer, SamplingProfiler, summarize
+
+
+class TestTracer(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "trace.jsonl")
+
+    def test_trace_is_recorded_after_last_release(self):
+        tracer = Tracer(self.path, sample_rate=1.)
+        trace = tracer.begin("crawl_batch", [{"owner": "benfred", "name": "implicit"}, {"id": 1}])
+        start = time.monotonic()
+        trace.span("fetch", start)
+
+        # 저장을 기다리는 document가 남아있으면 기록하지 않음
+        trace.retain()
+        trace.release()
+        self.assertEqual(tracer.num_traces, 0)
+        trace.span("write", start, batch=2)
+        trace.release()
+        tracer.close()
+
+        with open(self.path) as f:
+            record = json.loads(f.readline())
+        self.assertEqual(record["kind"], "crawl_batch")
+        self.assertEqual(record["keys"], ["benfred/implicit", "id:1"])
+        self.assertEqual([span["stage"] for span in record["spans"]], ["fetch", "write"])
+        self.assertEqual(set(summarize(self.path)), {"fetch", "write"})
+
+    def test_not_sampled(self):
+        tracer = Tracer(self.path, sample_rate=0.)
+        self.assertIsNone(tracer.begin("crawl", [{"id": 1}]))
+
+
+class TestSamplingProfiler(unittest.TestCase):
+    def test_collapsed_stacks(self):
+        path = os.path.join(tempfile.mkdtemp(), "profile.folded")
+        stopped = threading.Event()
+
+        def busy_loop():
+            while not stopped.is_set():
+                sum(range(1000))
+
+        thread = threading.Thread(target=busy_loop)
+        thread.start()
+        profiler = SamplingProfiler(path, duration=0.2, interval=0.001)
+        profiler.start(thread.ident)
+        profiler.thread.join()
+        stopped.set()
+        thread.join()
+
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all("test_tracing.py:busy_loop" in line for line in lines))
+        self.assertTrue(all(line.rsplit(" ", 1)[1].isdigit() for line in lines))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,13 +3,16 @@ Copyright 2020, All rights reserved.
 Author : SangJae Kang
 Mail : craftsangjae@gmail.com
 """
+import time
 import asyncio
 import unittest
 from service.github import GithubKeyGen
 from service.consumer import RedisQueue
-from service.database import MongoDatabase
+from service.consumer import BaseConsumer
+from service.database import MongoDatabase, BaseDatabase
 from service.document import parse_repository
 from service.worker import RepositoryCrawler
+from service.retry import RetryPolicy
 
 
 class TestConsumerMethods(unittest.TestCase):
@@ -44,4 +47,123 @@ class TestConsumerMethods(unittest.TestCase):
 
         with self.assertRaises(ValueError):
             document = loop.run_until_complete(self.worker.get_repository_info_by_name_and_owner("implasdsicit", "benfred", self.api_key))
-            print(parse_repository(document))
\ No newline at end of file
+            print(parse_repository(document))
+
+
+class FakeBroker(BaseConsumer):
+    def __init__(self):
+        self.acked, self.retried = [], []
+
+    def put(self, element):
+        pass
+
+    def get(self):
+        return None
+
+    def __len__(self):
+        return 0
+
+    def isEmpty(self):
+        return True
+
+    def deleteAll(self):
+        pass
+
+    def ack(self, message):
+        self.acked.append(message)
+
+    def retry(self, message, delay):
+        self.retried.append(message)
+
+
+class FakeDatabase(BaseDatabase):
+    def __init__(self):
+        self.writes = []
+
+    async def put(self, document):
+        pass
+
+    async def put_many(self, documents):
+        self.writes.append(len(documents))
+        return [IOError("fail") if document['id'] == 'bad' else None for document in documents]
+
+
+class TimeoutKeyGen(object):
+    async def get_async(self, cost=1):
+        raise asyncio.TimeoutError()
+
+
+class RevokedKeyGen(object):
+    def __init__(self):
+        self.released, self.revoked = [], []
+
+    async def get_async(self, cost=1):
+        return "key"
+
+    async def release_async(self, key, cost=1):
+        self.released.append(key)
+
+    async def revoke_async(self, key):
+        self.revoked.append(key)
+
+
+class TestPipeline(unittest.TestCase):
+    def test_fetch_failure_retries_messages(self):
+        broker = FakeBroker()
+        worker = RepositoryCrawler(broker, FakeDatabase(), TimeoutKeyGen(), retry_policy=RetryPolicy(base_delay=0.))
+        message = {"owner": "tensorflow", "name": "tensorflow"}
+
+        async def run():
+            worker.fetch_queue = asyncio.Queue()
+            worker.unsettled.add(id(message))
+            await worker.fetch_queue.put((worker.crawl, message, None, time.monotonic()))
+            fetcher = asyncio.ensure_future(worker.fetch_forever())
+            await worker.fetch_queue.join()
+            fetcher.cancel()
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(run())
+        finally:
+            loop.close()
+
+        # 키를 기다리다 timeout 되더라도 메시지를 잃지 않고 재시도
+        self.assertEqual(broker.retried, [{"owner": "tensorflow", "name": "tensorflow", "_attempts": 1}])
+        self.assertEqual(worker.stats['error:retryable'], 1)
+        self.assertFalse(worker.unsettled)
+
+    def test_revoked_key(self):
+        broker, githubkey = FakeBroker(), RevokedKeyGen()
+        worker = RepositoryCrawler(broker, FakeDatabase(), githubkey, retry_policy=RetryPolicy(base_delay=0.))
+
+        async def get_repository_info_by_name_and_owner(name, owner, api_key, trace=None):
+            raise PermissionError("401 - bad credentials")
+
+        worker.get_repository_info_by_name_and_owner = get_repository_info_by_name_and_owner
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(worker.crawl({"owner": "tensorflow", "name": "tensorflow"}))
+        finally:
+            loop.close()
+
+        # 폐기된 키는 돌려주지 않고 pool에서 제외하며, 메시지는 다른 키로 재시도
+        self.assertEqual((githubkey.revoked, githubkey.released), (["key"], []))
+        self.assertEqual(broker.retried, [{"owner": "tensorflow", "name": "tensorflow", "_attempts": 1}])
+
+    def test_store_writes_once_and_acks_per_document(self):
+        broker, database = FakeBroker(), FakeDatabase()
+        worker = RepositoryCrawler(broker, database, None, retry_policy=RetryPolicy(base_delay=0.))
+        items = [({"name": str(i)}, {"id": str(i)}) for i in range(3)]
+        items.append(({"name": "bad"}, {"id": "bad"}))
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(worker.store(items))
+        finally:
+            loop.close()
+
+        self.assertEqual(database.writes, [4])
+        self.assertEqual(len(broker.acked), 3)
+        self.assertEqual(broker.retried, [{"name": "bad", "_attempts": 1}])
+        self.assertTrue(all('crawledAt' in document for _, document in items))